@@ -1,16 +1,10 @@
 import streamlit as st
-import os
-from PyPDF2 import PdfReader
-from docx import Document
-from io import BytesIO
-import re
-import hashlib
-from typing import TypedDict, Optional, List, Dict
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langgraph.graph import StateGraph, END
-from rag_pipeline import run_rag_pipeline
-from database import init_db, login_user, register_user, save_quiz, get_quiz_history
-from docx import Document as DocxDocument
+import uuid
+from typing import List, Dict
+from database import (init_db, login_user, register_user, get_quiz_summaries, get_quiz,
+                      search_questions, HISTORY_PAGE_SIZE)
+from quiz_nodes import (QUIZ_SERVICE_URL, display_quiz_node, generate_via_service, get_llm, input_hash,
+                        run_quiz_graph, start_metrics_server, upload_node)
 
 # ------------------- Session State Initialization -------------------
 if "user" not in st.session_state:
@@ -19,6 +13,12 @@ if "quiz_data" not in st.session_state:
     st.session_state.quiz_data = []
 if "use_text" not in st.session_state:
     st.session_state.use_text = False
+if "history_summaries" not in st.session_state:
+    st.session_state.history_summaries = None  # loaded pages of quiz summaries; None = reload
+    st.session_state.history_has_more = False
+    st.session_state.history_bodies = {}  # quiz id -> quiz_data, fetched when an entry is opened
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex  # keys this session's graph checkpoints
 if "current_step" not in st.session_state:
     st.session_state.current_step = "upload_node"
 if "state" not in st.session_state:
@@ -29,23 +29,22 @@ if "state" not in st.session_state:
         "manual_topic": "",
         "file_hash": "",
         "quiz_data": [],
-        "num_mcqs": 5
+        "num_mcqs": 5,
+        "regenerate": False
     }
 
-# ------------------- LLM Setup -------------------
-google_api_key = os.environ.get("GOOGLE_API_KEY")
-try:
-    llm = ChatGoogleGenerativeAI(
-        model="gemini-2.5-flash",
-        google_api_key=google_api_key
-    )
-except Exception:
-    st.error("⚠️ GOOGLE_API_KEY not found. LLM features disabled.")
-    llm = None
+# ------------------- Cached Setup -------------------
+@st.cache_resource(show_spinner=False)
+def init_db_once():
+    """Schema check and migrations run once per process, not on every rerun."""
+    init_db()
+    return True
+
 
 # ------------------- Streamlit Page & Custom Styling -------------------
 st.set_page_config(page_title="🧠 AI Quiz Generator", layout="wide")
-init_db()
+init_db_once()
+start_metrics_server()
 
 # =========================
 # 🔥 UPDATED SIDEBAR + UI
@@ -265,6 +264,8 @@ if st.session_state.user:
     if st.sidebar.button("🚪 Logout"):
         st.session_state.user = None
         st.session_state.quiz_data = []
+        st.session_state.history_summaries = None
+        st.session_state.history_bodies = {}
         st.session_state.current_step = "upload_node"
         st.rerun()
 else:
@@ -276,8 +277,9 @@ else:
             user = login_user(username, password)
             if user:
                 st.session_state.user = user
-                # Fetch history upon successful login
-                st.session_state.quiz_data = get_quiz_history(user["id"]) or []
+                # History summaries are fetched lazily by the sidebar
+                st.session_state.history_summaries = None
+                st.session_state.history_bodies = {}
                 st.rerun()
             else:
                 st.sidebar.error("Invalid username or password.")
@@ -292,28 +294,56 @@ else:
                 st.sidebar.error("Username already exists.")
 
 # ------------------- Sidebar: Quiz History -------------------
+def load_history_page():
+    """Append the next page of summaries (keyset-paginated on quiz id) to the session."""
+    summaries = st.session_state.history_summaries or []
+    before_id = summaries[-1]["id"] if summaries else None
+    page = get_quiz_summaries(st.session_state.user["id"], limit=HISTORY_PAGE_SIZE + 1, before_id=before_id)
+    st.session_state.history_has_more = len(page) > HISTORY_PAGE_SIZE
+    st.session_state.history_summaries = summaries + page[:HISTORY_PAGE_SIZE]
+
+
+def render_history_quiz(quiz_data: List[Dict]):
+    # One markdown call per quiz instead of several per question
+    lines = []
+    for q_num, q in enumerate(quiz_data, 1):
+        lines.append(f"<p style='text-align:left; margin-bottom: 2px;'><b>Q{q_num}. {q['question']}</b></p>")
+        for label in ("A", "B", "C", "D"):
+            lines.append(f"<p style='font-size:0.8em; text-align:left; margin-bottom: 0;'>"
+                         f"{label}) {q['options'][label]}</p>")
+        lines.append(f"<p style='text-align:left;'><b>Answer:</b> {q['answer']}</p>")
+    st.markdown("".join(lines), unsafe_allow_html=True)
+
+
 if st.session_state.user:
     with st.sidebar.expander("📜 Quiz History", expanded=False):
-        history = get_quiz_history(st.session_state.user["id"])
-        if not history:
+        search_text = st.text_input("🔎 Search my questions", key="history_search")
+        if search_text.strip():
+            matches = search_questions(search_text, user_id=st.session_state.user["id"])
+            if matches:
+                render_history_quiz(matches)
+            else:
+                st.info("No matching questions.")
+            st.markdown("---")
+
+        if st.session_state.history_summaries is None:
+            load_history_page()
+        summaries = st.session_state.history_summaries
+        if not summaries:
             st.info("No quizzes yet.")
         else:
-            # Display history in a compact, readable format
-            for idx, entry in enumerate(history, 1):
-                st.markdown(f"**Quiz {idx}** - {entry['created_at']}")
-                for q_num, q in enumerate(entry["quiz_data"], 1):
-                    # Use a smaller font for options in the sidebar history
-                    st.markdown(f"Q{q_num}. {q['question']}")
-                    st.markdown(f"<p style='font-size:0.8em; margin-bottom: 0;'>A) {q['options']['A']}</p>",
-                                unsafe_allow_html=True)
-                    st.markdown(f"<p style='font-size:0.8em; margin-bottom: 0;'>B) {q['options']['B']}</p>",
-                                unsafe_allow_html=True)
-                    st.markdown(f"<p style='font-size:0.8em; margin-bottom: 0;'>C) {q['options']['C']}</p>",
-                                unsafe_allow_html=True)
-                    st.markdown(f"<p style='font-size:0.8em; margin-bottom: 0;'>D) {q['options']['D']}</p>",
-                                unsafe_allow_html=True)
-                    st.markdown(f"**Answer:** {q['answer']}")
-                st.markdown("---")
+            for entry in summaries:
+                label = f"{entry['created_at']} · {entry['num_questions']} Qs · {entry['title'][:40]}"
+                # Bodies are only fetched and drawn for entries the user opens
+                if st.checkbox(label, key=f"history_{entry['id']}"):
+                    bodies = st.session_state.history_bodies
+                    if entry["id"] not in bodies:
+                        bodies[entry["id"]] = get_quiz(st.session_state.user["id"], entry["id"]) or []
+                    render_history_quiz(bodies[entry["id"]])
+                    st.markdown("---")
+            if st.session_state.history_has_more and st.button("Load older quizzes"):
+                load_history_page()
+                st.rerun()
 
 # ------------------- Main App -------------------
 if st.session_state.user:
@@ -321,220 +351,8 @@ if st.session_state.user:
     st.markdown("<h1>🧠 AI Quiz Generator</h1>", unsafe_allow_html=True)
     st.markdown("<p>Upload a PDF/DOCX or type a topic to generate MCQs (Documents are saved per user)</p>",
                 unsafe_allow_html=True)
-
-
-    class QuizState(TypedDict, total=False):
-        file: Optional[any]
-        raw_text: str
-        context_text: str
-        manual_topic: str
-        file_hash: str
-        quiz_data: List[Dict]
-        num_mcqs: int
-
-
-    graph = StateGraph(QuizState)
-
-
-    # ------------------- Upload Node -------------------
-    def upload_node(state: QuizState) -> QuizState:
-        def toggle_use_text():
-            st.session_state.use_text = not st.session_state.use_text
-
-        # Keep the checkbox in the correct location
-        use_text = st.checkbox("Or type a topic manually", value=st.session_state.use_text, on_change=toggle_use_text)
-        file = None
-        text_input = ""
-
-        if not st.session_state.use_text:
-            file = st.file_uploader("📂 Upload PDF or DOCX", type=["pdf", "docx"])
-        else:
-            text_input = st.text_area("Enter topic or text", height=150, key="manual_text_input")
-
-        num_mcqs = st.number_input("Number of MCQs", 1, 50, state.get("num_mcqs", 5), 1)
-        return {"file": file, "manual_topic": text_input, "num_mcqs": int(num_mcqs)}
-
-
-    # ------------------- Extract Text Node -------------------
-    def extract_text_node(state: QuizState) -> QuizState:
-        file = state.get("file")
-        manual_topic = state.get("manual_topic", "")
-        raw_text = ""
-        file_hash = ""
-
-        if file:
-            file_bytes = file.read()
-            file_hash = hashlib.sha256(file_bytes).hexdigest()
-            file.seek(0)
-            if file.name.lower().endswith(".pdf"):
-                reader = PdfReader(file)
-                raw_text = "\n".join([p.extract_text() or "" for p in reader.pages])
-            elif file.name.lower().endswith(".docx"):
-                doc = Document(BytesIO(file_bytes))
-                raw_text = "\n".join([p.text for p in doc.paragraphs])
-        elif manual_topic:
-            raw_text = manual_topic
-            file_hash = hashlib.sha256(manual_topic.encode('utf-8')).hexdigest()
-
-        if not raw_text:
-            # Use st.warning instead of st.error here, as the graph execution might stop
-            st.warning("Please upload a file or enter a topic.")
-
-        return {
-            "file": file,
-            "raw_text": raw_text,
-            "manual_topic": manual_topic,
-            "file_hash": file_hash,
-            "num_mcqs": state.get("num_mcqs", 5)
-        }
-
-
-    # ------------------- Generate Quiz Node -------------------
-    def generate_quiz_node(state: QuizState) -> QuizState:
-
-        raw_text = state.get("raw_text", "").strip()
-        manual_topic = state.get("manual_topic", "").strip()
-        file_hash = state.get("file_hash", "manual_topic_no_hash")
-        num_mcqs = state.get("num_mcqs", 5)
-
-        if not raw_text or not llm:
-            # Use st.warning instead of st.error here, as the graph execution might stop
-            st.warning("LLM not initialized or empty input. Skipping quiz generation.")
-            return {"raw_text": raw_text, "context_text": "", "num_mcqs": num_mcqs, "quiz_data": []}
-
-        query = manual_topic if manual_topic else raw_text[:100]
-
-        # ---------------- RAG Pipeline ----------------
-        context_text = run_rag_pipeline(raw_text, query, file_hash)
-        if not context_text:
-            st.warning("RAG pipeline returned empty context. Using first 1000 chars as fallback.")
-            context_text = raw_text[:1000]
-
-        # ---------------- LLM Quiz Generation ----------------
-        prompt = f"""
-            Generate {num_mcqs} multiple-choice questions (MCQs) from the following text.
-            generate mcqs in that language which user tells you by default generate quiz in English language
-            Format each question clearly with options and mark the correct answer at the end.
-
-            CRITICAL INSTRUCTIONS:
-            1. Do NOT use phrases like "provided text," "given text," "as in the text," or "According to the text."
-            2. Instead, refer to the actual topic or subject matter.
-            3. Start directly with the first question, no extra introductory text.
-
-            Example format:
-            Q1. What is AI?
-            A) Option 1
-            B) Option 2
-            C) Option 3
-            D) Option 4
-            Answer: B
-
-        Text:
-        {context_text}
-        """
-
-        try:
-            result = llm.invoke(prompt)
-            output_text = getattr(result, "content", None) or getattr(result, "output_text", "")
-        except Exception as e:
-            st.error(f"LLM Error: {e}")
-            return {"raw_text": raw_text, "context_text": context_text, "num_mcqs": num_mcqs, "quiz_data": []}
-
-        output_text = re.sub(r'(?i)question\s*\d*[:.]', lambda m: f"Q", output_text)
-        output_text = output_text.replace("Option ", "").replace("Answer:", "Answer:")
-
-        pattern = r"""Q\d*[\.\)]?\s*([\s\S]*?)
-                      \s*A[\)\.:]\s*([\s\S]*?)
-                      \s*B[\)\.:]\s*([\s\S]*?)
-                      \s*C[\)\.:]\s*([\s\S]*?)
-                      \s*D[\)\.:]\s*([\s\S]*?)
-                      \s*Answer[:\s]*([ABCD])
-                    """
-        matches = re.findall(pattern, output_text, re.IGNORECASE | re.VERBOSE)
-
-        quiz_data = []
-        for q in matches:
-            question_text, A, B, C, D, ans = q
-            clean = lambda s: re.sub(r'\s+', ' ', s.strip())
-            quiz_data.append({
-                "question": clean(question_text),
-                "options": {"A": clean(A), "B": clean(B), "C": clean(C), "D": clean(D)},
-                "answer": ans.strip().upper()
-            })
-
-        if not quiz_data:
-            st.warning(
-                "⚠️ The model returned text but the format was unclear. Try shortening or simplifying your input.")
-
-        return {"raw_text": raw_text, "context_text": context_text, "num_mcqs": num_mcqs, "quiz_data": quiz_data}
-
-
-    # ------------------- Display Quiz Node (Updated with stylish cards) -------------------
-    def display_quiz_node(state: QuizState) -> QuizState:
-        quiz_data = state.get("quiz_data", [])
-        if not quiz_data:
-            return {"quiz_data": []}
-
-        st.subheader("✅ Quiz Generated!")
-
-        # Save quiz history
-        if st.session_state.user:
-            save_quiz(st.session_state.user["id"], quiz_data)
-
-        # Display the quiz using the new custom HTML/CSS
-        st.markdown("<span style='display:none'>.</span>", unsafe_allow_html=True)
-        for i, q in enumerate(quiz_data):
-            question_text = q['question'].strip()
-            # The download button is created below, so we'll only display the Q&A here
-            st.markdown(f"""
-            <div class='quiz-card' style='animation-delay:{i * 0.2}s'>
-                <div class='quiz-question'>Q{i + 1}. {question_text}</div>
-                <div class='quiz-option'>A) {q['options']['A']}</div>
-                <div class='quiz-option'>B) {q['options']['B']}</div>
-                <div class='quiz-option'>C) {q['options']['C']}</div>
-                <div class='quiz-option'>D) {q['options']['D']}</div>
-                <div style='color: #00FFE0; margin-top: 15px; font-weight: bold;'>Correct Answer: {q['answer']}</div>
-            </div>
-            """, unsafe_allow_html=True)
-
-        st.markdown("---")
-
-        # --- Download Button ---
-        # Create Word Document
-        doc = DocxDocument()
-        doc.add_heading("AI Generated Quiz", 0)
-        doc.add_paragraph("--- ANSWER KEY ---")  # Added Answer Key section
-
-        for i, q in enumerate(quiz_data):
-            doc.add_paragraph(f"Q{i + 1}. {q['question']}")
-            for k, v in q["options"].items():
-                doc.add_paragraph(f"{k}) {v}")
-            doc.add_paragraph(f"Correct Answer: {q['answer']}\n")
-
-        buf = BytesIO()
-        doc.save(buf)
-        buf.seek(0)
-
-        # Use the standard Streamlit download button for consistency with the new style
-        st.download_button("⬇️ Download as Word", buf, "AI_Quiz.docx")
-
-        return {"quiz_data": quiz_data}
-
-
-    # ------------------- Graph Setup -------------------
-    graph.add_node("upload_node", upload_node)
-    graph.add_node("extract_text_node", extract_text_node)
-    graph.add_node("generate_quiz_node", generate_quiz_node)
-    graph.add_node("display_quiz_node", display_quiz_node)
-
-    graph.set_entry_point("upload_node")
-    graph.add_edge("upload_node", "extract_text_node")
-    graph.add_edge("extract_text_node", "generate_quiz_node")
-    graph.add_edge("generate_quiz_node", "display_quiz_node")
-    graph.add_edge("display_quiz_node", END)
-
-    # Compile the graph
-    app = graph.compile()
+    if not QUIZ_SERVICE_URL and get_llm() is None:
+        st.error("⚠️ GOOGLE_API_KEY not found. LLM features disabled.")
 
     # Run App logic
     state = st.session_state.state
@@ -552,19 +370,38 @@ if st.session_state.user:
             st.error("Please upload a file or check the box to enter a topic manually.")
         elif st.session_state.use_text and not current_topic:
             st.error("Please enter a topic or text when using the manual input option.")
+        elif QUIZ_SERVICE_URL:
+            # Thin-client mode: the quiz service's workers do the extraction, RAG and generation.
+            with st.spinner("Generating quiz on the quiz service..."):
+                try:
+                    quiz_data = generate_via_service(None if st.session_state.use_text else current_file,
+                                                     current_topic if st.session_state.use_text else "",
+                                                     updated.get("num_mcqs", 5), updated.get("regenerate", False))
+                except Exception as e:
+                    st.error(f"Quiz service error: {e}")
+                    quiz_data = []
+            if quiz_data:
+                st.session_state.quiz_data = quiz_data
+                display_quiz_node({"quiz_data": quiz_data})
+            else:
+                st.warning("⚠️ The quiz service returned no questions.")
         else:
             with st.spinner("Generating quiz... please wait"):
-                # Run the graph manually step-by-step for better Streamlit control
-                updated = extract_text_node(updated)
-                st.session_state.state = updated
-
-                if updated.get("raw_text"):
-                    updated = generate_quiz_node(updated)
-                    st.session_state.state = updated
-
-                    if updated.get("quiz_data"):
-                        display_quiz_node(updated)
-                        st.session_state.state = updated
+                # The compiled graph drives extract -> retrieve -> generate -> display and
+                # checkpoints after each node; a failed run resumes on the next click.
+                manual_topic = current_topic if st.session_state.use_text else ""
+                inputs = {
+                    "manual_topic": manual_topic,
+                    "file_hash": input_hash(None if manual_topic else current_file, manual_topic),
+                    "num_mcqs": updated.get("num_mcqs", 5),
+                    "regenerate": updated.get("regenerate", False),
+                }
+                try:
+                    result = run_quiz_graph(st.session_state.session_id, inputs,
+                                            file=None if manual_topic else current_file)
+                    st.session_state.quiz_data = result.get("quiz_data", [])
+                except Exception as e:
+                    st.error(f"LLM Error: {e}. Press Generate again to resume from the last completed step.")
 
 
 else:
@@ -0,0 +1,210 @@
+"""
+Headless bulk quiz generation, without Streamlit.
+
+    python batch_generate.py DOCS_DIR_OR_MANIFEST --num-mcqs 10 --output quizzes.jsonl
+
+The input is a directory (searched recursively for .pdf/.docx files) or a manifest
+with one document per line, either a plain path or a JSON object such as
+{"path": "week1.pdf", "num_mcqs": 20, "topic": "recursion"}.
+
+Documents are extracted on a process pool, then indexed, retrieved and sent to the
+LLM on a thread pool whose model calls are capped at --llm-concurrency. Each result
+is appended to the JSONL output as soon as it completes; re-running with the same
+output file skips documents that already succeeded, so an interrupted run resumes.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import Dict, List, Set, Tuple
+
+from quiz_generation import create_llm
+from quiz_pipeline import quiz_for_context, retrieve_for_quiz
+from text_extraction import extract_text_cached, get_extraction_cache
+
+SUPPORTED_EXTENSIONS = (".pdf", ".docx")
+DEFAULT_NUM_MCQS = 10
+
+
+# ------------------- Jobs -------------------
+def job_key(job: Dict) -> str:
+    return json.dumps([os.path.abspath(job["path"]), job["num_mcqs"], job["topic"]])
+
+
+def load_jobs(source: str, num_mcqs: int, topic: str) -> List[Dict]:
+    """Documents to process, from a directory tree or a manifest file."""
+    if os.path.isdir(source):
+        paths = []
+        for root, _, files in os.walk(source):
+            paths.extend(os.path.join(root, f) for f in files if f.lower().endswith(SUPPORTED_EXTENSIONS))
+        return [{"path": p, "num_mcqs": num_mcqs, "topic": topic} for p in sorted(paths)]
+
+    base = os.path.dirname(os.path.abspath(source))
+    jobs = []
+    with open(source, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            entry = json.loads(line) if line.startswith("{") else {"path": line}
+            jobs.append({
+                "path": os.path.join(base, entry["path"]),  # relative paths are relative to the manifest
+                "num_mcqs": int(entry.get("num_mcqs", num_mcqs)),
+                "topic": entry.get("topic", topic),
+            })
+    return jobs
+
+
+def completed_keys(output_path: str) -> Set[str]:
+    """Jobs that already have a successful record in the output file."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # a line cut short by an interrupted run
+            if record.get("status") == "ok":
+                done.add(job_key(record))
+    return done
+
+
+# ------------------- Pipeline Stages -------------------
+def _extract(path: str) -> Tuple[str, int, float]:
+    """Process-pool task: extract into the shared on-disk cache and return (file_hash, chars, seconds)."""
+    start = time.perf_counter()
+    with open(path, "rb") as f:
+        # One process per document already; do not fan each PDF out over more processes.
+        file_hash, text = extract_text_cached(os.path.basename(path), f, workers=1)
+    return file_hash, len(text), time.perf_counter() - start
+
+
+class BoundedLLM:
+    """Chat model wrapper that allows at most `limit` model calls in flight across threads."""
+
+    def __init__(self, llm, limit: int):
+        self._llm = llm
+        self._slots = threading.BoundedSemaphore(limit)
+
+    def invoke(self, prompt):
+        with self._slots:
+            return self._llm.invoke(prompt)
+
+
+def _generate(llm, job: Dict, file_hash: str, regenerate: bool) -> Dict:
+    """Thread-pool task: RAG retrieval, quiz cache lookup and generation for one document."""
+    start = time.perf_counter()
+    text = get_extraction_cache().get_text(file_hash)
+    if text is None:
+        with open(job["path"], "rb") as f:
+            file_hash, text = extract_text_cached(os.path.basename(job["path"]), f, workers=1)
+    if not text.strip():
+        raise ValueError("no text could be extracted")
+
+    context_text = retrieve_for_quiz(text, file_hash, job["num_mcqs"], job["topic"])
+    # Quizzes generated here are also served to interactive users from the quiz cache.
+    quiz_data, cached = quiz_for_context(llm, context_text, job["num_mcqs"], regenerate)
+    if not quiz_data:
+        raise ValueError("the model output contained no parseable questions")
+
+    return {"file_hash": file_hash, "quiz_data": quiz_data, "cached": cached,
+            "generate_seconds": round(time.perf_counter() - start, 3)}
+
+
+# ------------------- Runner -------------------
+def run_batch(jobs: List[Dict], output_path: str, extract_workers: int, llm_concurrency: int,
+              regenerate: bool = False) -> Dict:
+    done = completed_keys(output_path)
+    todo = [job for job in jobs if job_key(job) not in done]
+    stats = {"documents": len(jobs), "skipped": len(jobs) - len(todo), "ok": 0, "failed": 0, "questions": 0,
+             "cached": 0, "extract_seconds": 0.0, "generate_seconds": 0.0}
+    if not todo:
+        return stats
+
+    llm = BoundedLLM(create_llm(), llm_concurrency)
+    out = open(output_path, "a", encoding="utf-8")
+
+    def write(job: Dict, **fields):
+        record = {"path": os.path.abspath(job["path"]), "num_mcqs": job["num_mcqs"], "topic": job["topic"], **fields}
+        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        out.flush()
+        if record["status"] == "ok":
+            stats["ok"] += 1
+            stats["questions"] += len(record["quiz_data"])
+        else:
+            stats["failed"] += 1
+        print(f"[{stats['ok'] + stats['failed']}/{len(todo)}] {record['status']:<5} {job['path']}")
+
+    try:
+        with ProcessPoolExecutor(max_workers=extract_workers) as extract_pool, \
+                ThreadPoolExecutor(max_workers=llm_concurrency) as llm_pool:
+            pending = {extract_pool.submit(_extract, job["path"]): ("extract", job) for job in todo}
+            # Generation of a document starts as soon as its own extraction finishes,
+            # while later documents are still being extracted.
+            while pending:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    stage, job = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        write(job, status="error", stage=stage, error=str(e))
+                        continue
+                    if stage == "extract":
+                        file_hash, _, seconds = result
+                        stats["extract_seconds"] += seconds
+                        pending[llm_pool.submit(_generate, llm, job, file_hash, regenerate)] = ("generate", job)
+                    else:
+                        stats["cached"] += result["cached"]
+                        stats["generate_seconds"] += result["generate_seconds"]
+                        write(job, status="ok", **result)
+    finally:
+        out.close()
+    return stats
+
+
+def print_stats(stats: Dict, elapsed: float):
+    processed = stats["ok"] + stats["failed"]
+    print()
+    print(f"Documents:   {stats['documents']} total, {stats['skipped']} already done, "
+          f"{stats['ok']} ok, {stats['failed']} failed")
+    print(f"Questions:   {stats['questions']} ({stats['cached']} documents served from the quiz cache)")
+    print(f"Wall time:   {elapsed:.1f}s")
+    if processed and elapsed:
+        print(f"Throughput:  {processed / elapsed * 60:.1f} documents/min, "
+              f"{stats['questions'] / elapsed * 60:.1f} questions/min")
+        print(f"Avg/doc:     extract {stats['extract_seconds'] / processed:.2f}s, "
+              f"retrieve+generate {stats['generate_seconds'] / max(stats['ok'], 1):.2f}s")
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="directory of .pdf/.docx files or a manifest file")
+    parser.add_argument("--output", default="quizzes.jsonl", help="JSONL file results are appended to")
+    parser.add_argument("--num-mcqs", type=int, default=DEFAULT_NUM_MCQS)
+    parser.add_argument("--topic", default="",
+                        help="retrieval query (default: none; k-means samples chunks covering the whole document)")
+    parser.add_argument("--extract-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--llm-concurrency", type=int, default=4, help="max LLM calls in flight")
+    parser.add_argument("--regenerate", action="store_true", help="ignore the quiz cache")
+    args = parser.parse_args(argv)
+
+    jobs = load_jobs(args.source, args.num_mcqs, args.topic)
+    if not jobs:
+        print(f"No documents found in {args.source}")
+        return 1
+
+    start = time.perf_counter()
+    stats = run_batch(jobs, args.output, max(1, args.extract_workers), max(1, args.llm_concurrency),
+                      args.regenerate)
+    print_stats(stats, time.perf_counter() - start)
+    return 1 if stats["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""
+Cold-start benchmark for the Streamlit app.
+
+    python -m benchmarks.bench_startup [--repeat 5] [--repo PATH]
+
+Measures how long a fresh interpreter takes to import each app module, and, when
+streamlit is installed, how long the first script run and a rerun take in
+streamlit's AppTest harness. Pass --repo with an older checkout to compare
+against the same numbers measured there.
+"""
+import argparse
+import os
+import subprocess
+import sys
+from typing import List, Optional
+
+MODULES = ["database", "quiz_generation", "text_extraction", "rag_pipeline", "rag_system", "quiz_nodes",
+           "ai_quiz_generator"]
+
+_IMPORT_SNIPPET = """
+import sys, time
+sys.path.insert(0, {repo!r})
+start = time.perf_counter()
+try:
+    import {module}
+except BaseException as e:
+    print("error", type(e).__name__)
+else:
+    print("ok", time.perf_counter() - start)
+"""
+
+_APPTEST_SNIPPET = """
+import os, sys, time
+os.chdir({repo!r})
+sys.path.insert(0, {repo!r})
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file("ai_quiz_generator.py", default_timeout=600)
+start = time.perf_counter()
+at.run()
+first = time.perf_counter() - start
+start = time.perf_counter()
+at.run()
+print(first, time.perf_counter() - start)
+"""
+
+
+def _run(code: str) -> str:
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    lines = result.stdout.strip().splitlines()
+    return lines[-1] if lines else f"error exit {result.returncode}"
+
+
+def cold_import(repo: str, module: str, repeat: int) -> Optional[float]:
+    """Best-of-`repeat` import time of `module` in a fresh interpreter, or None if it fails to import."""
+    best = None
+    for _ in range(repeat):
+        status, value = _run(_IMPORT_SNIPPET.format(repo=repo, module=module)).split(" ", 1)
+        if status != "ok":
+            return None
+        best = float(value) if best is None else min(best, float(value))
+    return best
+
+
+def app_runs(repo: str) -> Optional[List[float]]:
+    """[first run, rerun] seconds under AppTest, or None without streamlit."""
+    try:
+        return [float(x) for x in _run(_APPTEST_SNIPPET.format(repo=repo)).split()]
+    except ValueError:
+        return None
+
+
+def _fmt(seconds: Optional[float]) -> str:
+    return f"{seconds * 1000:>10.1f}" if seconds is not None else f"{'n/a':>10}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--repo", help="older checkout to compare against")
+    args = parser.parse_args()
+
+    repos = [os.getcwd()] + ([os.path.abspath(args.repo)] if args.repo else [])
+    header = "".join(f"{'this' if i == 0 else 'other':>10}" for i in range(len(repos)))
+    print(f"{'cold import (ms)':<24}{header}")
+    for module in MODULES:
+        times = [cold_import(repo, module, args.repeat) for repo in repos]
+        print(f"{module:<24}" + "".join(_fmt(t) for t in times))
+
+    runs = [app_runs(repo) for repo in repos]
+    print()
+    print(f"{'AppTest (ms)':<24}{header}")
+    for i, label in enumerate(["first run", "rerun"]):
+        print(f"{label:<24}" + "".join(_fmt(r[i] if r else None) for r in runs))
+
+
+if __name__ == "__main__":
+    main()
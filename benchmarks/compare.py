@@ -0,0 +1,56 @@
+"""
+Compare two benchmark result files written by benchmarks.run.
+
+    python -m benchmarks.compare OLD.json NEW.json [--threshold 0.10]
+
+Prints the median time of every benchmark present in both runs and the relative
+change. Exits with status 1 if any benchmark got slower by more than --threshold.
+"""
+import argparse
+import json
+import sys
+from typing import Dict
+
+
+def load(path: str) -> Dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative slowdown counted as a regression")
+    args = parser.parse_args(argv)
+
+    old, new = load(args.old), load(args.new)
+    print(f"old: {old['commit']}{' (dirty)' if old.get('dirty') else ''}  {old['created_at']}")
+    print(f"new: {new['commit']}{' (dirty)' if new.get('dirty') else ''}  {new['created_at']}")
+    if old.get("quick") != new.get("quick"):
+        print("warning: one run used --quick and the other did not; sizes differ")
+    print()
+    print(f"{'benchmark':<32}{'old ms':>12}{'new ms':>12}{'change':>10}")
+
+    regressions = []
+    for name in sorted(set(old["results"]) | set(new["results"])):
+        before, after = old["results"].get(name, {}), new["results"].get(name, {})
+        if "median_ms" not in before or "median_ms" not in after:
+            note = (after.get("failed") and f"failed: {after['failed']}") or after.get("skipped") or before.get("skipped") or ("new" if name not in old["results"] else "removed")
+            print(f"{name:<32}{'':>12}{'':>12}  {note}")
+            continue
+        change = after["median_ms"] / before["median_ms"] - 1 if before["median_ms"] else 0.0
+        flag = ""
+        if change > args.threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<32}{before['median_ms']:>12.2f}{after['median_ms']:>12.2f}{change:>+10.1%}{flag}")
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) above {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+"""
+Deterministic local stand-ins for the Gemini chat and embedding models.
+
+Both sleep for a configurable latency per call and return output that depends only
+on their input, so benchmark runs are repeatable and need no network or API key.
+"""
+import hashlib
+import json
+import math
+import struct
+import time
+from typing import Dict, Iterator, List
+
+
+class FakeMessage:
+    """The parts of an AIMessage / AIMessageChunk the pipeline reads."""
+
+    def __init__(self, content: str, total_tokens: int = 0):
+        self.content = content
+        self.usage_metadata = {"total_tokens": total_tokens} if total_tokens else None
+
+
+def fake_questions(prompt: str, n: int) -> List[Dict]:
+    seed = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8]
+    return [{
+        "question": f"Question {i + 1} ({seed}): which statement about the context is correct?",
+        "options": {label: f"Option {label} for question {i + 1} of {seed}" for label in "ABCD"},
+        "answer": "ABCD"[i % 4],
+    } for i in range(n)]
+
+
+class FakeChatModel:
+    """
+    Stand-in for ChatGoogleGenerativeAI. Answers every prompt with `num_questions`
+    MCQs (or the count the prompt asks for) in JSON or the "Q1. ... Answer: B" text
+    format, after `latency` seconds plus `seconds_per_token` per output token.
+    """
+
+    def __init__(self, latency: float = 0.05, seconds_per_token: float = 0.0, output_format: str = "json",
+                 num_questions: int = None, chunk_chars: int = 40):
+        self.latency = latency
+        self.seconds_per_token = seconds_per_token
+        self.output_format = output_format
+        self.num_questions = num_questions
+        self.chunk_chars = chunk_chars
+        self.calls = 0
+
+    def _requested(self, prompt: str) -> int:
+        if self.num_questions:
+            return self.num_questions
+        for word in prompt.split():
+            if word.isdigit():
+                return int(word)  # "Generate 5 multiple-choice questions ..."
+        return 5
+
+    def _answer(self, prompt: str) -> str:
+        questions = fake_questions(prompt, self._requested(prompt))
+        if self.output_format == "json":
+            return json.dumps(questions, indent=2)
+        blocks = []
+        for i, q in enumerate(questions, 1):
+            options = "\n".join(f"{label}) {text}" for label, text in q["options"].items())
+            blocks.append(f"Q{i}. {q['question']}\n{options}\nAnswer: {q['answer']}\n")
+        return "\n".join(blocks)
+
+    def invoke(self, prompt) -> FakeMessage:
+        self.calls += 1
+        text = self._answer(str(prompt))
+        tokens = len(text) // 4
+        time.sleep(self.latency + tokens * self.seconds_per_token)
+        return FakeMessage(text, total_tokens=len(str(prompt)) // 4 + tokens)
+
+    def predict(self, prompt: str) -> str:
+        return self.invoke(prompt).content
+
+    def stream(self, prompt) -> Iterator[FakeMessage]:
+        self.calls += 1
+        text = self._answer(str(prompt))
+        time.sleep(self.latency)
+        per_chunk = self.chunk_chars // 4 * self.seconds_per_token
+        for i in range(0, len(text), self.chunk_chars):
+            if per_chunk:
+                time.sleep(per_chunk)
+            yield FakeMessage(text[i:i + self.chunk_chars])
+
+
+def fake_vector(text: str, dim: int) -> List[float]:
+    """Unit vector derived from the text's hash; equal texts get equal vectors."""
+    values = []
+    counter = 0
+    while len(values) < dim:
+        digest = hashlib.sha256(f"{counter}:{text}".encode("utf-8")).digest()
+        values.extend(v / 2147483648.0 for v in struct.unpack("<8i", digest))
+        counter += 1
+    values = values[:dim]
+    norm = math.sqrt(sum(v * v for v in values)) or 1.0
+    return [v / norm for v in values]
+
+
+class FakeEmbeddings:
+    """Stand-in for GoogleGenerativeAIEmbeddings: `latency` seconds per request."""
+
+    def __init__(self, dim: int = 768, latency: float = 0.02):
+        self.dim = dim
+        self.latency = latency
+        self.calls = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        time.sleep(self.latency)
+        return [fake_vector(t, self.dim) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        self.calls += 1
+        time.sleep(self.latency)
+        return fake_vector(text, self.dim)
+
+
+class FakeSentenceTransformer:
+    """Stand-in for SentenceTransformer in rag_system.RAG (`encode` only)."""
+
+    def __init__(self, dim: int = 384, seconds_per_text: float = 0.0):
+        self.dim = dim
+        self.seconds_per_text = seconds_per_text
+
+    def encode(self, texts, convert_to_numpy: bool = True):
+        import numpy as np
+
+        if self.seconds_per_text:
+            time.sleep(self.seconds_per_text * len(texts))
+        return np.asarray([fake_vector(t, self.dim) for t in texts], dtype="float32")
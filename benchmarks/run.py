@@ -0,0 +1,350 @@
+"""
+Offline benchmark suite for the quiz pipeline.
+
+    python -m benchmarks.run [--quick] [--repeat 5] [--only extract parser ...] [--output FILE]
+
+Gemini is replaced by the deterministic fakes in benchmarks/fakes.py, and every
+cache and database is created in a throwaway directory. Results are written as JSON
+to benchmarks/results/<commit>.json by default. Compare two runs with:
+
+    python -m benchmarks.compare benchmarks/results/OLD.json benchmarks/results/NEW.json
+
+Benchmarks whose dependencies are not installed are recorded as skipped. A group
+that raises is recorded as failed, the remaining groups still run, and the exit
+status is 1.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Tuple
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+
+# (name, params, seconds per repetition)
+Result = Tuple[str, Dict, List[float]]
+
+
+def timed(fn: Callable[[], object], repeat: int, setup: Callable[[], None] = None) -> List[float]:
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+# ------------------- Synthetic Documents -------------------
+WORDS = ("photosynthesis converts light energy into chemical energy stored in glucose while mitochondria "
+         "release that energy through cellular respiration producing carbon dioxide water and ATP").split()
+
+
+def synthetic_text(num_words: int, seed: int = 0) -> str:
+    words = [WORDS[(i * 7 + seed) % len(WORDS)] for i in range(num_words)]
+    for i in range(12, len(words), 13):
+        words[i] += "."
+    return " ".join(words)
+
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def make_pdf(num_pages: int, lines_per_page: int = 40) -> bytes:
+    """A minimal valid PDF with `lines_per_page` lines of Helvetica text per page."""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for p in range(num_pages):
+        lines = [synthetic_text(12, seed=p * lines_per_page + i) for i in range(lines_per_page)]
+        stream = "BT /F1 10 Tf 14 TL 40 800 Td " + " ".join(f"({_pdf_escape(l)}) Tj T*" for l in lines) + " ET"
+        stream = stream.encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        content_id = len(objects)
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id)
+        page_ids.append(len(objects))
+    kids = " ".join(f"{i} 0 R" for i in page_ids).encode()
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, num_pages)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (i, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % o for o in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def make_docx(num_paragraphs: int) -> bytes:
+    from io import BytesIO
+    from docx import Document
+
+    doc = Document()
+    for i in range(num_paragraphs):
+        doc.add_paragraph(synthetic_text(60, seed=i))
+    buf = BytesIO()
+    doc.save(buf)
+    return buf.getvalue()
+
+
+# ------------------- Benchmarks -------------------
+def bench_extract(quick: bool, repeat: int) -> Iterator[Result]:
+    """Text extraction (extract_text_cached, as used by extract_text_node), cold and warm cache."""
+    from io import BytesIO
+    import text_extraction
+
+    def run(name: str, file_name: str, data: bytes, params: Dict):
+        counter = [0]
+
+        def fresh_cache():
+            counter[0] += 1
+            text_extraction._cache = text_extraction.ExtractionCache(f"extract_cache_{name}_{counter[0]}")
+
+        def extract():
+            text_extraction.extract_text_cached(file_name, BytesIO(data))
+
+        yield f"{name}_cold", params, timed(extract, repeat, setup=fresh_cache)
+        yield f"{name}_warm", params, timed(extract, repeat)
+
+    for pages in ([10, 50] if quick else [10, 50, 200]):
+        yield from run(f"extract_pdf_{pages}p", "doc.pdf", make_pdf(pages), {"pages": pages})
+    for paragraphs in ([100] if quick else [100, 1000]):
+        yield from run(f"extract_docx_{paragraphs}par", "doc.docx", make_docx(paragraphs),
+                       {"paragraphs": paragraphs})
+
+
+def bench_chunking(quick: bool, repeat: int) -> Iterator[Result]:
+    from langchain_core.documents import Document
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200,
+                                              separators=["\n\n", "\n", ".", "!", "?", ",", " ", ""],
+                                              add_start_index=True)
+    for words in ([20_000] if quick else [20_000, 200_000]):
+        doc = Document(page_content=synthetic_text(words), metadata={"file_hash": "bench"})
+        yield f"chunking_{words}w", {"words": words}, timed(lambda: splitter.split_documents([doc]), repeat)
+
+
+def bench_rag_pipeline(quick: bool, repeat: int) -> Iterator[Result]:
+    """index_document (fresh document each time) and retrieve_context with fake embeddings."""
+    import chromadb
+    import rag_pipeline
+    from benchmarks.fakes import FakeEmbeddings
+    from llm_gateway import GatewayEmbeddings
+
+    rag_pipeline.embedding_model = rag_pipeline.CachedEmbeddings(GatewayEmbeddings(FakeEmbeddings(latency=0.02)),
+                                                                 "fake-embedding")
+    rag_pipeline.chroma_client = chromadb.PersistentClient(path=rag_pipeline.PERSIST_DIRECTORY)
+    rag_pipeline._backends_initialized = True
+
+    for words in ([5_000] if quick else [5_000, 50_000]):
+        counter = [0]
+        store = []
+
+        def index():
+            counter[0] += 1
+            text = synthetic_text(words, seed=counter[0])
+            store.append(rag_pipeline.index_document(text, f"bench-{words}-{counter[0]}"))
+
+        yield f"index_document_{words}w", {"words": words, "embed_latency_s": 0.02}, timed(index, repeat)
+        file_hash = f"bench-{words}-{counter[0]}"
+        yield (f"retrieve_context_{words}w", {"words": words, "k": 5},
+               timed(lambda: rag_pipeline.retrieve_context(store[-1], "cellular respiration", k=5,
+                                                           file_hash=file_hash), repeat))
+
+
+def bench_context_builder(quick: bool, repeat: int) -> Iterator[Result]:
+    """MMR selection / k-means coverage sampling, overlap merging and budget packing."""
+    from benchmarks.fakes import fake_vector
+    from context_builder import CONTEXT_TOKEN_BUDGET, MMR_FETCH_FACTOR, Chunk, build_context, build_coverage_context
+
+    text = synthetic_text(40_000)
+    query = fake_vector("cellular respiration", 768)
+    for k in ([5] if quick else [5, 25]):
+        starts = range(0, 800 * k * MMR_FETCH_FACTOR, 800)
+        candidates = [Chunk(text[s:s + 1000], s, fake_vector(str(s), 768)) for s in starts]
+        yield f"build_context_k{k}", {"k": k, "candidates": len(candidates), "dim": 768}, timed(
+            lambda: build_context(query, candidates, k, CONTEXT_TOKEN_BUDGET * max(1, k // 5)), repeat)
+
+    for chunks, k in ([(500, 10)] if quick else [(500, 10), (5000, 50)]):
+        document = [Chunk(f"chunk {i}", i * 800, fake_vector(str(i), 768)) for i in range(chunks)]
+        yield f"coverage_context_{chunks}c_k{k}", {"chunks": chunks, "k": k, "dim": 768}, timed(
+            lambda: build_coverage_context(document, k, CONTEXT_TOKEN_BUDGET * max(1, k // 10)), repeat)
+
+
+def bench_rag_system(quick: bool, repeat: int) -> Iterator[Result]:
+    """In-memory FAISS RAG: add_document and retrieve with a fake sentence encoder."""
+    from rag_system import RAG
+    from benchmarks.fakes import FakeSentenceTransformer
+
+    # A fresh RAG must accept more than one document and still retrieve from them.
+    rag = RAG(use_embedding_cache=False)
+    rag._model = FakeSentenceTransformer()
+    rag.add_document(synthetic_text(500, seed=1))
+    rag.add_document(synthetic_text(500, seed=2))
+    if not rag.retrieve("cellular respiration", top_k=3):
+        raise AssertionError("RAG.retrieve returned nothing after adding two documents")
+
+    for words in ([20_000] if quick else [20_000, 200_000]):
+        rags = []
+
+        def add():
+            rag = RAG(use_embedding_cache=False)
+            rag._model = FakeSentenceTransformer()
+            rag.add_document(synthetic_text(words))
+            rags.append(rag)
+
+        yield f"rag_add_document_{words}w", {"words": words}, timed(add, repeat)
+        yield f"rag_retrieve_{words}w", {"words": words, "top_k": 3}, timed(
+            lambda: rags[-1].retrieve("cellular respiration", top_k=3), repeat)
+
+
+def bench_parser(quick: bool, repeat: int) -> Iterator[Result]:
+    from benchmarks.bench_parser import as_json, as_text, make_questions, stream_json
+    from quiz_generation import parse_mcqs, parse_mcqs_json
+
+    for n in ([50] if quick else [50, 500, 2000]):
+        questions = make_questions(n)
+        text, js = as_text(questions), as_json(questions)
+        yield f"parse_regex_{n}q", {"questions": n}, timed(lambda: parse_mcqs(text), repeat)
+        yield f"parse_json_{n}q", {"questions": n}, timed(lambda: parse_mcqs_json(js), repeat)
+        # The same JSON fed in 16-character pieces, as it arrives from a streaming model.
+        yield f"parse_json_stream_{n}q", {"questions": n, "piece_chars": 16}, timed(lambda: stream_json(js), repeat)
+
+
+def bench_generation(quick: bool, repeat: int) -> Iterator[Result]:
+    """generate_quiz against the fake chat model (single call, streamed, and sharded)."""
+    from benchmarks.fakes import FakeChatModel
+    from llm_gateway import GatewayChatModel
+    from quiz_generation import CONTEXT_SEPARATOR, generate_quiz
+
+    llm = GatewayChatModel(FakeChatModel(latency=0.05))
+    context = CONTEXT_SEPARATOR.join(synthetic_text(150, seed=i) for i in range(20))
+    yield "generate_5q", {"llm_latency_s": 0.05}, timed(lambda: generate_quiz(llm, context, 5), repeat)
+    yield "generate_5q_streamed", {"llm_latency_s": 0.05}, timed(
+        lambda: generate_quiz(llm, context, 5, on_question=lambda q: None), repeat)
+    yield "generate_30q_sharded", {"llm_latency_s": 0.05}, timed(lambda: generate_quiz(llm, context, 30), repeat)
+
+
+def bench_database(quick: bool, repeat: int) -> Iterator[Result]:
+    import database
+    from benchmarks.fakes import fake_questions
+
+    database.DB_PATH = os.path.abspath("bench_quiz_app.db")
+    yield "db_init", {}, timed(database.init_db, repeat)
+    database.register_user("bench", "bench")
+    user_id = database.login_user("bench", "bench")["id"]
+
+    quizzes = 50 if quick else 500
+    batches = [0]
+
+    def save_many():
+        batches[0] += 1
+        for i in range(quizzes):
+            database.save_quiz(user_id, fake_questions(f"{batches[0]}:{i}", 10))
+        database.flush_writes()
+
+    yield f"db_save_{quizzes}_quizzes", {"quizzes": quizzes, "questions": 10}, timed(save_many, repeat)
+    page = database.get_quiz_summaries(user_id)
+    yield "db_history_page", {"limit": database.HISTORY_PAGE_SIZE}, timed(
+        lambda: database.get_quiz_summaries(user_id, before_id=page[-1]["id"]), repeat)
+    yield "db_get_quiz", {}, timed(lambda: database.get_quiz(user_id, page[0]["id"]), repeat)
+    yield "db_search_questions", {"limit": 20}, timed(lambda: database.search_questions("statement", user_id), repeat)
+
+
+def bench_docx_export(quick: bool, repeat: int) -> Iterator[Result]:
+    from benchmarks.fakes import fake_questions
+    from quiz_pipeline import quiz_to_docx
+
+    for n in ([10] if quick else [10, 50]):
+        quiz = fake_questions("export", n)
+        yield f"docx_export_{n}q", {"questions": n}, timed(lambda: quiz_to_docx(quiz), repeat)
+
+
+BENCHMARKS = {
+    "extract": bench_extract,
+    "chunking": bench_chunking,
+    "rag_pipeline": bench_rag_pipeline,
+    "context_builder": bench_context_builder,
+    "rag_system": bench_rag_system,
+    "parser": bench_parser,
+    "generation": bench_generation,
+    "database": bench_database,
+    "docx_export": bench_docx_export,
+}
+
+
+# ------------------- Runner -------------------
+def git_commit() -> Tuple[str, bool]:
+    def git(*args):
+        return subprocess.run(["git", *args], cwd=REPO_ROOT, capture_output=True, text=True).stdout.strip()
+
+    return git("rev-parse", "--short", "HEAD") or "unknown", bool(git("status", "--porcelain", "--untracked-files=no"))
+
+
+def summarize(params: Dict, times: List[float]) -> Dict:
+    return {"params": params, "repeat": len(times), "min_ms": min(times) * 1000,
+            "median_ms": statistics.median(times) * 1000, "mean_ms": statistics.mean(times) * 1000}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quick", action="store_true", help="smaller inputs, for a fast check")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), help="run only these groups")
+    parser.add_argument("--output", help="results file (default: benchmarks/results/<commit>.json)")
+    args = parser.parse_args()
+
+    commit, dirty = git_commit()
+    output = os.path.abspath(args.output or os.path.join(RESULTS_DIR, f"{commit}{'-dirty' if dirty else ''}.json"))
+    workdir = tempfile.mkdtemp(prefix="quiz_bench_")
+
+    # Caches, databases and the vector store all use relative paths or these variables;
+    # point them at the scratch directory before any pipeline module is imported.
+    os.environ.update({"RAG_EMBED_RPM": "0", "LLM_CHAT_RPM": "0", "LLM_CHAT_TPM": "0"})
+    sys.path.insert(0, REPO_ROOT)
+    os.chdir(workdir)
+
+    results = {}
+    print(f"{'benchmark':<32}{'median ms':>12}{'min ms':>12}")
+    for group in args.only or BENCHMARKS:
+        try:
+            for name, params, times in BENCHMARKS[group](args.quick, args.repeat):
+                results[name] = summarize(params, times)
+                print(f"{name:<32}{results[name]['median_ms']:>12.2f}{results[name]['min_ms']:>12.2f}")
+        except ImportError as e:
+            results[group] = {"skipped": str(e)}
+            print(f"{group:<32}{'skipped: ' + str(e):>24}")
+        except Exception as e:
+            # One broken group must not lose the results of the others.
+            results[group] = {"failed": f"{type(e).__name__}: {e}"}
+            print(f"{group:<32}{'FAILED: ' + results[group]['failed']:>24}")
+            traceback.print_exc()
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"commit": commit, "dirty": dirty, "created_at": datetime.now().isoformat(timespec="seconds"),
+                   "python": platform.python_version(), "platform": platform.platform(), "quick": args.quick,
+                   "repeat": args.repeat, "results": results}, f, indent=2)
+    print(f"\nResults written to {output}")
+    failed = [name for name, result in results.items() if "failed" in result]
+    if failed:
+        print(f"{len(failed)} group(s) failed: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
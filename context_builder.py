@@ -0,0 +1,266 @@
+import os
+from typing import List, Optional, Sequence
+
+from lazy_imports import LazyModule
+from llm_gateway import estimate_tokens
+from quiz_generation import CONTEXT_SEPARATOR
+
+np = LazyModule("numpy")
+
+# Turns retrieved chunks into the prompt context: maximal-marginal-relevance selection
+# (relevant to the query but not to each other) or, without a query, one representative
+# chunk per k-means cluster of the whole document; then overlapping neighbours merged
+# back into contiguous spans, and the spans packed to a fixed token budget.
+
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("RAG_CONTEXT_TOKENS", "3000"))  # per LLM call
+MMR_LAMBDA = float(os.environ.get("RAG_MMR_LAMBDA", "0.5"))  # 1.0 = pure relevance, 0.0 = pure diversity
+MMR_FETCH_FACTOR = 4  # candidates fetched per chunk selected
+MIN_TRUNCATED_TOKENS = 100  # a span cut to fit the budget must keep at least this much
+MAX_TEXT_OVERLAP = 400  # longest suffix/prefix match tried for chunks without start_index
+KMEANS_ITERATIONS = 25
+KMEANS_RESTARTS = 3  # k-means++ runs per clustering; the lowest-inertia one is kept
+KMEANS_SEED = 0  # fixed, so the same document always yields the same context (and quiz-cache key)
+
+
+class Chunk:
+    """A retrieved chunk: text, offset in the source text (None if unknown) and embedding."""
+    __slots__ = ("text", "start", "vector", "rank")
+
+    def __init__(self, text: str, start: Optional[int] = None, vector: Optional[Sequence[float]] = None):
+        self.text = text
+        self.start = start
+        self.vector = vector
+        self.rank = 0  # selection order; the best rank survives a merge
+
+    @property
+    def end(self) -> int:
+        return self.start + len(self.text)
+
+
+# ------------------- MMR Selection -------------------
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def mmr_select(query_vector: Sequence[float], vectors: Sequence[Sequence[float]], k: int,
+               lambda_mult: float = MMR_LAMBDA) -> List[int]:
+    """
+    Indices of `k` vectors chosen by maximal marginal relevance, in selection order:
+    each pick maximizes lambda * sim(query) - (1 - lambda) * max sim(already picked).
+    """
+    if not len(vectors) or k <= 0:
+        return []
+    candidates = _normalize(np.asarray(vectors, dtype="float32"))
+    relevance = candidates @ _normalize(np.asarray(query_vector, dtype="float32"))
+    redundancy = np.full(len(candidates), -np.inf, dtype="float32")
+    available = np.ones(len(candidates), dtype=bool)
+
+    selected = []
+    for _ in range(min(k, len(candidates))):
+        if selected:
+            score = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        else:
+            score = relevance.copy()
+        score[~available] = -np.inf
+        best = int(np.argmax(score))
+        selected.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, candidates @ candidates[best])
+    return selected
+
+
+# ------------------- Coverage Sampling -------------------
+def _kmeans_once(points, squared, k: int, iterations: int, rng):
+    def distances(centroids):
+        # ||x - c||^2 for every point/centroid pair, without materializing the differences
+        return np.maximum(squared[:, None] - 2 * points @ centroids.T + (centroids * centroids).sum(axis=1), 0)
+
+    centroids = points[[rng.integers(len(points))]]
+    closest = distances(centroids)[:, 0]
+    for _ in range(1, k):
+        total = closest.sum()
+        pick = rng.choice(len(points), p=closest / total) if total > 0 else rng.integers(len(points))
+        centroids = np.vstack([centroids, points[pick]])
+        closest = np.minimum(closest, distances(points[[pick]])[:, 0])
+
+    labels = None
+    for _ in range(iterations):
+        d = distances(centroids)
+        new_labels = d.argmin(axis=1)
+        if labels is not None and (new_labels == labels).all():
+            break
+        labels = new_labels
+        members = np.zeros((k, len(points)), dtype=points.dtype)
+        members[labels, np.arange(len(points))] = 1
+        counts = members.sum(axis=1)
+        empty = counts == 0
+        centroids = (members @ points) / np.maximum(counts, 1)[:, None]
+        if empty.any():
+            # Re-seed empty clusters with the points farthest from their centroid.
+            farthest = np.argsort(-d[np.arange(len(points)), labels])[:int(empty.sum())]
+            centroids[empty] = points[farthest]
+    inertia = float(distances(centroids)[np.arange(len(points)), labels].sum())
+    return centroids, labels, inertia
+
+
+def kmeans(vectors, k: int, iterations: int = KMEANS_ITERATIONS, restarts: int = KMEANS_RESTARTS,
+           seed: int = KMEANS_SEED):
+    """
+    Cluster the rows of `vectors` into `k` groups (k-means++ seeding, Lloyd iterations),
+    keeping the best of `restarts` runs. Returns (centroids, labels).
+    """
+    points = np.asarray(vectors, dtype="float32")
+    squared = (points * points).sum(axis=1)
+    rng = np.random.default_rng(seed)
+    best = None
+    for _ in range(max(1, restarts)):
+        run = _kmeans_once(points, squared, k, iterations, rng)
+        if best is None or run[2] < best[2]:
+            best = run
+    return best[0], best[1]
+
+
+def coverage_select(vectors: Sequence[Sequence[float]], k: int) -> List[int]:
+    """
+    Indices of `k` vectors that represent the whole set: the member closest to each
+    k-means centroid, largest cluster first. With k or fewer vectors, all of them.
+    Clusters left empty (duplicate or degenerate vectors) are made up for with the
+    vectors farthest from every pick so far, so min(k, n) distinct indices come back.
+    """
+    if k <= 0 or not len(vectors):
+        return []
+    points = _normalize(np.asarray(vectors, dtype="float32"))
+    if len(points) <= k:
+        return list(range(len(points)))
+
+    centroids, labels = kmeans(points, k)
+    counts = np.bincount(labels, minlength=k)
+    representatives = []
+    for cluster in np.argsort(-counts, kind="stable"):
+        members = np.flatnonzero(labels == cluster)
+        if len(members):
+            offsets = ((points[members] - centroids[cluster]) ** 2).sum(axis=1)
+            representatives.append(int(members[offsets.argmin()]))
+
+    if len(representatives) < k:
+        squared = (points * points).sum(axis=1)
+
+        def gap_to(picks):
+            return np.maximum(squared[:, None] - 2 * points @ points[picks].T + squared[picks], 0).min(axis=1)
+
+        gap = gap_to(representatives)
+        gap[representatives] = -np.inf
+        while len(representatives) < k:
+            best = int(np.argmax(gap))
+            representatives.append(best)
+            gap = np.minimum(gap, gap_to([best]))
+            gap[best] = -np.inf
+    return representatives
+
+
+# ------------------- Overlap Merging -------------------
+def _text_overlap(left: str, right: str, max_chars: int = MAX_TEXT_OVERLAP) -> int:
+    """Length of the longest suffix of `left` that is also a prefix of `right`."""
+    for size in range(min(len(left), len(right), max_chars), 0, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def merge_overlapping(chunks: List[Chunk]) -> List[Chunk]:
+    """
+    Merge chunks that overlap or touch in the source text into single spans, so text
+    repeated by the splitter's chunk_overlap is sent once. Chunks with a start offset
+    are merged by position; chunks without one (indexed before start_index was
+    stored) only when one ends with the other's beginning.
+    """
+    positioned = sorted((c for c in chunks if c.start is not None), key=lambda c: c.start)
+    merged: List[Chunk] = []
+    for chunk in positioned:
+        last = merged[-1] if merged else None
+        if last is not None and chunk.start <= last.end:
+            if chunk.end > last.end:
+                last.text += chunk.text[last.end - chunk.start:]
+            last.rank = min(last.rank, chunk.rank)
+        else:
+            merged.append(Chunk(chunk.text, chunk.start))
+            merged[-1].rank = chunk.rank
+
+    for chunk in sorted((c for c in chunks if c.start is None), key=lambda c: c.rank):
+        for span in merged:
+            if span.start is not None:
+                continue
+            if chunk.text in span.text:
+                break
+            overlap = _text_overlap(span.text, chunk.text)
+            if overlap:
+                span.text += chunk.text[overlap:]
+                break
+            overlap = _text_overlap(chunk.text, span.text)
+            if overlap:
+                span.text = chunk.text + span.text[overlap:]
+                break
+        else:
+            merged.append(Chunk(chunk.text))
+            merged[-1].rank = chunk.rank
+    return merged
+
+
+# ------------------- Token Budget Packing -------------------
+def _truncate(text: str, max_tokens: int) -> str:
+    """Cut `text` to about `max_tokens`, at the last sentence or word end that fits."""
+    cut = text[:max_tokens * (len(text) // estimate_tokens(text) or 1)]
+    for boundary in (". ", "\n", " "):
+        end = cut.rfind(boundary)
+        if end > len(cut) // 2:
+            return cut[:end + 1].rstrip()
+    return cut
+
+
+def pack_spans(spans: List[Chunk], token_budget: int) -> List[Chunk]:
+    """
+    Take spans best-rank first while they fit in `token_budget`; a span that does not
+    fit is cut down if enough budget is left, otherwise skipped for smaller ones.
+    The packed spans are returned in document order.
+    """
+    packed = []
+    remaining = token_budget
+    for span in sorted(spans, key=lambda s: s.rank):
+        tokens = estimate_tokens(span.text)
+        if tokens <= remaining:
+            packed.append(span)
+            remaining -= tokens
+        elif remaining >= MIN_TRUNCATED_TOKENS:
+            cut = Chunk(_truncate(span.text, remaining), span.start)
+            cut.rank = span.rank
+            packed.append(cut)
+            remaining -= estimate_tokens(cut.text)
+    return sorted(packed, key=lambda s: (s.start is None, s.start or 0, s.rank))
+
+
+def _assemble(chunks: List[Chunk], order: List[int], token_budget: int) -> str:
+    selected = []
+    for rank, index in enumerate(order):
+        chunks[index].rank = rank
+        selected.append(chunks[index])
+    spans = pack_spans(merge_overlapping(selected), token_budget)
+    return CONTEXT_SEPARATOR.join(span.text for span in spans)
+
+
+def build_context(query_vector: Sequence[float], candidates: List[Chunk], k: int,
+                  token_budget: int = CONTEXT_TOKEN_BUDGET, lambda_mult: float = MMR_LAMBDA) -> str:
+    """
+    Pick `k` of `candidates` by MMR against `query_vector`, merge the picks that overlap
+    in the source and pack them into `token_budget` tokens, joined by CONTEXT_SEPARATOR.
+    """
+    order = mmr_select(query_vector, [c.vector for c in candidates], k, lambda_mult)
+    return _assemble(candidates, order, token_budget)
+
+
+def build_coverage_context(chunks: List[Chunk], k: int, token_budget: int = CONTEXT_TOKEN_BUDGET) -> str:
+    """
+    Like `build_context`, but with no query: `k` chunks representative of all of
+    `chunks` (one per k-means cluster), so the context covers the whole document.
+    """
+    return _assemble(chunks, coverage_select([c.vector for c in chunks], k), token_budget)
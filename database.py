@@ -1,53 +1,153 @@
 import sqlite3
+import queue
+import hashlib
+import atexit
+import threading
 from datetime import datetime
-from typing import List, Dict
+from typing import List, Dict, Optional
+from sqlite_store import ConnectionPool, data_path
+
+DB_PATH = data_path("quiz_app.db")
+WRITE_BATCH_MAX = 100  # most quizzes written in one transaction
+WRITE_BATCH_WAIT = 0.05  # seconds the writer waits for more quizzes before committing
+
+# ------------------- Connection Pool -------------------
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_connection():
+    """Borrow a pooled connection: `with get_connection() as conn: ...`"""
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.path != DB_PATH:
+            _pool = ConnectionPool(DB_PATH)
+        pool = _pool
+    return pool.connection()
 
-DB_PATH = "quiz_app.db"
 
 # ------------------- Initialize Database -------------------
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    # Users table
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL
-        )
-    """)
-    # Quizzes table
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS quizzes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            quiz_data TEXT NOT NULL,
-            created_at TEXT NOT NULL,
-            FOREIGN KEY(user_id) REFERENCES users(id)
-        )
+    with get_connection() as conn:
+        c = conn.cursor()
+        # Users table
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT UNIQUE NOT NULL,
+                password TEXT NOT NULL
+            )
+        """)
+        # Quizzes table
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS quizzes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                quiz_data TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                FOREIGN KEY(user_id) REFERENCES users(id)
+            )
+        """)
+        _migrate_quiz_summaries(conn)
+        # History is always read per user, newest first.
+        c.execute("CREATE INDEX IF NOT EXISTS idx_quizzes_user_id ON quizzes(user_id, id)")
+        # Questions are stored once per distinct content and linked to the quizzes using them.
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS questions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                content_hash TEXT UNIQUE NOT NULL,
+                question TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                created_at TEXT NOT NULL
+            )
+        """)
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS question_options (
+                question_id INTEGER NOT NULL,
+                label TEXT NOT NULL,
+                text TEXT NOT NULL,
+                PRIMARY KEY (question_id, label),
+                FOREIGN KEY(question_id) REFERENCES questions(id)
+            ) WITHOUT ROWID
+        """)
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS quiz_questions (
+                quiz_id INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                question_id INTEGER NOT NULL,
+                PRIMARY KEY (quiz_id, position),
+                FOREIGN KEY(quiz_id) REFERENCES quizzes(id),
+                FOREIGN KEY(question_id) REFERENCES questions(id)
+            ) WITHOUT ROWID
+        """)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_quiz_questions_question ON quiz_questions(question_id)")
+        _create_question_search(conn)
+        _migrate_quiz_blobs(conn)
+        conn.commit()
+
+
+_fts_enabled = False
+
+
+def _create_question_search(conn: sqlite3.Connection):
+    """Full-text index over question text, kept in sync by a trigger (questions are never updated)."""
+    global _fts_enabled
+    try:
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS questions_fts "
+                     "USING fts5(question, content='questions', content_rowid='id')")
+    except sqlite3.OperationalError as e:
+        print(f"SQLite FTS5 unavailable ({e}); question search falls back to LIKE.")
+        _fts_enabled = False
+        return
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS questions_fts_insert AFTER INSERT ON questions BEGIN
+            INSERT INTO questions_fts(rowid, question) VALUES (new.id, new.question);
+        END
     """)
-    conn.commit()
-    conn.close()
+    _fts_enabled = True
+
+
+def _quiz_summary_fields(quiz_data: List[Dict]) -> tuple:
+    title = quiz_data[0].get("question", "") if quiz_data else ""
+    return len(quiz_data), title[:120]
+
+
+def _migrate_quiz_summaries(conn: sqlite3.Connection):
+    """Add and backfill the num_questions/title columns that history summaries read."""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(quizzes)")}
+    if "num_questions" not in columns:
+        conn.execute("ALTER TABLE quizzes ADD COLUMN num_questions INTEGER")
+    if "title" not in columns:
+        conn.execute("ALTER TABLE quizzes ADD COLUMN title TEXT")
+    rows = conn.execute("SELECT id, quiz_data FROM quizzes WHERE num_questions IS NULL").fetchall()
+    if rows:
+        conn.executemany("UPDATE quizzes SET num_questions=?, title=? WHERE id=?",
+                         [(*_quiz_summary_fields(json.loads(quiz_json)), quiz_id) for quiz_id, quiz_json in rows])
+
+def _migrate_quiz_blobs(conn: sqlite3.Connection):
+    """Move quiz bodies stored as JSON blobs into the normalized question tables."""
+    rows = conn.execute("SELECT id, quiz_data, created_at FROM quizzes WHERE quiz_data != ''").fetchall()
+    for quiz_id, quiz_json, created_at in rows:
+        _insert_quiz_questions(conn, quiz_id, json.loads(quiz_json), created_at)
+    if rows:
+        conn.execute("UPDATE quizzes SET quiz_data='' WHERE quiz_data != ''")
+
 
 # ------------------- User Auth -------------------
 def register_user(username: str, password: str) -> bool:
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    try:
-        c.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, password))
-        conn.commit()
-        return True
-    except sqlite3.IntegrityError:
-        return False
-    finally:
-        conn.close()
+    with get_connection() as conn:
+        try:
+            conn.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, password))
+            conn.commit()
+            return True
+        except sqlite3.IntegrityError:
+            conn.rollback()
+            return False
 
 def login_user(username: str, password: str) -> dict:
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT id, username FROM users WHERE username=? AND password=?", (username, password))
-    row = c.fetchone()
-    conn.close()
+    with get_connection() as conn:
+        row = conn.execute("SELECT id, username FROM users WHERE username=? AND password=?",
+                           (username, password)).fetchone()
     if row:
         return {"id": row[0], "username": row[1]}
     return None
@@ -55,24 +155,195 @@ def login_user(username: str, password: str) -> dict:
 # ------------------- Quiz Storage -------------------
 import json
 
+HISTORY_PAGE_SIZE = 10
+
+# save_quiz only enqueues; a background writer commits queued quizzes in batches.
+_write_queue = queue.Queue()
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def question_hash(q: Dict) -> str:
+    """Content hash of a question: identical text, options and answer give the same hash."""
+    normalize = lambda s: " ".join(str(s).lower().split())
+    content = [normalize(q["question"]), [normalize(q["options"][k]) for k in sorted(q["options"])],
+               normalize(q["answer"])]
+    return hashlib.sha256(json.dumps(content).encode("utf-8")).hexdigest()
+
+
+def _insert_quiz_questions(conn: sqlite3.Connection, quiz_id: int, quiz_data: List[Dict], created_at: str):
+    for position, q in enumerate(quiz_data):
+        content_hash = question_hash(q)
+        cur = conn.execute("INSERT INTO questions (content_hash, question, answer, created_at) VALUES (?, ?, ?, ?) "
+                           "ON CONFLICT(content_hash) DO NOTHING",
+                           (content_hash, q["question"], q["answer"], created_at))
+        if cur.rowcount:
+            question_id = cur.lastrowid
+            conn.executemany("INSERT INTO question_options (question_id, label, text) VALUES (?, ?, ?)",
+                             [(question_id, label, text) for label, text in q["options"].items()])
+        else:
+            # Seen before: reuse the stored question instead of storing a duplicate.
+            question_id = conn.execute("SELECT id FROM questions WHERE content_hash=?",
+                                       (content_hash,)).fetchone()[0]
+        conn.execute("INSERT OR REPLACE INTO quiz_questions (quiz_id, position, question_id) VALUES (?, ?, ?)",
+                     (quiz_id, position, question_id))
+
+
+def _load_questions(conn: sqlite3.Connection, question_ids: List[int]) -> Dict[int, Dict]:
+    """quiz_data-shaped dicts for the given question ids."""
+    questions = {}
+    for i in range(0, len(question_ids), 500):
+        ids = question_ids[i:i + 500]
+        marks = ",".join("?" * len(ids))
+        for question_id, question, answer in conn.execute(
+                f"SELECT id, question, answer FROM questions WHERE id IN ({marks})", ids):
+            questions[question_id] = {"question": question, "options": {}, "answer": answer}
+        for question_id, label, text in conn.execute(
+                f"SELECT question_id, label, text FROM question_options WHERE question_id IN ({marks}) "
+                f"ORDER BY question_id, label", ids):
+            questions[question_id]["options"][label] = text
+    return questions
+
+
+def _load_quizzes(conn: sqlite3.Connection, quiz_ids: List[int]) -> Dict[int, List[Dict]]:
+    links = []
+    for i in range(0, len(quiz_ids), 500):
+        ids = quiz_ids[i:i + 500]
+        marks = ",".join("?" * len(ids))
+        links.extend(conn.execute(f"SELECT quiz_id, question_id FROM quiz_questions WHERE quiz_id IN ({marks}) "
+                                  f"ORDER BY quiz_id, position", ids))
+    questions = _load_questions(conn, list({question_id for _, question_id in links}))
+    quizzes = {quiz_id: [] for quiz_id in quiz_ids}
+    for quiz_id, question_id in links:
+        quizzes[quiz_id].append(questions[question_id])
+    return quizzes
+
+
+def _write_batch(batch: List[tuple]):
+    with get_connection() as conn:
+        for user_id, quiz_data, created_at in batch:
+            num_questions, title = _quiz_summary_fields(quiz_data)
+            # quiz_data stays empty: the body lives in quiz_questions/questions/question_options.
+            cur = conn.execute("INSERT INTO quizzes (user_id, quiz_data, created_at, num_questions, title) "
+                               "VALUES (?, '', ?, ?, ?)", (user_id, created_at, num_questions, title))
+            _insert_quiz_questions(conn, cur.lastrowid, quiz_data, created_at)
+        conn.commit()
+
+
+def _writer_loop():
+    while True:
+        batch = [_write_queue.get()]
+        try:
+            while len(batch) < WRITE_BATCH_MAX:
+                batch.append(_write_queue.get(timeout=WRITE_BATCH_WAIT))
+        except queue.Empty:
+            pass
+        # Any error (not just sqlite3.Error, e.g. a row that fails to serialize) is
+        # handled here: if the writer thread died, flush_writes() would wait forever.
+        try:
+            _write_batch(batch)
+        except Exception as e:
+            print(f"Quiz write failed, retrying row by row: {e}")
+            for row in batch:
+                try:
+                    _write_batch([row])
+                except Exception as row_error:
+                    print(f"Dropping quiz for user {row[0]}: {row_error}")
+        finally:
+            for _ in batch:
+                _write_queue.task_done()
+
+
+def _ensure_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = threading.Thread(target=_writer_loop, name="quiz-writer", daemon=True)
+            _writer.start()
+
+
+def flush_writes():
+    """Block until every queued save_quiz has been committed."""
+    if _writer is not None and _writer.is_alive():
+        _write_queue.join()
+
+
+atexit.register(flush_writes)
+
+
 def save_quiz(user_id: int, quiz_data: List[Dict]):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
     created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    quiz_json = json.dumps(quiz_data)
-    c.execute("INSERT INTO quizzes (user_id, quiz_data, created_at) VALUES (?, ?, ?)",
-              (user_id, quiz_json, created_at))
-    conn.commit()
-    conn.close()
+    _ensure_writer()
+    _write_queue.put((user_id, quiz_data, created_at))
 
 def get_quiz_history(user_id: int) -> List[Dict]:
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT quiz_data, created_at FROM quizzes WHERE user_id=? ORDER BY id ASC", (user_id,))
-    rows = c.fetchall()
-    conn.close()
+    flush_writes()  # read your own writes
+    with get_connection() as conn:
+        rows = conn.execute("SELECT id, created_at FROM quizzes WHERE user_id=? ORDER BY id ASC",
+                            (user_id,)).fetchall()
+        quizzes = _load_quizzes(conn, [quiz_id for quiz_id, _ in rows])
     history = []
-    for quiz_json, created_at in rows:
-        quiz_data = json.loads(quiz_json)
-        history.append({"quiz_data": quiz_data, "created_at": created_at})
+    for quiz_id, created_at in rows:
+        history.append({"quiz_data": quizzes[quiz_id], "created_at": created_at})
     return history
+
+
+def get_quiz_summaries(user_id: int, limit: int = HISTORY_PAGE_SIZE, before_id: Optional[int] = None) -> List[Dict]:
+    """
+    One page of a user's quizzes, newest first, without loading the quiz bodies.
+    Pass the smallest `id` of the previous page as `before_id` to get the next page.
+    """
+    flush_writes()
+    with get_connection() as conn:
+        if before_id is None:
+            rows = conn.execute("SELECT id, created_at, num_questions, title FROM quizzes "
+                                "WHERE user_id=? ORDER BY id DESC LIMIT ?", (user_id, limit)).fetchall()
+        else:
+            rows = conn.execute("SELECT id, created_at, num_questions, title FROM quizzes "
+                                "WHERE user_id=? AND id<? ORDER BY id DESC LIMIT ?",
+                                (user_id, before_id, limit)).fetchall()
+    return [{"id": quiz_id, "created_at": created_at, "num_questions": num_questions, "title": title}
+            for quiz_id, created_at, num_questions, title in rows]
+
+def get_quiz(user_id: int, quiz_id: int) -> Optional[List[Dict]]:
+    """Full quiz_data of one quiz, or None if it does not belong to the user."""
+    with get_connection() as conn:
+        row = conn.execute("SELECT id FROM quizzes WHERE id=? AND user_id=?", (quiz_id, user_id)).fetchone()
+        if not row:
+            return None
+        return _load_quizzes(conn, [quiz_id])[quiz_id]
+
+
+def _fts_query(text: str) -> str:
+    # Quote every term so user input cannot inject FTS5 syntax; the last term matches as a prefix.
+    terms = ['"' + term.replace('"', '""') + '"' for term in text.split()]
+    if terms:
+        terms[-1] += "*"
+    return " ".join(terms)
+
+def search_questions(text: str, user_id: Optional[int] = None, limit: int = 20) -> List[Dict]:
+    """
+    Full-text search over stored questions, best matches first. With `user_id`, only
+    questions from that user's quizzes are searched; otherwise the whole instance.
+    """
+    if not text.strip():
+        return []
+    flush_writes()
+    user_filter = ""
+    params: list = []
+    if user_id is not None:
+        user_filter = ("AND EXISTS (SELECT 1 FROM quiz_questions qq JOIN quizzes z ON z.id = qq.quiz_id "
+                       "WHERE qq.question_id = q.id AND z.user_id = ?)")
+    with get_connection() as conn:
+        if _fts_enabled:
+            params = [_fts_query(text)] + ([user_id] if user_id is not None else []) + [limit]
+            rows = conn.execute(f"SELECT q.id FROM questions_fts JOIN questions q ON q.id = questions_fts.rowid "
+                                f"WHERE questions_fts MATCH ? {user_filter} "
+                                f"ORDER BY bm25(questions_fts) LIMIT ?", params).fetchall()
+        else:
+            params = [f"%{text.strip()}%"] + ([user_id] if user_id is not None else []) + [limit]
+            rows = conn.execute(f"SELECT q.id FROM questions q WHERE q.question LIKE ? {user_filter} "
+                                f"ORDER BY q.id DESC LIMIT ?", params).fetchall()
+        ids = [row[0] for row in rows]
+        questions = _load_questions(conn, ids)
+    return [{"id": question_id, **questions[question_id]} for question_id in ids]
@@ -0,0 +1,100 @@
+import os
+import hashlib
+import threading
+import time
+from array import array
+from typing import Callable, List, Optional, Sequence
+from sqlite_store import LRUTable, data_path
+
+EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH") or data_path("embedding_cache.db")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+_SQL_BATCH = 500  # stay well below SQLite's host-parameter limit
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache(LRUTable):
+    """
+    Content-addressed embedding cache keyed by (model name, sha256 of the text).
+    Vectors are stored as float32 blobs in SQLite; the least recently used rows are
+    evicted once the cache grows past `max_entries`.
+    """
+    table = "embeddings"
+    metric = "embedding_cache"
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        super().__init__(path, max_entries)
+
+    def _create(self, conn):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                UNIQUE(model, text_hash)
+            )
+        """)
+
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[array]]:
+        """Return the cached float32 vector for each text, or None where it is not cached."""
+        hashes = [text_hash(t) for t in texts]
+        found = {}
+        with self._pool.connection() as conn:
+            for i in range(0, len(hashes), _SQL_BATCH):
+                batch = list(set(hashes[i:i + _SQL_BATCH]))
+                marks = ",".join("?" * len(batch))
+                rows = conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model=? AND text_hash IN ({marks})",
+                    [model, *batch]).fetchall()
+                found.update(rows)
+        if found:
+            with self._write() as conn:
+                self._touch(conn, "model=? AND text_hash=?", [(model, h) for h in found])
+
+        vectors = []
+        for h in hashes:
+            blob = found.get(h)
+            vectors.append(array("f", blob) if blob is not None else None)
+        return vectors
+
+    def put_many(self, model: str, texts: Sequence[str], vectors: Sequence[Sequence[float]]):
+        now = time.time()
+        rows = [(model, text_hash(t), array("f", v).tobytes(), now) for t, v in zip(texts, vectors)]
+        with self._write() as conn:
+            cur = conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (model, text_hash, vector, last_used) VALUES (?, ?, ?, ?)", rows)
+            self._added(conn, max(cur.rowcount, 0))
+
+    def embed(self, model: str, texts: Sequence[str],
+              embed_fn: Callable[[List[str]], Sequence[Sequence[float]]]) -> List[array]:
+        """
+        Return embeddings for `texts`, calling `embed_fn` only for texts that are not
+        cached yet (each distinct text once) and caching the results.
+        """
+        vectors = self.get_many(model, texts)
+        missing = list(dict.fromkeys(t for t, v in zip(texts, vectors) if v is None))
+        self._record(len(texts) - sum(v is None for v in vectors), len(missing))
+
+        if missing:
+            new_vectors = [array("f", v) for v in embed_fn(missing)]
+            self.put_many(model, missing, new_vectors)
+            by_text = dict(zip(missing, new_vectors))
+            vectors = [v if v is not None else by_text[t] for t, v in zip(texts, vectors)]
+        return vectors
+
+
+_cache: Optional[EmbeddingCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """Process-wide shared cache instance."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = EmbeddingCache()
+        return _cache
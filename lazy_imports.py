@@ -0,0 +1,18 @@
+import importlib
+
+
+class LazyModule:
+    """
+    Stand-in for a heavy module that is only imported on first attribute access,
+    e.g. `faiss = LazyModule("faiss")` keeps `faiss.IndexFlatL2(...)` call sites
+    unchanged while moving the import cost to the first call.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
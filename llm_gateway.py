@@ -0,0 +1,305 @@
+import os
+import re
+import time
+import random
+import itertools
+import sqlite3
+import threading
+from typing import Callable, Dict, Iterator, List, Optional
+from sqlite_store import ThreadConnections, data_path
+from tracing import incr, observe, span
+
+# Every chat and embedding request goes through `call`, which enforces requests- and
+# tokens-per-minute budgets shared by all threads and processes (via SQLite), retries
+# transient failures with jittered exponential backoff and keeps per-endpoint metrics.
+
+GATEWAY_DB_PATH = os.environ.get("LLM_GATEWAY_DB_PATH") or data_path("llm_gateway.db")
+GATEWAY_MAX_RETRIES = int(os.environ.get("LLM_GATEWAY_MAX_RETRIES", "5"))
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
+CHARS_PER_TOKEN = 4  # rough estimate used to reserve tokens before a call
+
+# Budgets per endpoint; 0 means unlimited.
+ENDPOINT_LIMITS = {
+    "chat": {"rpm": int(os.environ.get("LLM_CHAT_RPM", "60")),
+             "tpm": int(os.environ.get("LLM_CHAT_TPM", "1000000"))},
+    "embed": {"rpm": int(os.environ.get("RAG_EMBED_RPM", "100")),
+              "tpm": int(os.environ.get("RAG_EMBED_TPM", "0"))},
+}
+
+_RETRYABLE = re.compile(r"429|500|502|503|504|rate.?limit|quota|resource.?exhausted|overloaded|unavailable|"
+                        r"deadline|timed? ?out|temporar|connection", re.IGNORECASE)
+_RATE_LIMITED = re.compile(r"429|rate.?limit|quota|resource.?exhausted", re.IGNORECASE)
+_RETRY_HINT = re.compile(r"retry[_ -]?(?:after|delay|in)\W{0,4}(\d+(?:\.\d+)?)\s*s?", re.IGNORECASE)
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+# ------------------- Shared Token Buckets -------------------
+class TokenBuckets:
+    """
+    Token buckets kept in SQLite so that every process using the same file draws from
+    one budget. A bucket refills continuously at `per_minute / 60` per second up to
+    `per_minute`. `pause` blocks an endpoint for everyone until a given time, which is
+    how one rate-limit error slows all callers instead of each retrying on its own.
+    """
+
+    def __init__(self, path: str = GATEWAY_DB_PATH):
+        self.path = path
+        self._conns = ThreadConnections(path)
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS buckets (
+                name TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL,
+                blocked_until REAL NOT NULL DEFAULT 0
+            )
+        """)
+
+    def _conn(self) -> sqlite3.Connection:
+        return self._conns.get()
+
+    def try_take(self, costs: Dict[str, float], limits: Dict[str, int]) -> float:
+        """
+        Take `costs[name]` from each bucket if all of them can afford it and return 0;
+        otherwise take nothing and return the seconds to wait before trying again.
+        """
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            wait, levels = 0.0, {}
+            for name, cost in costs.items():
+                capacity = limits[name]
+                row = conn.execute("SELECT tokens, updated, blocked_until FROM buckets WHERE name=?",
+                                   (name,)).fetchone()
+                tokens, updated, blocked_until = row if row else (capacity, now, 0.0)
+                tokens = min(capacity, tokens + (now - updated) * capacity / 60.0)
+                levels[name] = tokens
+                wait = max(wait, blocked_until - now)
+                # A request larger than the whole bucket waits for a full bucket, then goes.
+                needed = min(cost, capacity)
+                if tokens < needed:
+                    wait = max(wait, (needed - tokens) * 60.0 / capacity)
+            if wait <= 0:
+                for name, cost in costs.items():
+                    conn.execute("INSERT INTO buckets (name, tokens, updated) VALUES (?, ?, ?) "
+                                 "ON CONFLICT(name) DO UPDATE SET tokens=excluded.tokens, updated=excluded.updated",
+                                 (name, levels[name] - cost, now))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return max(wait, 0.0)
+
+    def adjust(self, name: str, delta: float):
+        """Correct a bucket once the real cost of a call is known (negative delta refunds)."""
+        self._conn().execute("UPDATE buckets SET tokens = tokens - ? WHERE name=?", (delta, name))
+
+    def pause(self, names: List[str], until: float):
+        conn = self._conn()
+        for name in names:
+            conn.execute("INSERT INTO buckets (name, tokens, updated, blocked_until) VALUES (?, 0, ?, ?) "
+                         "ON CONFLICT(name) DO UPDATE SET blocked_until=MAX(blocked_until, excluded.blocked_until)",
+                         (name, time.time(), until))
+
+
+_buckets: Optional[TokenBuckets] = None
+_buckets_lock = threading.Lock()
+
+
+def get_buckets() -> TokenBuckets:
+    global _buckets
+    with _buckets_lock:
+        if _buckets is None or _buckets.path != GATEWAY_DB_PATH:
+            _buckets = TokenBuckets(GATEWAY_DB_PATH)
+        return _buckets
+
+
+# ------------------- Metrics -------------------
+_metrics: Dict[str, Dict[str, float]] = {}
+_metrics_lock = threading.Lock()
+
+
+def _record(endpoint: str, **values: float):
+    with _metrics_lock:
+        m = _metrics.setdefault(endpoint, {
+            "calls": 0, "errors": 0, "retries": 0, "rate_limited": 0, "tokens": 0,
+            "throttle_seconds": 0.0, "latency_seconds": 0.0, "max_latency_seconds": 0.0})
+        for key, value in values.items():
+            if key == "max_latency_seconds":
+                m[key] = max(m[key], value)
+            else:
+                m[key] += value
+
+
+def metrics() -> Dict[str, Dict[str, float]]:
+    """Per-endpoint counters for this process, e.g. metrics()["chat"]["retries"]."""
+    with _metrics_lock:
+        return {name: dict(m) for name, m in _metrics.items()}
+
+
+# ------------------- Calls -------------------
+def retry_after(error: Exception) -> Optional[float]:
+    """Server-suggested delay from a Retry-After header or a 'retry in 12s' style message."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        value = headers.get("retry-after") or headers.get("Retry-After")
+        if value:
+            return float(value)
+    except (TypeError, ValueError):
+        pass
+    match = _RETRY_HINT.search(str(error))
+    return float(match.group(1)) if match else None
+
+
+def is_retryable(error: Exception) -> bool:
+    status = getattr(error, "status_code", None) or getattr(error, "code", None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    return bool(_RETRYABLE.search(f"{type(error).__name__} {error}"))
+
+
+def _acquire(endpoint: str, tokens: int):
+    limits = ENDPOINT_LIMITS.get(endpoint, {})
+    costs, bucket_limits = {}, {}
+    if limits.get("rpm"):
+        costs[f"{endpoint}:requests"], bucket_limits[f"{endpoint}:requests"] = 1, limits["rpm"]
+    if limits.get("tpm"):
+        costs[f"{endpoint}:tokens"], bucket_limits[f"{endpoint}:tokens"] = tokens, limits["tpm"]
+    if not costs:
+        return
+    waited = 0.0
+    while True:
+        wait = get_buckets().try_take(costs, bucket_limits)
+        if wait <= 0:
+            break
+        wait = min(wait, BACKOFF_MAX_SECONDS)
+        time.sleep(wait)
+        waited += wait
+    if waited:
+        _record(endpoint, throttle_seconds=waited)
+
+
+def _backoff(attempt: int, hint: Optional[float]) -> float:
+    if hint is not None:
+        return min(hint, BACKOFF_MAX_SECONDS) + random.uniform(0, BACKOFF_BASE_SECONDS)
+    # "Full jitter": spreads retries of concurrent callers instead of synchronising them.
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+def _handle_failure(endpoint: str, error: Exception, attempt: int, max_retries: int):
+    """Raise `error` if it is final, otherwise sleep before the next attempt."""
+    _record(endpoint, errors=1)
+    if attempt >= max_retries or not is_retryable(error):
+        raise error
+    delay = _backoff(attempt, retry_after(error))
+    if _RATE_LIMITED.search(f"{type(error).__name__} {error}"):
+        _record(endpoint, rate_limited=1)
+        get_buckets().pause([f"{endpoint}:requests", f"{endpoint}:tokens"], time.time() + delay)
+    print(f"LLM gateway: {endpoint} attempt {attempt + 1} failed ({error}); retrying in {delay:.1f}s")
+    _record(endpoint, retries=1)
+    time.sleep(delay)
+
+
+def call(endpoint: str, fn: Callable, *args, tokens: int = 1, max_retries: int = GATEWAY_MAX_RETRIES,
+         usage: Optional[Callable[[object], Optional[int]]] = None):
+    """
+    Run `fn(*args)` under the endpoint's budgets, retrying transient errors.
+    `tokens` is reserved up front; `usage(result)` may return the real token count,
+    and the difference is settled with the shared bucket.
+    """
+    for attempt in range(max_retries + 1):
+        _acquire(endpoint, tokens)
+        start = time.perf_counter()
+        try:
+            with span(f"llm.{endpoint}", attempt=attempt):
+                result = fn(*args)
+        except Exception as e:
+            _handle_failure(endpoint, e, attempt, max_retries)
+            continue
+        latency = time.perf_counter() - start
+        used = usage(result) if usage else None
+        if used is not None and ENDPOINT_LIMITS.get(endpoint, {}).get("tpm"):
+            get_buckets().adjust(f"{endpoint}:tokens", used - tokens)
+        _record(endpoint, calls=1, tokens=used if used is not None else tokens,
+                latency_seconds=latency, max_latency_seconds=latency)
+        return result
+
+
+def _usage_tokens(message) -> Optional[int]:
+    usage = getattr(message, "usage_metadata", None) or {}
+    return usage.get("total_tokens")
+
+
+def _count_tokens(prompt_estimate: int, usage: Optional[Dict], completion_chars: int = 0):
+    """Prompt / completion token counters, from usage_metadata when the model reports it."""
+    usage = usage or {}
+    incr("llm_prompt_tokens", usage.get("input_tokens") or prompt_estimate)
+    incr("llm_completion_tokens", usage.get("output_tokens") or completion_chars // CHARS_PER_TOKEN)
+
+
+# ------------------- Model Wrappers -------------------
+class GatewayChatModel:
+    """Chat model whose invoke / predict / stream calls go through the gateway."""
+
+    def __init__(self, llm, endpoint: str = "chat"):
+        self.llm = llm
+        self.endpoint = endpoint
+
+    def invoke(self, prompt):
+        tokens = estimate_tokens(str(prompt))
+        result = call(self.endpoint, self.llm.invoke, prompt, tokens=tokens, usage=_usage_tokens)
+        content = getattr(result, "content", "")
+        _count_tokens(tokens, getattr(result, "usage_metadata", None), len(content) if isinstance(content, str) else 0)
+        return result
+
+    def predict(self, prompt: str) -> str:
+        result = self.invoke(prompt)
+        return getattr(result, "content", result)
+
+    def stream(self, prompt) -> Iterator:
+        """
+        Streams are retried only until the first chunk arrives: after that the caller has
+        already consumed part of the answer and a retry would repeat it.
+        """
+        def first_chunk():
+            chunks = iter(self.llm.stream(prompt))
+            return chunks, next(chunks, None)
+
+        tokens = estimate_tokens(str(prompt))
+        chunks, first = call(self.endpoint, first_chunk, tokens=tokens)
+        if first is None:
+            return
+        usage, chars = None, 0
+        start = time.perf_counter()
+        for chunk in itertools.chain([first], chunks):
+            usage = getattr(chunk, "usage_metadata", None) or usage  # reported on the last chunk
+            content = getattr(chunk, "content", "")
+            chars += len(content) if isinstance(content, str) else 0
+            yield chunk
+        # Timed by hand: a span held open across yields would parent the consumer's spans.
+        observe(f"llm.{self.endpoint}.stream", time.perf_counter() - start)
+        _count_tokens(tokens, usage, chars)
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
+
+
+class GatewayEmbeddings:
+    """Embedding model whose requests go through the gateway (embed_documents / embed_query)."""
+
+    def __init__(self, embeddings, endpoint: str = "embed"):
+        self.embeddings = embeddings
+        self.endpoint = endpoint
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return call(self.endpoint, self.embeddings.embed_documents, texts,
+                    tokens=sum(estimate_tokens(t) for t in texts))
+
+    def embed_query(self, text: str) -> List[float]:
+        return call(self.endpoint, self.embeddings.embed_query, text, tokens=estimate_tokens(text))
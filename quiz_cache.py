@@ -0,0 +1,81 @@
+import os
+import json
+import hashlib
+import threading
+import time
+from typing import Dict, List, Optional
+from sqlite_store import LRUTable, data_path
+
+QUIZ_CACHE_PATH = os.environ.get("QUIZ_CACHE_PATH") or data_path("quiz_cache.db")
+QUIZ_CACHE_TTL_SECONDS = int(os.environ.get("QUIZ_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+QUIZ_CACHE_MAX_ENTRIES = int(os.environ.get("QUIZ_CACHE_MAX_ENTRIES", "5000"))
+
+
+def make_quiz_key(context_text: str, num_mcqs: int, prompt_version: str, model_name: str) -> str:
+    context_hash = hashlib.sha256(context_text.encode("utf-8")).hexdigest()
+    key = json.dumps([context_hash, num_mcqs, prompt_version, model_name])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class QuizCache(LRUTable):
+    """
+    Parsed quiz_data from earlier LLM calls, keyed by `make_quiz_key`. Entries expire
+    after `ttl_seconds`; past `max_entries` the least recently used are evicted.
+    """
+    table = "quiz_cache"
+    metric = "quiz_cache"
+
+    def __init__(self, path: str = QUIZ_CACHE_PATH, ttl_seconds: int = QUIZ_CACHE_TTL_SECONDS,
+                 max_entries: int = QUIZ_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        super().__init__(path, max_entries)
+
+    def _create(self, conn):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS quiz_cache (
+                cache_key TEXT PRIMARY KEY,
+                quiz_data TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+
+    def get(self, cache_key: str) -> Optional[List[Dict]]:
+        with self._pool.connection() as conn:
+            row = conn.execute("SELECT quiz_data, created_at FROM quiz_cache WHERE cache_key=?",
+                               (cache_key,)).fetchone()
+        if row and time.time() - row[1] > self.ttl_seconds:
+            with self._write() as conn:
+                cur = conn.execute("DELETE FROM quiz_cache WHERE cache_key=? AND created_at=?", (cache_key, row[1]))
+                self._added(conn, -max(cur.rowcount, 0))
+            row = None
+        if row is None:
+            self._record(0, 1)
+            return None
+        with self._write() as conn:
+            self._touch(conn, "cache_key=?", [(cache_key,)])
+        self._record(1, 0)
+        return json.loads(row[0])
+
+    def put(self, cache_key: str, quiz_data: List[Dict]):
+        if not quiz_data:
+            return
+        now = time.time()
+        with self._write() as conn:
+            exists = conn.execute("SELECT 1 FROM quiz_cache WHERE cache_key=?", (cache_key,)).fetchone()
+            conn.execute("INSERT OR REPLACE INTO quiz_cache (cache_key, quiz_data, created_at, last_used) "
+                         "VALUES (?, ?, ?, ?)", (cache_key, json.dumps(quiz_data), now, now))
+            self._added(conn, 0 if exists else 1)
+
+
+_cache: Optional[QuizCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_quiz_cache() -> QuizCache:
+    """Process-wide shared cache instance."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = QuizCache()
+        return _cache
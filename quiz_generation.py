@@ -0,0 +1,402 @@
+import os
+import re
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Iterator, List, Optional
+from tracing import incr, span, traced
+
+# "json": ask for JSON MCQ objects and validate them (regex parser as fallback).
+# "text": the original "Q1. ... Answer: B" format parsed by regex only.
+QUIZ_OUTPUT_FORMAT = os.environ.get("QUIZ_OUTPUT_FORMAT", "json")
+# bump whenever the quiz prompt changes, so cached quizzes are not reused
+QUIZ_PROMPT_VERSION = f"v2-{QUIZ_OUTPUT_FORMAT}"
+LLM_MODEL_NAME = "gemini-2.5-flash"
+CONTEXT_SEPARATOR = "\n---\n"  # how context_builder joins retrieved spans
+RETRIEVAL_K = 5  # chunks retrieved per shard of SHARD_SIZE questions
+SHARD_SIZE = 10  # quizzes larger than this are generated as several concurrent calls
+SHARD_CONCURRENCY = 4
+SHARD_RETRIES = 2
+
+
+def create_llm():
+    """
+    Chat model used for quiz generation, behind the rate-limiting, retrying LLM gateway.
+    langchain_google_genai is imported on first use.
+    """
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    from llm_gateway import GatewayChatModel
+
+    return GatewayChatModel(ChatGoogleGenerativeAI(
+        model=LLM_MODEL_NAME,
+        google_api_key=os.environ.get("GOOGLE_API_KEY")
+    ))
+
+
+# ------------------- Prompt -------------------
+JSON_FORMAT_INSTRUCTIONS = """
+            OUTPUT FORMAT:
+            Return ONLY a JSON array, with no markdown fences and no text before or after it.
+            Each element must be an object of exactly this shape:
+            {"question": "What is AI?", "options": {"A": "...", "B": "...", "C": "...", "D": "..."}, "answer": "B"}
+"""
+
+
+def build_quiz_prompt(context_text: str, num_mcqs: int, output_format: str = QUIZ_OUTPUT_FORMAT) -> str:
+    if output_format == "json":
+        return f"""
+            Generate {num_mcqs} multiple-choice questions (MCQs) from the following text.
+            generate mcqs in that language which user tells you by default generate quiz in English language
+            Each question has four options A-D and exactly one correct answer.
+
+            CRITICAL INSTRUCTIONS:
+            1. Do NOT use phrases like "provided text," "given text," "as in the text," or "According to the text."
+            2. Instead, refer to the actual topic or subject matter.
+            {JSON_FORMAT_INSTRUCTIONS}
+        Text:
+        {context_text}
+        """
+    return f"""
+            Generate {num_mcqs} multiple-choice questions (MCQs) from the following text.
+            generate mcqs in that language which user tells you by default generate quiz in English language
+            Format each question clearly with options and mark the correct answer at the end.
+
+            CRITICAL INSTRUCTIONS:
+            1. Do NOT use phrases like "provided text," "given text," "as in the text," or "According to the text."
+            2. Instead, refer to the actual topic or subject matter.
+            3. Start directly with the first question, no extra introductory text.
+
+            Example format:
+            Q1. What is AI?
+            A) Option 1
+            B) Option 2
+            C) Option 3
+            D) Option 4
+            Answer: B
+
+        Text:
+        {context_text}
+        """
+
+
+# ------------------- Parser -------------------
+MCQ_PATTERN = r"""Q\d*[\.\)]?\s*([\s\S]*?)
+                  \s*A[\)\.:]\s*([\s\S]*?)
+                  \s*B[\)\.:]\s*([\s\S]*?)
+                  \s*C[\)\.:]\s*([\s\S]*?)
+                  \s*D[\)\.:]\s*([\s\S]*?)
+                  \s*Answer[:\s]*([ABCD])
+                """
+
+
+def parse_mcqs(output_text: str) -> List[Dict]:
+    """Parse free-form "Q1. ... A) ... Answer: B" model output into quiz_data dicts."""
+    output_text = re.sub(r'(?i)question\s*\d*[:.]', lambda m: f"Q", output_text)
+    output_text = output_text.replace("Option ", "").replace("Answer:", "Answer:")
+
+    matches = re.findall(MCQ_PATTERN, output_text, re.IGNORECASE | re.VERBOSE)
+
+    quiz_data = []
+    for q in matches:
+        question_text, A, B, C, D, ans = q
+        clean = lambda s: re.sub(r'\s+', ' ', s.strip())
+        quiz_data.append({
+            "question": clean(question_text),
+            "options": {"A": clean(A), "B": clean(B), "C": clean(C), "D": clean(D)},
+            "answer": ans.strip().upper()
+        })
+    return quiz_data
+
+
+OPTION_LABELS = ("A", "B", "C", "D")
+
+
+def validate_mcq(obj) -> Optional[Dict]:
+    """
+    Check one decoded JSON object against the MCQ schema and normalise it to the
+    quiz_data shape. Options may be an {"A": ..} object or a list of four strings.
+    Returns None if the object is not a usable question.
+    """
+    if not isinstance(obj, dict):
+        return None
+    question = obj.get("question")
+    options = obj.get("options")
+    answer = obj.get("answer")
+    if isinstance(options, list) and len(options) == 4:
+        options = dict(zip(OPTION_LABELS, options))
+    if not isinstance(question, str) or not isinstance(options, dict) or not isinstance(answer, str):
+        return None
+
+    clean = lambda s: re.sub(r'\s+', ' ', s.strip())
+    option_texts = {}
+    for label in OPTION_LABELS:
+        text = options.get(label, options.get(label.lower()))
+        if not isinstance(text, (str, int, float)) or not str(text).strip():
+            return None
+        option_texts[label] = clean(str(text))
+
+    answer = answer.strip().upper()[:1]
+    if not question.strip() or answer not in OPTION_LABELS:
+        return None
+    return {"question": clean(question), "options": option_texts, "answer": answer}
+
+
+def _strip_fences(text: str) -> str:
+    text = text.strip()
+    if text.startswith("```"):
+        text = re.sub(r'^```[a-zA-Z]*\s*', '', text)
+        text = re.sub(r'\s*```$', '', text)
+    return text
+
+
+def parse_mcqs_json(output_text: str) -> List[Dict]:
+    """
+    Parse a JSON array of MCQ objects. If the output as a whole is not valid JSON
+    (truncated, stray prose, one broken object), every object that does decode and
+    validate is salvaged individually.
+    """
+    text = _strip_fences(output_text)
+    try:
+        data = json.loads(text)
+    except ValueError:
+        data = None
+    if isinstance(data, dict):
+        data = data.get("questions", data.get("mcqs", [data]))
+    if isinstance(data, list):
+        return [mcq for mcq in map(validate_mcq, data) if mcq]
+
+    # Salvage: decode object by object, resuming after each one (or after a bad '{').
+    decoder = json.JSONDecoder()
+    quiz_data = []
+    pos = text.find("{")
+    while pos != -1:
+        try:
+            obj, end = decoder.raw_decode(text, pos)
+        except ValueError:
+            pos = text.find("{", pos + 1)
+            continue
+        mcq = validate_mcq(obj)
+        if mcq:
+            quiz_data.append(mcq)
+            pos = text.find("{", end)
+        else:
+            pos = text.find("{", pos + 1)
+    return quiz_data
+
+
+def parse_quiz_output(output_text: str) -> List[Dict]:
+    """Structured JSON parsing first, the regex parser if that yields nothing."""
+    with span("quiz.parse", chars=len(output_text)):
+        if "{" in output_text:
+            quiz_data = parse_mcqs_json(output_text)
+            if quiz_data:
+                return quiz_data
+            incr("parse_json_fallbacks")
+        quiz_data = parse_mcqs(output_text)
+    if not quiz_data:
+        incr("parse_failures")
+    return quiz_data
+
+
+class MCQStreamParser:
+    """
+    Incremental version of `parse_mcqs` for streamed model output. `feed` returns the
+    questions completed by the new text: a block is complete once its "Answer: X"
+    line has arrived, and only the unconsumed tail of the buffer is ever re-scanned.
+    """
+
+    ANSWER_PATTERN = re.compile(r'Answer[:\s]*[ABCD](?=\W)', re.IGNORECASE)
+
+    def __init__(self):
+        self._buffer = ""
+
+    def feed(self, text: str) -> List[Dict]:
+        self._buffer += text
+        completed = []
+        while True:
+            match = self.ANSWER_PATTERN.search(self._buffer)
+            if not match:
+                break
+            completed.extend(parse_mcqs(self._buffer[:match.end()]))
+            self._buffer = self._buffer[match.end():]
+        return completed
+
+    def close(self) -> List[Dict]:
+        """Parse whatever is left once the stream has ended (e.g. a final "Answer: C")."""
+        remainder, self._buffer = self._buffer, ""
+        return parse_mcqs(remainder)
+
+
+class JSONMCQStreamParser:
+    """
+    Incremental parser for a streamed JSON array of MCQ objects. `feed` only searches
+    new text for a '}' that may close the current object, then hands the object to
+    the json decoder; each object is decoded about once per '}' it contains, so the
+    whole stream costs a small multiple of `parse_mcqs_json` on the finished output
+    (see benchmarks/bench_parser.py) while each question is returned as soon as it closes.
+    """
+
+    MAX_OBJECT_CHARS = 20000  # an object still open after this is a wrapper, e.g. {"questions": [...]}: look inside
+
+    def __init__(self):
+        self._buffer = ""  # text from the start of the unfinished object on
+        self._pos = 0  # where the search for the next '}' (or '{') resumes
+        self._start = -1  # start of the unfinished object, -1 until its '{' arrives
+        self._decoder = json.JSONDecoder()
+        self._emitted = 0
+        self._text = []
+
+    def feed(self, text: str) -> List[Dict]:
+        self._text.append(text)
+        if "}" not in text:
+            self._buffer += text  # nothing can close without a '}': most pieces stop here
+            return []
+        buf = self._buffer + text
+        start, pos = self._start, self._pos
+        completed = []
+        while True:
+            if start < 0:
+                start = buf.find("{", pos)
+                if start < 0:
+                    pos = len(buf)
+                    break
+                pos = start
+            close = buf.find("}", pos)
+            if close < 0:
+                pos = len(buf)
+                break
+            try:
+                obj, end = self._decoder.raw_decode(buf, start)
+            except json.JSONDecodeError as e:
+                incomplete = e.pos > close or e.msg.startswith("Unterminated string")
+                if incomplete and close - start < self.MAX_OBJECT_CHARS:
+                    pos = close + 1  # the '}' closed a nested object or is inside a string
+                else:
+                    start, pos = -1, start + 1  # not an object: resume at the next '{'
+                continue
+            mcq = validate_mcq(obj)
+            if mcq:
+                completed.append(mcq)
+            start, pos = -1, end
+
+        # Keep only the unfinished object, if any.
+        keep_from = start if start >= 0 else pos
+        self._buffer = buf[keep_from:]
+        self._pos = pos - keep_from
+        self._start = 0 if start >= 0 else -1
+        self._emitted += len(completed)
+        return completed
+
+    def close(self) -> List[Dict]:
+        """If nothing could be parsed incrementally, fall back to parsing the whole output."""
+        self._buffer = ""
+        if self._emitted:
+            return []
+        return parse_quiz_output("".join(self._text))
+
+
+def make_stream_parser(output_format: str = QUIZ_OUTPUT_FORMAT):
+    return JSONMCQStreamParser() if output_format == "json" else MCQStreamParser()
+
+
+# ------------------- Generation -------------------
+def num_shards(num_mcqs: int) -> int:
+    return max(1, -(-num_mcqs // SHARD_SIZE))
+
+
+def retrieval_k(num_mcqs: int) -> int:
+    """Chunks to retrieve for a quiz: RETRIEVAL_K per shard, and at least one per question."""
+    return max(RETRIEVAL_K * num_shards(num_mcqs), num_mcqs)
+
+
+def _invoke(llm, prompt: str) -> str:
+    result = llm.invoke(prompt)
+    return getattr(result, "content", None) or getattr(result, "output_text", "")
+
+
+def _question_key(mcq: Dict) -> str:
+    return re.sub(r'[\W_]+', ' ', mcq["question"].lower()).strip()
+
+
+def stream_quiz(llm, context_text: str, num_mcqs: int) -> Iterator[Dict]:
+    """Yield each question as soon as the model has finished writing it."""
+    parser = make_stream_parser()
+    for chunk in llm.stream(build_quiz_prompt(context_text, num_mcqs)):
+        text = chunk.content if isinstance(chunk.content, str) else "".join(
+            part.get("text", "") if isinstance(part, dict) else str(part) for part in chunk.content)
+        yield from parser.feed(text)
+    yield from parser.close()
+
+
+@traced("quiz.generate")
+def generate_quiz(llm, context_text: str, num_mcqs: int,
+                  on_question: Optional[Callable[[Dict], None]] = None) -> List[Dict]:
+    """
+    Generate `num_mcqs` questions from `context_text`. Up to SHARD_SIZE questions are
+    asked for in one call; larger quizzes go through `generate_quiz_sharded`.
+    With `on_question`, the single call is streamed and the callback receives each
+    question as soon as it is parsed (always on the calling thread).
+    LLM errors of the single-call path are raised to the caller.
+    """
+    if num_mcqs > SHARD_SIZE:
+        quiz_data = generate_quiz_sharded(llm, context_text.split(CONTEXT_SEPARATOR), num_mcqs, on_question)
+    elif on_question is None:
+        quiz_data = parse_quiz_output(_invoke(llm, build_quiz_prompt(context_text, num_mcqs)))
+    else:
+        quiz_data = []
+        for mcq in stream_quiz(llm, context_text, num_mcqs):
+            quiz_data.append(mcq)
+            on_question(mcq)
+        if not quiz_data:
+            incr("parse_failures")
+    incr("quiz_questions", len(quiz_data))
+    return quiz_data
+
+
+def generate_quiz_sharded(llm, context_chunks: List[str], num_mcqs: int,
+                          on_question: Optional[Callable[[Dict], None]] = None) -> List[Dict]:
+    """
+    Split the quiz into shards of at most SHARD_SIZE questions, give each shard its own
+    round-robin slice of the retrieved chunks and run the shard calls concurrently.
+    Shards that raise or return nothing parseable are retried (only those shards),
+    up to SHARD_RETRIES times. Questions are de-duplicated and merged in the order
+    their shards finish; `on_question` is called for each one as it is accepted.
+    """
+    shards = num_shards(num_mcqs)
+    sizes = [num_mcqs // shards + (1 if i < num_mcqs % shards else 0) for i in range(shards)]
+    chunks = [c for c in context_chunks if c.strip()] or [""]
+    contexts = []
+    for i in range(shards):
+        own = chunks[i::shards] or [chunks[i % len(chunks)]]
+        contexts.append(CONTEXT_SEPARATOR.join(own))
+
+    def run_shard(i: int) -> List[Dict]:
+        try:
+            return parse_quiz_output(_invoke(llm, build_quiz_prompt(contexts[i], sizes[i])))
+        except Exception as e:
+            print(f"Quiz shard {i + 1}/{shards} failed: {e}")
+            return []
+
+    quiz_data = []
+    seen = set()
+    pending = list(range(shards))
+    with ThreadPoolExecutor(max_workers=min(SHARD_CONCURRENCY, shards)) as pool:
+        for _ in range(1 + SHARD_RETRIES):
+            futures = {pool.submit(run_shard, i): i for i in pending}
+            failed = []
+            for future in as_completed(futures):
+                i = futures[future]
+                shard_quiz = future.result()
+                if not shard_quiz:
+                    failed.append(i)
+                    continue
+                for mcq in shard_quiz[:sizes[i]]:
+                    key = _question_key(mcq)
+                    if key and key not in seen and len(quiz_data) < num_mcqs:
+                        seen.add(key)
+                        quiz_data.append(mcq)
+                        if on_question:
+                            on_question(mcq)
+            pending = failed
+            if not pending:
+                break
+    return quiz_data
@@ -0,0 +1,314 @@
+import streamlit as st
+import os
+import hashlib
+from typing import TypedDict, Optional, List, Dict
+from context_builder import CONTEXT_TOKEN_BUDGET
+from rag_pipeline import run_rag_pipeline
+from text_extraction import extract_text_cached, get_extraction_cache, hash_stream
+from quiz_cache import get_quiz_cache
+from quiz_generation import create_llm, num_shards, retrieval_k
+from quiz_pipeline import quiz_for_context, quiz_to_docx
+from database import save_quiz
+from sqlite_store import connect, data_path
+from tracing import serve_metrics, traced
+
+# Streamlit re-executes the page script on every interaction, but imported modules
+# are loaded once per process: the graph state, the nodes and the cached resources
+# below are therefore only defined and built once.
+
+CHECKPOINT_DB_PATH = os.environ.get("QUIZ_CHECKPOINT_DB_PATH") or data_path("quiz_checkpoints.db")
+# When set, quizzes are generated by quiz_service.py at this URL instead of in the session.
+QUIZ_SERVICE_URL = os.environ.get("QUIZ_SERVICE_URL", "").rstrip("/")
+# When set, this process serves /metrics and /metrics.json on that port.
+METRICS_PORT = int(os.environ.get("QUIZ_METRICS_PORT", "0"))
+
+
+# ------------------- Cached Resources -------------------
+@st.cache_resource(show_spinner=False)
+def get_llm():
+    """The chat model client, created once per process (None if it cannot be created)."""
+    try:
+        return create_llm()
+    except Exception as e:
+        print(f"LLM Setup Error: {e}")
+        return None
+
+
+@st.cache_resource(show_spinner=False)
+def start_metrics_server():
+    """
+    Per-stage latency and counters of this Streamlit process, started once. If the port
+    cannot be bound (in use, or taken by another Streamlit worker), metrics are disabled:
+    the None result is cached, so the bind is not retried on every rerun.
+    """
+    if METRICS_PORT:
+        try:
+            return serve_metrics(METRICS_PORT)
+        except OSError as e:
+            print(f"Metrics server disabled: cannot listen on port {METRICS_PORT}: {e}")
+    return None
+
+
+class QuizState(TypedDict, total=False):
+    # Everything in here is checkpointed after each node, so it only holds small values:
+    # the uploaded file travels in config["configurable"]["file"] and the extracted text
+    # stays in the extraction cache under file_hash.
+    manual_topic: str
+    file_hash: str
+    context_text: str
+    quiz_data: List[Dict]
+    num_mcqs: int
+    regenerate: bool
+
+
+def input_hash(file, manual_topic: str) -> str:
+    """Hash identifying the quiz input: the uploaded file's bytes or the typed topic."""
+    if file:
+        return hash_stream(file)
+    return hashlib.sha256(manual_topic.encode('utf-8')).hexdigest()
+
+
+def source_text(state: QuizState, config: Optional[Dict] = None) -> str:
+    """The full input text, from the typed topic or the extraction cache."""
+    if state.get("manual_topic"):
+        return state["manual_topic"]
+    text = get_extraction_cache().get_text(state.get("file_hash", ""))
+    if text is None:
+        # Evicted since extraction; re-extract if the upload is still at hand.
+        file = ((config or {}).get("configurable") or {}).get("file")
+        if file:
+            _, text = extract_text_cached(file.name, file)
+    return text or ""
+
+
+# ------------------- Upload Node -------------------
+def upload_node(state: QuizState) -> QuizState:
+    def toggle_use_text():
+        st.session_state.use_text = not st.session_state.use_text
+
+    # Keep the checkbox in the correct location
+    use_text = st.checkbox("Or type a topic manually", value=st.session_state.use_text, on_change=toggle_use_text)
+    file = None
+    text_input = ""
+
+    if not st.session_state.use_text:
+        file = st.file_uploader("📂 Upload PDF or DOCX", type=["pdf", "docx"])
+    else:
+        text_input = st.text_area("Enter topic or text", height=150, key="manual_text_input")
+
+    num_mcqs = st.number_input("Number of MCQs", 1, 50, state.get("num_mcqs", 5), 1)
+    regenerate = st.checkbox("🔄 Regenerate fresh (ignore cached quiz)", value=state.get("regenerate", False))
+    return {"file": file, "manual_topic": text_input, "num_mcqs": int(num_mcqs), "regenerate": regenerate}
+
+
+# ------------------- Extract Text Node -------------------
+@traced("node.extract_text")
+def extract_text_node(state: QuizState, config: Dict) -> QuizState:
+    file = config["configurable"].get("file")
+    manual_topic = state.get("manual_topic", "")
+    file_hash = state.get("file_hash", "")
+
+    if file and not manual_topic:
+        # Known uploads come from the extraction cache; new PDFs are extracted on a
+        # process pool, off the script thread's single core.
+        file_hash, raw_text = extract_text_cached(file.name, file)
+    else:
+        raw_text = manual_topic
+
+    if not raw_text:
+        # Use st.warning instead of st.error here, as the graph execution might stop
+        st.warning("Please upload a file or enter a topic.")
+
+    return {"file_hash": file_hash}
+
+
+# ------------------- Retrieve Context Node -------------------
+@traced("node.retrieve_context")
+def retrieve_context_node(state: QuizState, config: Dict) -> QuizState:
+    raw_text = source_text(state, config).strip()
+    if not raw_text:
+        return {"context_text": ""}
+
+    manual_topic = state.get("manual_topic", "").strip()
+    num_mcqs = state.get("num_mcqs", 5)
+
+    # Without a topic the pipeline samples chunks covering the whole document. Each shard
+    # of the quiz gets its own CONTEXT_TOKEN_BUDGET tokens.
+    context_text = run_rag_pipeline(raw_text, manual_topic, state.get("file_hash", "manual_topic_no_hash"),
+                                    k=retrieval_k(num_mcqs), token_budget=CONTEXT_TOKEN_BUDGET * num_shards(num_mcqs))
+    if not context_text:
+        st.warning("RAG pipeline returned empty context. Using first 1000 chars as fallback.")
+        context_text = raw_text[:1000]
+    return {"context_text": context_text}
+
+
+# ------------------- Quiz Card -------------------
+def render_quiz_card(i: int, q: Dict):
+    question_text = q['question'].strip()
+    st.markdown(f"""
+    <div class='quiz-card' style='animation-delay:{i * 0.2}s'>
+        <div class='quiz-question'>Q{i + 1}. {question_text}</div>
+        <div class='quiz-option'>A) {q['options']['A']}</div>
+        <div class='quiz-option'>B) {q['options']['B']}</div>
+        <div class='quiz-option'>C) {q['options']['C']}</div>
+        <div class='quiz-option'>D) {q['options']['D']}</div>
+        <div style='color: #00FFE0; margin-top: 15px; font-weight: bold;'>Correct Answer: {q['answer']}</div>
+    </div>
+    """, unsafe_allow_html=True)
+
+
+# ------------------- Generate Quiz Node -------------------
+@traced("node.generate_quiz")
+def generate_quiz_node(state: QuizState) -> QuizState:
+    context_text = state.get("context_text", "")
+    num_mcqs = state.get("num_mcqs", 5)
+
+    llm = get_llm()
+    if not context_text or not llm:
+        # Use st.warning instead of st.error here, as the graph execution might stop
+        st.warning("LLM not initialized or empty input. Skipping quiz generation.")
+        return {"quiz_data": []}
+
+    # ---------------- LLM Quiz Generation ----------------
+    # Cards are drawn into a temporary slot as each question finishes streaming;
+    # display_quiz_node replaces them with the final quiz.
+    stream_slot = st.empty()
+    stream_area = stream_slot.container()
+    streamed = []
+
+    def show_question(q: Dict):
+        with stream_area:
+            render_quiz_card(len(streamed), q)
+        streamed.append(q)
+
+    try:
+        # Served from the quiz cache when possible; sessions asking for the same prompt at
+        # the same time share one LLM call. Large quizzes are split into concurrent shards.
+        # Errors propagate so the run stops with the checkpoint still after retrieval;
+        # a retry then resumes here instead of extracting and embedding again.
+        quiz_data, cached = quiz_for_context(llm, context_text, num_mcqs, state.get("regenerate", False),
+                                             on_question=show_question)
+    finally:
+        stream_slot.empty()
+
+    if not quiz_data:
+        st.warning(
+            "⚠️ The model returned text but the format was unclear. Try shortening or simplifying your input.")
+    elif cached:
+        stats = get_quiz_cache().stats()
+        st.caption(f"♻️ Loaded from quiz cache ({stats['hits']} hits / {stats['misses']} misses). "
+                   "Tick 'Regenerate fresh' for new questions.")
+
+    return {"quiz_data": quiz_data}
+
+
+# ------------------- Quiz Service Client -------------------
+def generate_via_service(file, manual_topic: str, num_mcqs: int, regenerate: bool) -> List[Dict]:
+    """Submit the quiz to the quiz service and draw each question as the service streams it."""
+    from quiz_service import stream_job, submit_job
+
+    if file:
+        job_id = submit_job(QUIZ_SERVICE_URL, num_mcqs, file_name=file.name, file_bytes=file.getvalue(),
+                            regenerate=regenerate)
+    else:
+        job_id = submit_job(QUIZ_SERVICE_URL, num_mcqs, text=manual_topic, topic=manual_topic,
+                            regenerate=regenerate)
+
+    stream_slot = st.empty()
+    stream_area = stream_slot.container()
+    quiz_data = []
+    try:
+        for mcq in stream_job(QUIZ_SERVICE_URL, job_id):
+            with stream_area:
+                render_quiz_card(len(quiz_data), mcq)
+            quiz_data.append(mcq)
+    finally:
+        stream_slot.empty()
+    return quiz_data
+
+
+# ------------------- Display Quiz Node (Updated with stylish cards) -------------------
+@traced("node.display_quiz")
+def display_quiz_node(state: QuizState) -> QuizState:
+    quiz_data = state.get("quiz_data", [])
+    if not quiz_data:
+        return {"quiz_data": []}
+
+    st.subheader("✅ Quiz Generated!")
+
+    # Save quiz history
+    if st.session_state.user:
+        save_quiz(st.session_state.user["id"], quiz_data)
+        st.session_state.history_summaries = None  # reload on the next run
+
+    # Display the quiz using the new custom HTML/CSS
+    st.markdown("<span style='display:none'>.</span>", unsafe_allow_html=True)
+    for i, q in enumerate(quiz_data):
+        # The download button is created below, so we'll only display the Q&A here
+        render_quiz_card(i, q)
+
+    st.markdown("---")
+
+    # --- Download Button ---
+    buf = quiz_to_docx(quiz_data)
+
+    # Use the standard Streamlit download button for consistency with the new style
+    st.download_button("⬇️ Download as Word", buf, "AI_Quiz.docx")
+
+    return {"quiz_data": quiz_data}
+
+
+# ------------------- Graph Setup -------------------
+@st.cache_resource(show_spinner=False)
+def get_checkpointer():
+    """SQLite checkpointer shared by all sessions; the saver serialises access to the connection."""
+    from langgraph.checkpoint.sqlite import SqliteSaver
+
+    return SqliteSaver(connect(CHECKPOINT_DB_PATH))
+
+
+@st.cache_resource(show_spinner=False)
+def get_quiz_graph():
+    """
+    Build and compile the quiz StateGraph once per process. Input widgets (upload_node)
+    are drawn by the page on every rerun, so the graph starts at extraction; state is
+    checkpointed after every node so an interrupted run can resume where it stopped.
+    """
+    from langgraph.graph import StateGraph, END
+
+    graph = StateGraph(QuizState)
+    graph.add_node("extract_text_node", extract_text_node)
+    graph.add_node("retrieve_context_node", retrieve_context_node)
+    graph.add_node("generate_quiz_node", generate_quiz_node)
+    graph.add_node("display_quiz_node", display_quiz_node)
+
+    graph.set_entry_point("extract_text_node")
+    graph.add_edge("extract_text_node", "retrieve_context_node")
+    graph.add_edge("retrieve_context_node", "generate_quiz_node")
+    graph.add_edge("generate_quiz_node", "display_quiz_node")
+    graph.add_edge("display_quiz_node", END)
+
+    # Compile the graph
+    return graph.compile(checkpointer=get_checkpointer())
+
+
+def run_quiz_graph(session_id: str, inputs: QuizState, file=None) -> QuizState:
+    """
+    Run the graph on a thread keyed by session and input hash. If the last run on that
+    thread stopped part-way (an LLM error or a Streamlit rerun) with the same settings,
+    it resumes from the last completed node and reuses its extracted text and context.
+    """
+    app = get_quiz_graph()
+    config = {"configurable": {"thread_id": f"{session_id}:{inputs['file_hash']}", "file": file}}
+
+    snapshot = app.get_state(config)
+    pending = snapshot.next and all(snapshot.values.get(k) == inputs.get(k) for k in ("num_mcqs", "regenerate"))
+    if pending:
+        st.caption(f"⏩ Resuming from {snapshot.next[0]}")
+        result = app.invoke(None, config)
+    else:
+        result = app.invoke(inputs, config)
+
+    # Nothing left to resume; drop the thread so the checkpoint database stays small.
+    get_checkpointer().delete_thread(config["configurable"]["thread_id"])
+    return result
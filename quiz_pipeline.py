@@ -0,0 +1,137 @@
+import threading
+import contextvars
+from concurrent.futures import Future
+from io import BytesIO
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from context_builder import CONTEXT_TOKEN_BUDGET
+from quiz_cache import get_quiz_cache, make_quiz_key
+from quiz_generation import LLM_MODEL_NAME, QUIZ_PROMPT_VERSION, generate_quiz, num_shards, retrieval_k
+from rag_pipeline import run_rag_pipeline
+from single_flight import get_single_flight
+
+# Streamlit-free retrieve -> generate -> parse steps shared by the batch CLI and the quiz service.
+
+
+def retrieve_for_quiz(text: str, file_hash: str, num_mcqs: int, topic: str = "") -> str:
+    """Context for a quiz: RAG chunks for `topic`, or chunks covering the whole text without one."""
+    return run_rag_pipeline(text, topic, file_hash, k=retrieval_k(num_mcqs),
+                            token_budget=CONTEXT_TOKEN_BUDGET * num_shards(num_mcqs)) or text[:1000]
+
+
+class _QuizBroadcast:
+    """
+    Questions of one in-flight generation. Every caller that joins the flight follows
+    them on its own thread, so a caller's callback can fail (a Streamlit rerun, a lost
+    service lease) without affecting the generation or the other callers.
+    """
+
+    def __init__(self):
+        self.questions: List[Dict] = []
+        self.done = False
+        self.future: Future = Future()
+        self._cond = threading.Condition()
+
+    def publish(self, mcq: Dict):
+        with self._cond:
+            self.questions.append(mcq)
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self.done = True
+            self._cond.notify_all()
+
+    def follow(self) -> Iterator[Dict]:
+        """Every question published so far, then each new one until the flight ends."""
+        position = 0
+        while True:
+            with self._cond:
+                while position == len(self.questions) and not self.done:
+                    self._cond.wait()
+                batch = self.questions[position:]
+                if not batch and self.done:
+                    return
+            position += len(batch)
+            yield from batch
+
+
+_broadcasts: Dict[str, _QuizBroadcast] = {}
+_broadcasts_lock = threading.Lock()
+
+
+def quiz_for_context(llm, context_text: str, num_mcqs: int, regenerate: bool = False,
+                     on_question: Optional[Callable[[Dict], None]] = None) -> Tuple[List[Dict], bool]:
+    """
+    Return (quiz_data, cached). Uses the same quiz-cache key as the app, so a quiz made
+    by any entry point is reused by the others; `on_question` also sees cached questions.
+    Identical prompts requested concurrently share one LLM call, run on a background
+    thread: each caller streams its questions from it, and the callers that joined
+    an already running call get the result as cached (cached=True). Only errors of
+    the generation itself are raised to every caller.
+    """
+    quiz_cache = get_quiz_cache()
+    cache_key = make_quiz_key(context_text, num_mcqs, QUIZ_PROMPT_VERSION, LLM_MODEL_NAME)
+    flight_key = f"quiz:{cache_key}:{int(regenerate)}"
+
+    with _broadcasts_lock:
+        broadcast = _broadcasts.get(flight_key)
+        leader = broadcast is None
+        if leader:
+            broadcast = _broadcasts[flight_key] = _QuizBroadcast()
+
+    if leader:
+        ran = []
+
+        def generate() -> List[Dict]:
+            ran.append(True)
+            result = generate_quiz(llm, context_text, num_mcqs, on_question=broadcast.publish)
+            quiz_cache.put(cache_key, result)
+            return result
+
+        def run_flight():
+            try:
+                # The cache is checked first, and again after waiting on another process's call.
+                # Regenerate requests skip it, so they only coalesce with each other.
+                lookup = None if regenerate else lambda: quiz_cache.get(cache_key)
+                quiz_data = get_single_flight().do(flight_key, generate, lookup=lookup)
+                if not ran:
+                    for mcq in quiz_data:
+                        broadcast.publish(mcq)
+                broadcast.future.set_result((quiz_data, not ran))
+            except Exception as e:
+                broadcast.future.set_exception(e)
+            finally:
+                with _broadcasts_lock:
+                    del _broadcasts[flight_key]
+                broadcast.close()
+
+        # copy_context keeps the caller's tracing span as the parent of the generation's spans.
+        threading.Thread(target=contextvars.copy_context().run, args=(run_flight,),
+                         name="quiz-flight", daemon=True).start()
+
+    if on_question:
+        for mcq in broadcast.follow():
+            on_question(mcq)
+    quiz_data, cached = broadcast.future.result()
+    return quiz_data, cached or not leader
+
+
+def quiz_to_docx(quiz_data: List[Dict]) -> BytesIO:
+    """Word document of the quiz with its answer key, ready for a download button."""
+    from docx import Document  # only needed once a quiz is exported
+
+    doc = Document()
+    doc.add_heading("AI Generated Quiz", 0)
+    doc.add_paragraph("--- ANSWER KEY ---")  # Added Answer Key section
+
+    for i, q in enumerate(quiz_data):
+        doc.add_paragraph(f"Q{i + 1}. {q['question']}")
+        for k, v in q["options"].items():
+            doc.add_paragraph(f"{k}) {v}")
+        doc.add_paragraph(f"Correct Answer: {q['answer']}\n")
+
+    buf = BytesIO()
+    doc.save(buf)
+    buf.seek(0)
+    return buf
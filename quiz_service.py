@@ -0,0 +1,431 @@
+"""
+Standalone HTTP quiz-generation service with a persistent job queue.
+
+    python quiz_service.py [--host 127.0.0.1] [--port 8765] [--workers 4]
+    python quiz_service.py --no-http --workers 8     # extra worker-only process
+
+Endpoints:
+    POST /jobs                 submit; JSON {"text"|"topic", "num_mcqs", "regenerate"} or raw
+                               file bytes with ?file_name=notes.pdf&num_mcqs=10[&topic=..]
+    GET  /jobs/<id>            status, questions so far and the final quiz
+    GET  /jobs/<id>/stream     newline-delimited JSON: one line per question as it is
+                               generated, then a final {"status": ...} line
+    GET  /health
+    GET  /metrics              per-stage latency histograms and counters (Prometheus text)
+    GET  /metrics.json         the same with p50/p90/p99 per stage
+
+Jobs live in SQLite, so they survive restarts and any number of worker processes
+can share one queue. A worker holds a lease on its job that a heartbeat renews for
+as long as the job runs; jobs whose lease runs out (a crashed worker) are picked up
+again. Each claim gets its own lease id, and writes under a lease that was taken
+over are dropped, so only the current attempt records questions and the result.
+"""
+import os
+import json
+import time
+import uuid
+import hashlib
+import sqlite3
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, Optional
+from urllib.parse import parse_qs, urlencode, urlparse
+from urllib.request import Request, urlopen
+from sqlite_store import ThreadConnections, data_path
+from tracing import observe, prometheus_text, snapshot, span
+
+SERVICE_DB_PATH = os.environ.get("QUIZ_SERVICE_DB_PATH") or data_path("quiz_jobs.db")
+SERVICE_SPOOL_DIR = os.environ.get("QUIZ_SERVICE_SPOOL_DIR") or data_path(".service_uploads")
+SERVICE_WORKERS = int(os.environ.get("QUIZ_SERVICE_WORKERS", "4"))
+JOB_LEASE_SECONDS = 300  # a running job is re-queued if its worker's heartbeat stops this long
+POLL_INTERVAL = 0.25  # seconds between queue/progress polls
+MAX_CLAIM_BACKOFF = 10.0  # longest wait after repeated claim errors
+MAX_UPLOAD_BYTES = 100 * 1024 * 1024
+MAX_NUM_MCQS = 50
+
+
+# ------------------- Job Queue -------------------
+class JobQueue:
+    """Jobs and their streamed questions in SQLite. One connection per thread."""
+
+    def __init__(self, path: str = SERVICE_DB_PATH):
+        self.path = path
+        self._conns = ThreadConnections(path)
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                request TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                lease_expires REAL,
+                lease_id TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT
+            )
+        """)
+        if "lease_id" not in {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}:
+            conn.execute("ALTER TABLE jobs ADD COLUMN lease_id TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created_at)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS job_questions (
+                job_id TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (job_id, position)
+            ) WITHOUT ROWID
+        """)
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        return self._conns.get()
+
+    def submit(self, request: Dict, job_id: Optional[str] = None) -> str:
+        job_id = job_id or uuid.uuid4().hex
+        self._conn().execute("INSERT INTO jobs (id, status, request, created_at) VALUES (?, 'queued', ?, ?)",
+                             (job_id, json.dumps(request), time.time()))
+        return job_id
+
+    def claim(self) -> Optional[Dict]:
+        """
+        Take the oldest queued job (or one whose lease expired) for this worker. The
+        returned "lease" id must be passed to renew / add_question / finish.
+        """
+        conn = self._conn()
+        now = time.time()
+        lease_id = uuid.uuid4().hex
+        conn.execute("BEGIN IMMEDIATE")  # one claimer at a time across processes
+        try:
+            row = conn.execute(
+                "SELECT id, request, created_at FROM jobs WHERE status='queued' "
+                "OR (status='running' AND lease_expires < ?) ORDER BY created_at LIMIT 1", (now,)).fetchone()
+            if row:
+                conn.execute("UPDATE jobs SET status='running', started_at=?, lease_expires=?, lease_id=?, "
+                             "attempts=attempts+1 WHERE id=?", (now, now + JOB_LEASE_SECONDS, lease_id, row[0]))
+                # Questions streamed by an earlier, abandoned attempt are regenerated.
+                conn.execute("DELETE FROM job_questions WHERE job_id=?", (row[0],))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if not row:
+            return None
+        observe("service.queue_wait", now - row[2])
+        return {"id": row[0], "lease": lease_id, "request": json.loads(row[1])}
+
+    def renew(self, job_id: str, lease_id: str) -> bool:
+        """Extend the lease; False if the job was taken over by another claim."""
+        cur = self._conn().execute("UPDATE jobs SET lease_expires=? WHERE id=? AND lease_id=? AND status='running'",
+                                   (time.time() + JOB_LEASE_SECONDS, job_id, lease_id))
+        return cur.rowcount == 1
+
+    def add_question(self, job_id: str, lease_id: str, position: int, mcq: Dict) -> bool:
+        """Record a question under `lease_id`; False (and nothing written) if the lease was lost."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            held = conn.execute("UPDATE jobs SET lease_expires=? WHERE id=? AND lease_id=? AND status='running'",
+                                (time.time() + JOB_LEASE_SECONDS, job_id, lease_id)).rowcount == 1
+            if held:
+                conn.execute("INSERT OR REPLACE INTO job_questions (job_id, position, data) VALUES (?, ?, ?)",
+                             (job_id, position, json.dumps(mcq)))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return held
+
+    def finish(self, job_id: str, lease_id: str, error: Optional[str] = None) -> bool:
+        """Mark the job done or failed, unless `lease_id` no longer holds it."""
+        cur = self._conn().execute(
+            "UPDATE jobs SET status=?, finished_at=?, error=?, lease_expires=NULL "
+            "WHERE id=? AND lease_id=? AND status='running'",
+            ("failed" if error else "done", time.time(), error, job_id, lease_id))
+        return cur.rowcount == 1
+
+    def get(self, job_id: str, after: int = 0) -> Optional[Dict]:
+        """Job status plus its questions from position `after` on."""
+        conn = self._conn()
+        row = conn.execute("SELECT status, created_at, started_at, finished_at, attempts, error "
+                           "FROM jobs WHERE id=?", (job_id,)).fetchone()
+        if not row:
+            return None
+        questions = [json.loads(data) for (data,) in conn.execute(
+            "SELECT data FROM job_questions WHERE job_id=? AND position>=? ORDER BY position", (job_id, after))]
+        status, created_at, started_at, finished_at, attempts, error = row
+        return {"id": job_id, "status": status, "created_at": created_at, "started_at": started_at,
+                "finished_at": finished_at, "attempts": attempts, "error": error, "questions": questions}
+
+    def counts(self) -> Dict[str, int]:
+        return dict(self._conn().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+
+# ------------------- Workers -------------------
+class LeaseLost(Exception):
+    """The job's lease expired and another worker claimed it; this attempt stops."""
+
+
+def _spool_path(job_id: str) -> str:
+    return os.path.join(SERVICE_SPOOL_DIR, job_id)
+
+
+def run_job(llm, jobs: JobQueue, job: Dict):
+    """Extract, retrieve and generate one job, recording each question as it is accepted."""
+    from quiz_pipeline import quiz_for_context, retrieve_for_quiz
+    from text_extraction import extract_text_cached
+
+    request = job["request"]
+    if request.get("file_name"):
+        with open(_spool_path(job["id"]), "rb") as f:
+            file_hash, text = extract_text_cached(request["file_name"], f)
+    else:
+        text = request.get("text") or request.get("topic", "")
+        file_hash = request["text_hash"]
+    if not text.strip():
+        raise ValueError("no text could be extracted")
+
+    context_text = retrieve_for_quiz(text, file_hash, request["num_mcqs"], request.get("topic", ""))
+    position = 0
+
+    def on_question(mcq: Dict):
+        nonlocal position
+        if not jobs.add_question(job["id"], job["lease"], position, mcq):
+            raise LeaseLost(job["id"], job["lease"])
+        position += 1
+
+    quiz_data, _ = quiz_for_context(llm, context_text, request["num_mcqs"], request.get("regenerate", False),
+                                    on_question=on_question)
+    if not quiz_data:
+        raise ValueError("the model output contained no parseable questions")
+
+
+def _heartbeat(jobs: JobQueue, job: Dict, done: threading.Event):
+    """Renew the job's lease until it finishes, so slow extraction or throttled LLM calls keep it."""
+    while not done.wait(JOB_LEASE_SECONDS / 3):
+        if not jobs.renew(job["id"], job["lease"]):
+            print(f"Quiz job {job['id']}: lease lost to another worker.")
+            return
+
+
+def _finish(jobs: JobQueue, job: Dict, error: Optional[str] = None) -> bool:
+    try:
+        return jobs.finish(job["id"], job["lease"], error=error)
+    except sqlite3.Error as e:
+        # The lease lapses and the job is claimed again; the worker keeps going.
+        print(f"Quiz job {job['id']}: could not record the result: {e}")
+        return False
+
+
+def worker_loop(llm, jobs: JobQueue, stop: threading.Event):
+    backoff = POLL_INTERVAL
+    while not stop.is_set():
+        try:
+            job = jobs.claim()
+        except Exception as e:
+            # e.g. "database is locked" with many worker processes; the thread must survive it.
+            print(f"Quiz worker could not claim a job: {e}")
+            stop.wait(backoff)
+            backoff = min(backoff * 2, MAX_CLAIM_BACKOFF)
+            continue
+        backoff = POLL_INTERVAL
+        if job is None:
+            stop.wait(POLL_INTERVAL)
+            continue
+        done = threading.Event()
+        threading.Thread(target=_heartbeat, args=(jobs, job, done), daemon=True).start()
+        try:
+            with span("service.job", job_id=job["id"]):
+                run_job(llm, jobs, job)
+        except LeaseLost as e:
+            if e.args != (job["id"], job["lease"]):
+                # Not this attempt's own fenced write: fail the job like any other error.
+                finished = _finish(jobs, job, error=f"lease lost: {e}")
+            else:
+                print(f"Quiz job {job['id']} was taken over by another worker; dropping this attempt.")
+                continue
+        except Exception as e:
+            print(f"Quiz job {job['id']} failed: {e}")
+            finished = _finish(jobs, job, error=str(e))
+        else:
+            finished = _finish(jobs, job)
+        finally:
+            done.set()
+        if finished:
+            # A superseded attempt leaves the spooled upload to the worker that now owns the job.
+            try:
+                os.remove(_spool_path(job["id"]))
+            except OSError:
+                pass
+
+
+def start_workers(jobs: JobQueue, count: int) -> threading.Event:
+    from quiz_generation import create_llm
+
+    llm = create_llm()
+    stop = threading.Event()
+    for i in range(count):
+        threading.Thread(target=worker_loop, args=(llm, jobs, stop), name=f"quiz-worker-{i}", daemon=True).start()
+    return stop
+
+
+# ------------------- HTTP Server -------------------
+class QuizServiceHandler(BaseHTTPRequestHandler):
+    jobs: JobQueue = None  # set by serve()
+
+    def _send_json(self, status: int, body: Dict):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _job_id(self, path: str) -> str:
+        return path.split("/")[2] if path.count("/") >= 2 else ""
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/jobs":
+            return self._send_json(404, {"error": "not found"})
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_UPLOAD_BYTES:
+            return self._send_json(413, {"error": "upload too large"})
+        body = self.rfile.read(length)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+
+        try:
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                payload = json.loads(body or b"{}")
+                if not isinstance(payload, dict):
+                    raise ValueError("JSON body must be an object")
+                params.update(payload)
+                body = None
+            request = {
+                "num_mcqs": max(1, min(int(params.get("num_mcqs", 5)), MAX_NUM_MCQS)),
+                "topic": str(params.get("topic", "")),
+                "regenerate": str(params.get("regenerate", "")).lower() in ("1", "true"),
+            }
+        except (TypeError, ValueError) as e:  # e.g. "num_mcqs": null or a list
+            return self._send_json(400, {"error": f"bad request: {e}"})
+
+        if body:
+            if not params.get("file_name", "").lower().endswith((".pdf", ".docx")):
+                return self._send_json(400, {"error": "file_name must be a .pdf or .docx"})
+            request["file_name"] = params["file_name"]
+        else:
+            text = str(params.get("text", "")) or request["topic"]
+            if not text.strip():
+                return self._send_json(400, {"error": "send a file, text or topic"})
+            request["text"] = text
+            request["text_hash"] = hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+        job_id = uuid.uuid4().hex
+        if body:
+            # The upload is spooled before the job is queued, so a worker never sees a job without its file.
+            os.makedirs(SERVICE_SPOOL_DIR, exist_ok=True)
+            with open(_spool_path(job_id), "wb") as f:
+                f.write(body)
+        self.jobs.submit(request, job_id)
+        self._send_json(202, {"id": job_id, "status": "queued"})
+
+    def do_GET(self):
+        path = urlparse(self.path).path.rstrip("/")
+        if path == "/health":
+            return self._send_json(200, {"status": "ok", "jobs": self.jobs.counts()})
+        if path == "/metrics.json":
+            return self._send_json(200, dict(snapshot(), jobs=self.jobs.counts()))
+        if path == "/metrics":
+            body = prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if not path.startswith("/jobs/"):
+            return self._send_json(404, {"error": "not found"})
+
+        job = self.jobs.get(self._job_id(path))
+        if job is None:
+            return self._send_json(404, {"error": "unknown job"})
+        if not path.endswith("/stream"):
+            return self._send_json(200, job)
+
+        # Streamed as NDJSON until the job ends; HTTP/1.0 so the end of the body is the close.
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        sent = 0
+        while True:
+            job = self.jobs.get(job["id"], after=sent)
+            for mcq in job["questions"]:
+                self.wfile.write((json.dumps(mcq) + "\n").encode("utf-8"))
+            self.wfile.flush()
+            sent += len(job["questions"])
+            if job["status"] in ("done", "failed"):
+                break
+            time.sleep(POLL_INTERVAL)
+        self.wfile.write((json.dumps({"status": job["status"], "error": job["error"]}) + "\n").encode("utf-8"))
+
+    def log_message(self, format, *args):
+        pass  # one line per poll would drown the worker output
+
+
+def serve(host: str, port: int, jobs: JobQueue):
+    QuizServiceHandler.jobs = jobs
+    server = ThreadingHTTPServer((host, port), QuizServiceHandler)
+    print(f"Quiz service listening on http://{host}:{port}")
+    server.serve_forever()
+
+
+# ------------------- Client -------------------
+def submit_job(base_url: str, num_mcqs: int, text: str = "", topic: str = "", file_name: str = "",
+               file_bytes: bytes = b"", regenerate: bool = False) -> str:
+    """Queue a quiz on a running service and return the job id."""
+    if file_bytes:
+        query = urlencode({"file_name": file_name, "num_mcqs": num_mcqs, "topic": topic,
+                           "regenerate": int(regenerate)})
+        req = Request(f"{base_url}/jobs?{query}", data=file_bytes,
+                      headers={"Content-Type": "application/octet-stream"})
+    else:
+        body = {"text": text, "topic": topic, "num_mcqs": num_mcqs, "regenerate": regenerate}
+        req = Request(f"{base_url}/jobs", data=json.dumps(body).encode("utf-8"),
+                      headers={"Content-Type": "application/json"})
+    with urlopen(req, timeout=60) as resp:
+        return json.loads(resp.read())["id"]
+
+
+def stream_job(base_url: str, job_id: str, timeout: float = 600) -> Iterator[Dict]:
+    """Yield each question of a job as the service produces it; raises if the job fails."""
+    with urlopen(f"{base_url}/jobs/{job_id}/stream", timeout=timeout) as resp:
+        for line in resp:
+            item = json.loads(line)
+            if "status" in item and "question" not in item:
+                if item["status"] != "done":
+                    raise RuntimeError(item.get("error") or f"job {item['status']}")
+                return
+            yield item
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=SERVICE_WORKERS, help="worker threads in this process")
+    parser.add_argument("--no-http", action="store_true", help="only run workers against the shared queue")
+    args = parser.parse_args()
+
+    jobs = JobQueue()
+    if args.workers > 0:
+        start_workers(jobs, args.workers)
+    if args.no_http:
+        threading.Event().wait()
+    else:
+        serve(args.host, args.port, jobs)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,66 +1,245 @@
 import os
-import chromadb
-from typing import Optional
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_chroma import Chroma
-from langchain_core.documents import Document
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Optional, List, TYPE_CHECKING
+from context_builder import (CONTEXT_SEPARATOR, CONTEXT_TOKEN_BUDGET, MMR_FETCH_FACTOR, Chunk, build_context,
+                             build_coverage_context)
+from embedding_cache import get_embedding_cache
+from llm_gateway import estimate_tokens
+from single_flight import get_single_flight
+from sqlite_store import connect, data_path
+from tracing import incr, span, traced
+
+# chromadb and the langchain packages take seconds to import, so they are only
+# imported once a document is actually indexed.
+if TYPE_CHECKING:
+    from langchain_chroma import Chroma
+    from langchain_core.documents import Document
+    from langchain_core.embeddings import Embeddings
 
 google_api_key = os.environ.get("GOOGLE_API_KEY")
 
-PERSIST_DIRECTORY = "./chroma_db"
+PERSIST_DIRECTORY = data_path("chroma_db")
 COLLECTION_NAME = "quiz_generator_documents"
+EMBEDDING_MODEL_NAME = "gemini-embedding-001"
+
+
+class CachedEmbeddings:
+    """
+    Wraps an embedding model so that each chunk text is only embedded once per model;
+    repeats are served from the shared content-addressed embedding cache.
+    Implements the langchain Embeddings interface (embed_documents / embed_query).
+    """
+
+    def __init__(self, embeddings: "Embeddings", model_name: str):
+        self.embeddings = embeddings
+        self.model_name = model_name
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = get_embedding_cache().embed(self.model_name, texts, self.embeddings.embed_documents)
+        return [v.tolist() for v in vectors]
+
+    def embed_query(self, text: str) -> List[float]:
+        # Query embeddings use a different task type, so they get their own key space.
+        vectors = get_embedding_cache().embed(f"{self.model_name}:query", [text],
+                                              lambda texts: [self.embeddings.embed_query(texts[0])])
+        return vectors[0].tolist()
+
+
+embedding_model = None
+chroma_client = None
+_backends_initialized = False
+_backends_lock = threading.Lock()
+
+
+def _init_backends() -> bool:
+    """Create the embedding model and the Chroma client on first use."""
+    global embedding_model, chroma_client, _backends_initialized
+    with _backends_lock:
+        if not _backends_initialized:
+            _backends_initialized = True
+            try:
+                import chromadb
+                from langchain_google_genai import GoogleGenerativeAIEmbeddings
+                from llm_gateway import GatewayEmbeddings
+
+                # Cache misses go through the gateway, which rate-limits and retries them.
+                embedding_model = CachedEmbeddings(
+                    GatewayEmbeddings(GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL_NAME)),
+                    EMBEDDING_MODEL_NAME)
+                chroma_client = chromadb.PersistentClient(path=PERSIST_DIRECTORY)
+
+            except Exception as e:
+                print(
+                    f"⚠️ RAG Pipeline Error: Failed to initialize embeddings or ChromaDB. Ensure GOOGLE_API_KEY is set. Error: {e}")
+                embedding_model = None
+                chroma_client = None
+    return embedding_model is not None and chroma_client is not None
+
+
+
+# ------------------- Document Registry -------------------
+# One row per indexed file hash, so "is this document already embedded?" is a
+# primary-key lookup instead of a scan over every Chroma collection.
+SHARED_COLLECTION = os.environ.get("RAG_SHARED_COLLECTION", "1") == "1"
+REGISTRY_PATH = os.path.join(PERSIST_DIRECTORY, "document_registry.db")
+
+_registry_lock = threading.Lock()
+_registry_conn = None
+
+
+def _registry() -> sqlite3.Connection:
+    global _registry_conn
+    if _registry_conn is None:
+        conn = connect(REGISTRY_PATH)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS indexed_documents (
+                file_hash TEXT PRIMARY KEY,
+                collection_name TEXT NOT NULL,
+                chunk_count INTEGER NOT NULL,
+                created_at TEXT NOT NULL
+            )
+        """)
+        conn.commit()
+        _registry_conn = conn
+    return _registry_conn
+
+
+def lookup_document(file_hash: str) -> Optional[str]:
+    """Name of the collection holding `file_hash`, or None if it has not been indexed."""
+    with _registry_lock:
+        row = _registry().execute("SELECT collection_name FROM indexed_documents WHERE file_hash=?",
+                                  (file_hash,)).fetchone()
+    return row[0] if row else None
+
+
+def register_document(file_hash: str, collection_name: str, chunk_count: int):
+    with _registry_lock:
+        conn = _registry()
+        conn.execute("INSERT OR REPLACE INTO indexed_documents (file_hash, collection_name, chunk_count, created_at) "
+                     "VALUES (?, ?, ?, ?)",
+                     (file_hash, collection_name, chunk_count, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+        conn.commit()
+
+
+# ------------------- Batched Embedding -------------------
+EMBED_BATCH_SIZE = int(os.environ.get("RAG_EMBED_BATCH_SIZE", "50"))
+EMBED_CONCURRENCY = int(os.environ.get("RAG_EMBED_CONCURRENCY", "4"))
+# Requests/tokens per minute for embeddings are enforced by llm_gateway (RAG_EMBED_RPM / RAG_EMBED_TPM).
+
+
+def _embed_batch(texts: List[str]) -> List[List[float]]:
+    return embedding_model.embed_documents(texts)
+
+
+def _embed_and_insert(vector_store: "Chroma", chunks: List["Document"], file_hash: str):
+    """
+    Embed `chunks` in batches of EMBED_BATCH_SIZE on up to EMBED_CONCURRENCY threads and
+    write each batch into the collection as soon as its embeddings arrive.
+    """
+    starts = range(0, len(chunks), EMBED_BATCH_SIZE)
+    pool = ThreadPoolExecutor(max_workers=EMBED_CONCURRENCY)
+    try:
+        futures = {
+            pool.submit(_embed_batch, [c.page_content for c in chunks[start:start + EMBED_BATCH_SIZE]]): start
+            for start in starts
+        }
+        for future in as_completed(futures):
+            start = futures[future]
+            batch = chunks[start:start + EMBED_BATCH_SIZE]
+            # Writes stay on this thread; only the embedding requests run concurrently.
+            # Deterministic ids make a retried index of the same document overwrite, not duplicate.
+            vector_store._collection.upsert(
+                ids=[f"{file_hash}:{start + i}" for i in range(len(batch))],
+                embeddings=future.result(),
+                documents=[c.page_content for c in batch],
+                metadatas=[c.metadata for c in batch],
+            )
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
 
-try:
 
-    embedding_model = GoogleGenerativeAIEmbeddings(model="gemini-embedding-001")
-    chroma_client = chromadb.PersistentClient(path=PERSIST_DIRECTORY)
+def _vector_store(collection_name: str) -> "Chroma":
+    from langchain_chroma import Chroma
 
-except Exception as e:
-    print(
-        f"⚠️ RAG Pipeline Error: Failed to initialize embeddings or ChromaDB. Ensure GOOGLE_API_KEY is set. Error: {e}")
-    embedding_model = None
-    chroma_client = None
+    return Chroma(
+        client=chroma_client,
+        collection_name=collection_name,
+        embedding_function=embedding_model,
+    )
 
 
+def _find_existing_index(file_hash: str) -> Optional["Chroma"]:
+    collection_name = lookup_document(file_hash)
+    if collection_name:
+        return _vector_store(collection_name)
 
-def index_document(text: str, file_hash: str) -> Optional[Chroma]:
-    if not embedding_model or not chroma_client:
+    # Per-document collections created before the registry existed.
+    legacy_name = f"{COLLECTION_NAME}_{file_hash}"
+    try:
+        collection = chroma_client.get_collection(legacy_name)
+    except Exception:
         return None
+    register_document(file_hash, legacy_name, collection.count())
+    return _vector_store(legacy_name)
 
-    doc_collection_name = f"{COLLECTION_NAME}_{file_hash}"
 
+def _existing_index(file_hash: str) -> Optional["Chroma"]:
     try:
-        if doc_collection_name in [c.name for c in chroma_client.list_collections()]:
+        with span("rag.lookup"):
+            vector_store = _find_existing_index(file_hash)
+        if vector_store:
             print(f"ChromaDB: Found existing index for document {file_hash}.")
-            vector_store = Chroma(
-                client=chroma_client,
-                collection_name=doc_collection_name,
-                embedding_function=embedding_model,
-            )
+            incr("rag_index_hits")
             return vector_store
 
     except Exception as e:
         print(f"ChromaDB Check Error: {e}. Proceeding to re-index.")
+    return None
+
+
+@traced("rag.index")
+def index_document(text: str, file_hash: str) -> Optional["Chroma"]:
+    """
+    Index `text` unless `file_hash` is already indexed. Concurrent calls for the same
+    file hash, from any thread or process, share one indexing run instead of each
+    embedding the document.
+    """
+    if not _init_backends():
+        return None
+
+    return get_single_flight().do(f"index:{file_hash}", lambda: _build_index(text, file_hash),
+                                  lookup=lambda: _existing_index(file_hash))
+
+
+def _build_index(text: str, file_hash: str) -> Optional["Chroma"]:
+    from langchain_core.documents import Document
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
 
     text_splitter = RecursiveCharacterTextSplitter(
         chunk_size=1000,
         chunk_overlap=200,
-        separators=["\n\n", "\n", ".", "!", "?", ",", " ", ""]
+        separators=["\n\n", "\n", ".", "!", "?", ",", " ", ""],
+        add_start_index=True,  # lets retrieval merge overlapping neighbours back together
     )
     doc = Document(page_content=text, metadata={"file_hash": file_hash})
-    chunks = text_splitter.split_documents([doc])
+    with span("rag.split", chars=len(text)):
+        chunks = text_splitter.split_documents([doc])
+    incr("rag_chunks_indexed", len(chunks))
 
     if not chunks:
         return None
 
+    # Shared mode keeps every document in one collection, told apart by `file_hash` metadata.
+    doc_collection_name = COLLECTION_NAME if SHARED_COLLECTION else f"{COLLECTION_NAME}_{file_hash}"
+
     try:
-        vector_store = Chroma.from_documents(
-            documents=chunks,
-            embedding=embedding_model,
-            client=chroma_client,
-            collection_name=doc_collection_name,
-        )
+        vector_store = _vector_store(doc_collection_name)
+        with span("rag.embed_insert", chunks=len(chunks)):
+            _embed_and_insert(vector_store, chunks, file_hash)
+        register_document(file_hash, doc_collection_name, len(chunks))
         print(f"ChromaDB: Created new index for document {file_hash} with {len(chunks)} chunks.")
         return vector_store
     except Exception as e:
@@ -68,18 +247,66 @@ def index_document(text: str, file_hash: str) -> Optional[Chroma]:
         return None
 
 
-def retrieve_context(vector_store: Chroma, topic: str, k: int = 5) -> str:
+@traced("rag.retrieve")
+def retrieve_context(vector_store: "Chroma", topic: str, k: int = 5, file_hash: Optional[str] = None,
+                     token_budget: int = CONTEXT_TOKEN_BUDGET) -> str:
+    """
+    Fetch MMR_FETCH_FACTOR * k candidates by similarity to `topic`, keep `k` of them by
+    maximal marginal relevance and return them merged and packed into `token_budget`.
+    """
+    if not vector_store:
+        return ""
+
+    search_filter = {"file_hash": file_hash} if file_hash else None
+    query_vector = vector_store.embeddings.embed_query(topic)
+    result = vector_store._collection.query(
+        query_embeddings=[query_vector],
+        n_results=k * MMR_FETCH_FACTOR,
+        where=search_filter,
+        include=["documents", "metadatas", "embeddings"],
+    )
+    candidates = [
+        Chunk(text, (metadata or {}).get("start_index"), vector)
+        for text, metadata, vector in zip(result["documents"][0], result["metadatas"][0], result["embeddings"][0])
+    ]
+    incr("rag_chunks_retrieved", min(k, len(candidates)))
 
+    context = build_context(query_vector, candidates, k, token_budget)
+    incr("rag_context_tokens", estimate_tokens(context) if context else 0)
+    return context
+
+
+@traced("rag.coverage")
+def sample_coverage_context(vector_store: "Chroma", k: int, file_hash: Optional[str] = None,
+                            token_budget: int = CONTEXT_TOKEN_BUDGET) -> str:
+    """
+    Context representative of the whole document: k-means over the stored embeddings
+    of all its chunks, one chunk per cluster, packed into `token_budget`.
+    """
     if not vector_store:
         return ""
 
-    docs = vector_store.similarity_search(topic, k=k)
+    search_filter = {"file_hash": file_hash} if file_hash else None
+    result = vector_store._collection.get(where=search_filter, include=["documents", "metadatas", "embeddings"])
+    chunks = [
+        Chunk(text, (metadata or {}).get("start_index"), vector)
+        for text, metadata, vector in zip(result["documents"], result["metadatas"], result["embeddings"])
+    ]
+    incr("rag_chunks_retrieved", min(k, len(chunks)))
 
-    context = "\n---\n".join([doc.page_content for doc in docs])
+    context = build_coverage_context(chunks, k, token_budget)
+    incr("rag_context_tokens", estimate_tokens(context) if context else 0)
     return context
 
 
-def run_rag_pipeline(text: str, topic: str, file_hash: str) -> str:
+# "auto": coverage sampling when no topic is given, similarity search for a topic.
+# "similarity" always searches (using the start of the text as the query when there is no topic).
+RETRIEVAL_MODE = os.environ.get("RAG_RETRIEVAL_MODE", "auto")
+
+
+@traced("rag.pipeline")
+def run_rag_pipeline(text: str, topic: str, file_hash: str, k: int = 5,
+                     token_budget: int = CONTEXT_TOKEN_BUDGET) -> str:
     """
     Main function to run the RAG process with persistence check.
     """
@@ -93,17 +320,24 @@ def run_rag_pipeline(text: str, topic: str, file_hash: str) -> str:
 
         if vector_store:
             # 2. Retrieve relevant context
-            query = topic if topic else text[:100]
-            retrieved_context = retrieve_context(vector_store, query, k=5)
+            if topic or RETRIEVAL_MODE == "similarity":
+                query = topic if topic else text[:100]
+                retrieved_context = retrieve_context(vector_store, query, k=k, file_hash=file_hash,
+                                                     token_budget=token_budget)
+            else:
+                retrieved_context = sample_coverage_context(vector_store, k, file_hash=file_hash,
+                                                            token_budget=token_budget)
 
             if retrieved_context:
-                print(f"RAG: Successfully retrieved {len(retrieved_context.split('---'))} context chunks.")
+                print(f"RAG: Successfully retrieved {len(retrieved_context.split(CONTEXT_SEPARATOR))} context spans.")
                 return retrieved_context
             else:
                 print("RAG: Retrieval failed, falling back to full text (max 4000 chars).")
+                incr("rag_fallbacks")
                 return text[:4000]  # Fallback
         else:
             print("RAG: Indexing failed, falling back to full text (max 4000 chars).")
+            incr("rag_fallbacks")
             return text[:4000]  # Fallback
 
     return ""
\ No newline at end of file
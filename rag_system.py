@@ -1,31 +1,109 @@
-import re
-from typing import List
-import faiss
+import json
+import mmap
+import time
+from typing import List, Sequence
 import numpy as np
-from sentence_transformers import SentenceTransformer
-from langchain_google_genai import ChatGoogleGenerativeAI
+from embedding_cache import get_embedding_cache
+from lazy_imports import LazyModule
+from llm_gateway import GatewayChatModel
+from quiz_generation import JSON_FORMAT_INSTRUCTIONS, QUIZ_OUTPUT_FORMAT, parse_quiz_output
+from tracing import incr, span, traced
 import os
 api_key = os.environ.get("GOOGLE_API_KEY")
 
-llm = ChatGoogleGenerativeAI(
-    model="gemini-2.5-flash",
-    temperature=0,
-    max_output_tokens=512,
-    timeout=120
-)
+# Imported on first use: loading faiss and sentence-transformers (torch) dominates start-up.
+faiss = LazyModule("faiss")
+sentence_transformers = LazyModule("sentence_transformers")
+
+_llm = None
+
+
+def get_llm():
+    global _llm
+    if _llm is None:
+        from langchain_google_genai import ChatGoogleGenerativeAI
+
+        _llm = GatewayChatModel(ChatGoogleGenerativeAI(
+            model="gemini-2.5-flash",
+            temperature=0,
+            max_output_tokens=512,
+            timeout=120
+        ))
+    return _llm
 
-import time
 
 def safe_chat(prompt):
-    retries = 3
-    delay = 10
-    for i in range(retries):
+    # Rate limiting and retries with jittered backoff happen in the LLM gateway.
+    return get_llm().predict(prompt)
+
+
+# ------------------- Index Types -------------------
+# flat: exact search. ivf_flat / ivf_pq: inverted lists, trained on the stored
+# embeddings, tuned with `nprobe`. hnsw: graph index, tuned with `ef_search`.
+# IVF types are served by an exact IndexFlatL2 until there are TRAIN_POINTS_PER_CENTROID
+# vectors per centroid (what FAISS's k-means asks for; fewer gives centroids fit on a
+# tiny early sample and poor recall), and are retrained from all stored vectors
+# whenever the corpus has grown RETRAIN_GROWTH times past the set they were trained on.
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+PQ_CODEBOOK_SIZE = 256  # centroids per sub-quantizer of 8-bit PQ codes
+TRAIN_POINTS_PER_CENTROID = 39
+RETRAIN_GROWTH = 4
+
+
+# ------------------- On-disk Chunk Store -------------------
+INDEX_FILE = "index.faiss"
+EMBEDDINGS_FILE = "embeddings.npy"
+CHUNKS_FILE = "chunks.bin"
+OFFSETS_FILE = "chunk_offsets.npy"
+META_FILE = "meta.json"
+
+
+class MappedChunks(Sequence):
+    """
+    Read-only list of chunk texts backed by a memory-mapped UTF-8 file.
+    `offsets[i]:offsets[i + 1]` is the byte range of chunk i.
+    """
+
+    def __init__(self, chunks_path: str, offsets_path: str):
+        self.offsets = np.load(offsets_path, mmap_mode="r")
+        self._file = open(chunks_path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("chunk index out of range")
+        return self._data[int(self.offsets[i]):int(self.offsets[i + 1])].decode("utf-8")
+
+
+def _write_chunks(chunks: Sequence[str], chunks_path: str, offsets_path: str):
+    offsets = np.zeros(len(chunks) + 1, dtype="int64")
+    with open(chunks_path, "wb") as f:
+        for i, chunk in enumerate(chunks):
+            data = chunk.encode("utf-8")
+            f.write(data)
+            offsets[i + 1] = offsets[i] + len(data)
+    np.save(offsets_path, offsets)
+
+
+def _read_index_mmap(path: str):
+    """Read a FAISS index, memory-mapping its data when this FAISS build supports it."""
+    for flag_name in ("IO_FLAG_MMAP_IFC", "IO_FLAG_MMAP"):
+        flag = getattr(faiss, flag_name, None)
+        if flag is None:
+            continue
         try:
-            return llm.predict(prompt)
-        except Exception as e:
-            print(f"Retry {i+1} failed: {e}")
-            time.sleep(delay)
-    raise Exception("All retries failed")
+            return faiss.read_index(path, flag)
+        except RuntimeError:
+            continue
+    return faiss.read_index(path)
 
 
 class RAG:
@@ -33,18 +111,48 @@ class RAG:
     RAG pipeline components: Chunking, Embedding, Indexing, Retrieval, and Generation.
     """
 
-    def __init__(self, embedding_model_name: str = "sentence-transformers/all-MiniLM-L6-v2", chunk_size = 200):
-        self.documents: List[str] = []
-        self.embeddings: List[np.ndarray] = []
+    def __init__(self, embedding_model_name: str = "sentence-transformers/all-MiniLM-L6-v2", chunk_size = 200,
+                 index_type: str = "flat", nlist: int = 100, pq_m: int = 8, hnsw_m: int = 32,
+                 nprobe: int = 8, ef_search: int = 64, use_embedding_cache: bool = True):
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"index_type must be one of {INDEX_TYPES}, got {index_type!r}")
+        self.documents: Sequence[str] = []
         self.chunk_size = chunk_size
-        self.model = SentenceTransformer(embedding_model_name)
+        self.embedding_model_name = embedding_model_name
+        self.index_type = index_type
+        self.nlist = nlist
+        self.pq_m = pq_m
+        self.hnsw_m = hnsw_m
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.use_embedding_cache = use_embedding_cache
+        self._model = None  # SentenceTransformer, loaded on first use
         self.index = None  # FAISS Index
+        self._index_read_only = False  # True while the index is memory-mapped from disk
+        self._trained_size = 0  # vectors the IVF index was trained on (0: not trained yet)
+        # Growable float32 buffer; only the first `_size` rows are in use.
+        self._embeddings = np.empty((0, 0), dtype='float32')
+        self._size = 0
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        """All stored embeddings as a (num_chunks, dim) float32 view."""
+        return self._embeddings[:self._size]
+
+    @property
+    def model(self):
+        if self._model is None:
+            self._model = sentence_transformers.SentenceTransformer(self.embedding_model_name)
+        return self._model
 
     def clear_documents(self):
         """Clears all stored documents, embeddings, and the FAISS index."""
         self.documents = []
-        self.embeddings = []
+        self._embeddings = np.empty((0, 0), dtype='float32')
+        self._size = 0
         self.index = None
+        self._index_read_only = False
+        self._trained_size = 0
 
     @staticmethod
     def _chunk_text(text: str, size: int) -> List[str]:
@@ -57,20 +165,140 @@ class RAG:
             chunks.append(" ".join(words[i:i + size]))
         return chunks
 
-    def _embed_chunks(self, chunks: List[str]) -> List[np.ndarray]:
-        """Convert a list of text chunks into embeddings."""
+    def _embed_chunks(self, chunks: List[str]) -> np.ndarray:
+        """Convert a list of text chunks into a (len(chunks), dim) float32 array."""
         if not chunks:
-            return []
+            return np.empty((0, 0), dtype='float32')
+        if self.use_embedding_cache:
+            # Only chunks never seen with this model are encoded (and the model is
+            # only loaded if there are any).
+            vectors = get_embedding_cache().embed(
+                self.embedding_model_name, chunks,
+                lambda missing: self.model.encode(missing, convert_to_numpy=True))
+            return np.vstack([np.frombuffer(v, dtype='float32') for v in vectors])
         embeddings = self.model.encode(chunks, convert_to_numpy=True)
-        return embeddings.tolist()
+        return np.ascontiguousarray(embeddings, dtype='float32')
+
+    def _append_embeddings(self, new_embeddings: np.ndarray):
+        """Copy new rows into the buffer, doubling its capacity when it is full."""
+        count, dim = new_embeddings.shape
+        capacity = self._embeddings.shape[0]
+        needed = self._size + count
+
+        if self._embeddings.shape[1] != dim:
+            if self._size:
+                raise ValueError(f"Embedding dimension changed from {self._embeddings.shape[1]} to {dim}.")
+            capacity = 0
+
+        if needed > capacity:
+            grown = np.empty((max(needed, 2 * capacity, 64), dim), dtype='float32')
+            if self._size:
+                grown[:self._size] = self._embeddings[:self._size]
+            self._embeddings = grown
+
+        self._embeddings[self._size:needed] = new_embeddings
+        self._size = needed
+
+    def _new_index(self, dim: int):
+        """Create an empty (possibly untrained) FAISS index of the configured type."""
+        if self.index_type == "ivf_flat":
+            return faiss.index_factory(dim, f"IVF{self.nlist},Flat")
+        if self.index_type == "ivf_pq":
+            return faiss.index_factory(dim, f"IVF{self.nlist},PQ{self.pq_m}")
+        if self.index_type == "hnsw":
+            return faiss.index_factory(dim, f"HNSW{self.hnsw_m}")
+        return faiss.IndexFlatL2(dim)
+
+    def _min_train_size(self) -> int:
+        """Vectors needed before an IVF index is trained (the largest k-means run times 39)."""
+        if self.index_type == "ivf_pq":
+            return TRAIN_POINTS_PER_CENTROID * max(self.nlist, PQ_CODEBOOK_SIZE)
+        if self.index_type == "ivf_flat":
+            return TRAIN_POINTS_PER_CENTROID * self.nlist
+        return 0
+
+    def _awaiting_training(self) -> bool:
+        """True while an IVF index type is still served by the exact fallback index."""
+        return self._min_train_size() > 0 and (self.index is None or isinstance(self.index, faiss.IndexFlat))
+
+    def _needs_retraining(self) -> bool:
+        """True once a trained IVF index covers RETRAIN_GROWTH times the vectors it was trained on."""
+        return self._trained_size > 0 and self._size >= RETRAIN_GROWTH * self._trained_size
+
+    def _apply_search_params(self):
+        if self.index is None:
+            return
+        if hasattr(self.index, "nprobe"):
+            self.index.nprobe = self.nprobe
+        if hasattr(self.index, "hnsw"):
+            self.index.hnsw.efSearch = self.ef_search
+
+    def set_search_params(self, nprobe: int = None, ef_search: int = None):
+        """Tune the accuracy/latency trade-off of IVF (`nprobe`) and HNSW (`ef_search`) indexes."""
+        if nprobe is not None:
+            self.nprobe = nprobe
+        if ef_search is not None:
+            self.ef_search = ef_search
+        self._apply_search_params()
 
     def _build_index(self):
-        """Build FAISS index for fast similarity search."""
-        if self.embeddings:
-            embeddings_array = np.array(self.embeddings, dtype='float32')
-            dim = embeddings_array.shape[1]
-            self.index = faiss.IndexFlatL2(dim)
-            self.index.add(embeddings_array)
+        """
+        Build FAISS index for fast similarity search. IVF indexes are trained on all
+        stored embeddings; until there are enough of them to train on (see
+        `_min_train_size`), an exact IndexFlatL2 is used instead.
+        """
+        self.index = None
+        self._index_read_only = False
+        self._trained_size = 0
+        if not self._size:
+            return
+        data = np.ascontiguousarray(self.embeddings)
+        index = self._new_index(data.shape[1])
+        if not index.is_trained:
+            if self._size < self._min_train_size():
+                index = faiss.IndexFlatL2(data.shape[1])
+            else:
+                index.train(data)
+                self._trained_size = self._size
+        index.add(data)
+        self.index = index
+        self._apply_search_params()
+
+    def _add_to_index(self, new_embeddings: np.ndarray):
+        """Add only the new vectors to the live index, creating it on first use."""
+        if self.index is None:
+            self.index = self._new_index(new_embeddings.shape[1])
+            self._apply_search_params()
+        self.index.add(new_embeddings)
+
+    def add_documents(self, texts: List[str]):
+        """
+        Process many documents at once: Chunk -> Embed (one batch) -> Index.
+        """
+        # 1. Chunking
+        new_chunks = []
+        with span("rag_system.chunk", documents=len(texts)):
+            for text in texts:
+                new_chunks.extend(self._chunk_text(text, self.chunk_size))
+        if not new_chunks:
+            return
+        incr("rag_system_chunks", len(new_chunks))
+
+        # 2. Embedding
+        with span("rag_system.embed", chunks=len(new_chunks)):
+            new_embeddings = self._embed_chunks(new_chunks)
+
+        # 3. Store and Index (incrementally, existing vectors are not re-added)
+        if not isinstance(self.documents, list):
+            # Loaded from disk: switch to an in-memory copy before writing.
+            self.documents = list(self.documents)
+        self.documents.extend(new_chunks)
+        self._append_embeddings(new_embeddings)
+        with span("rag_system.index", index_type=self.index_type):
+            if self._index_read_only or self._awaiting_training() or self._needs_retraining():
+                self._build_index()
+            else:
+                self._add_to_index(new_embeddings)
 
     def add_document(self, text: str):
         """
@@ -78,29 +306,120 @@ class RAG:
         """
         if not text.strip():
             return
+        self.add_documents([text])
 
-        # 1. Chunking
-        new_chunks = self._chunk_text(text, self.chunk_size)
+    def save(self, directory: str):
+        """
+        Write the FAISS index, embedding matrix, chunk texts and chunk offsets to `directory`.
+        """
+        os.makedirs(directory, exist_ok=True)
+        path = lambda name: os.path.join(directory, name)
 
-        # 2. Embedding
-        new_embeddings = self._embed_chunks(new_chunks)
+        # Write to temporary names first so a concurrent load never sees a half-written index.
+        if self.index is not None:
+            faiss.write_index(self.index, path(INDEX_FILE + ".tmp"))
+        np.save(path(EMBEDDINGS_FILE + ".tmp.npy"), self.embeddings)
+        _write_chunks(self.documents, path(CHUNKS_FILE + ".tmp"), path(OFFSETS_FILE + ".tmp.npy"))
+        with open(path(META_FILE + ".tmp"), "w", encoding="utf-8") as f:
+            json.dump({
+                "embedding_model_name": self.embedding_model_name,
+                "chunk_size": self.chunk_size,
+                "num_chunks": len(self.documents),
+                "dim": int(self._embeddings.shape[1]),
+                "has_index": self.index is not None,
+                "index_type": self.index_type,
+                "nlist": self.nlist,
+                "pq_m": self.pq_m,
+                "hnsw_m": self.hnsw_m,
+                "nprobe": self.nprobe,
+                "ef_search": self.ef_search,
+                "trained_size": self._trained_size,
+            }, f)
 
-        # 3. Store and Index
-        self.documents.extend(new_chunks)
-        self.embeddings.extend(new_embeddings)
-        self._build_index()
+        if self.index is not None:
+            os.replace(path(INDEX_FILE + ".tmp"), path(INDEX_FILE))
+        os.replace(path(EMBEDDINGS_FILE + ".tmp.npy"), path(EMBEDDINGS_FILE))
+        os.replace(path(CHUNKS_FILE + ".tmp"), path(CHUNKS_FILE))
+        os.replace(path(OFFSETS_FILE + ".tmp.npy"), path(OFFSETS_FILE))
+        os.replace(path(META_FILE + ".tmp"), path(META_FILE))
 
+    @classmethod
+    def load(cls, directory: str) -> "RAG":
+        """
+        Load an index written by `save`. Embeddings, chunks and (where FAISS allows) the
+        index are memory-mapped, so processes loading the same directory share one copy
+        of the pages. The SentenceTransformer is only loaded when a query is embedded.
+        """
+        path = lambda name: os.path.join(directory, name)
+        with open(path(META_FILE), encoding="utf-8") as f:
+            meta = json.load(f)
+
+        index_params = {key: meta[key] for key in ("index_type", "nlist", "pq_m", "hnsw_m", "nprobe", "ef_search")
+                        if key in meta}
+        rag = cls(embedding_model_name=meta["embedding_model_name"], chunk_size=meta["chunk_size"], **index_params)
+        rag.documents = MappedChunks(path(CHUNKS_FILE), path(OFFSETS_FILE))
+        if meta["num_chunks"]:
+            rag._embeddings = np.load(path(EMBEDDINGS_FILE), mmap_mode="r")
+            rag._size = rag._embeddings.shape[0]
+        if meta.get("has_index"):
+            rag.index = _read_index_mmap(path(INDEX_FILE))
+            rag._index_read_only = True
+            rag._apply_search_params()
+            # Indexes saved before trained_size was recorded count as trained on all their vectors.
+            rag._trained_size = meta.get("trained_size", rag._size if rag.index.ntotal and rag.index.is_trained
+                                         and not isinstance(rag.index, faiss.IndexFlat) else 0)
+        return rag
+
+    @traced("rag_system.retrieve")
     def retrieve(self, query: str, top_k: int = 3) -> str:
         """Retrieve top_k most similar chunks from the FAISS index."""
-        if not self.index or not self.documents:
+        if self.index is None or not self.documents:
             return ""
 
         query_emb = self.model.encode([query])[0].astype('float32')
         distances, indices = self.index.search(np.array([query_emb]), top_k)
 
-        retrieved_docs = [self.documents[i] for i in indices[0] if i < len(self.documents)]
+        retrieved_docs = [self.documents[i] for i in indices[0] if 0 <= i < len(self.documents)]
         return "\n".join(retrieved_docs)
 
+    def evaluate_recall(self, queries: List[str] = None, top_k: int = 10, num_samples: int = 100,
+                        seed: int = 0) -> dict:
+        """
+        Compare the configured index against exact search over the stored embeddings.
+        Without `queries`, a random sample of stored chunks is used as the query set.
+        Returns recall@top_k and the per-query latency of both searches.
+        """
+        if self.index is None or not self._size:
+            return {"recall": 0.0, "top_k": top_k, "num_queries": 0,
+                    "index_ms_per_query": 0.0, "exact_ms_per_query": 0.0}
+
+        if queries:
+            query_embs = self._embed_chunks(queries)
+        else:
+            rng = np.random.default_rng(seed)
+            sample = rng.choice(self._size, size=min(num_samples, self._size), replace=False)
+            query_embs = np.ascontiguousarray(self.embeddings[np.sort(sample)])
+        top_k = min(top_k, self._size)
+
+        start = time.perf_counter()
+        _, index_ids = self.index.search(query_embs, top_k)
+        index_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        _, exact_ids = faiss.knn(query_embs, np.ascontiguousarray(self.embeddings), top_k)
+        exact_seconds = time.perf_counter() - start
+
+        hits = sum(len(set(found[found >= 0]) & set(truth)) for found, truth in zip(index_ids, exact_ids))
+        num_queries = len(query_embs)
+        return {
+            "recall": hits / (num_queries * top_k),
+            "top_k": top_k,
+            "num_queries": num_queries,
+            "index_ms_per_query": 1000 * index_seconds / num_queries,
+            "exact_ms_per_query": 1000 * exact_seconds / num_queries,
+        }
+
+    @traced("rag_system.generate_mcqs")
     def generate_mcqs(self, topic: str, num_mcqs: int = 5) -> List[dict]:
         """Generate MCQs using retrieved context and the LLM."""
 
@@ -113,16 +432,10 @@ class RAG:
         else:
             prompt_context = f"Context:\n{context[:4000]}"
 
-        prompt = f"""
-            Generate {num_mcqs} multiple-choice questions (MCQs) related to the given information.
-            Follow the constraints strictly:
-            1. Don't give any introductory or concluding sentences. Start directly with the first question.
-            2. Do not use phrases like "provided text," "given text," "as in the text," "According to the text," or "as mentioned in the text."
-            3. Instead, formulate the question naturally as if you are knowledgeable about the topic.
-            4.Remove unnecessary context.
-            5.Only send the text you need for quiz generation.
-            6.Use shorter questions and answers when possible.
-
+        if QUIZ_OUTPUT_FORMAT == "json":
+            format_instructions = JSON_FORMAT_INSTRUCTIONS
+        else:
+            format_instructions = """
             Example format:
             Q1. What is AI?
             A) Option 1
@@ -131,29 +444,25 @@ class RAG:
             D) Option 4
             Answer: B
             Q2. ...
+"""
 
+        prompt = f"""
+            Generate {num_mcqs} multiple-choice questions (MCQs) related to the given information.
+            Follow the constraints strictly:
+            1. Don't give any introductory or concluding sentences. Start directly with the first question.
+            2. Do not use phrases like "provided text," "given text," "as in the text," "According to the text," or "as mentioned in the text."
+            3. Instead, formulate the question naturally as if you are knowledgeable about the topic.
+            4.Remove unnecessary context.
+            5.Only send the text you need for quiz generation.
+            6.Use shorter questions and answers when possible.
+            {format_instructions}
             {prompt_context}
             """
         try:
-            result = llm.invoke(prompt)
+            result = get_llm().invoke(prompt)
             output_text = getattr(result, "content", None) or getattr(result, "output_text", "")
         except Exception:
             output_text = ""
 
-        # Clean and parse the output text
-        output_text = re.sub(r'(?i)q(uestion)?\s*\d*[.:]\s*', 'Q', output_text)
-        output_text = output_text.replace("Option ", "").replace("Answer:", "Answer:")
-
-        pattern = r"""Q\s*([\s\S]*?)\s*A[\)\.:]\s*([\s\S]*?)\s*B[\)\.:]\s*([\s\S]*?)\s*C[\)\.:]\s*([\s\S]*?)\s*D[\)\.:]\s*([\s\S]*?)\s*Answer[:\s]*([ABCD])"""
-        matches = re.findall(pattern, output_text, re.IGNORECASE | re.VERBOSE)
-
-        mcqs = []
-        for q in matches:
-            question_text, A, B, C, D, ans = q
-            clean = lambda s: re.sub(r'\s+', ' ', s).strip()
-            mcqs.append({
-                "question": clean(question_text),
-                "options": {"A": clean(A), "B": clean(B), "C": clean(C), "D": clean(D)},
-                "answer": ans.strip().upper()
-            })
-        return mcqs
\ No newline at end of file
+        # JSON objects are validated one by one; free-form text falls back to the regex parser.
+        return parse_quiz_output(output_text)
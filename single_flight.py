@@ -0,0 +1,141 @@
+import os
+import time
+import uuid
+import sqlite3
+import threading
+from concurrent.futures import Future
+from typing import Callable, Dict, Optional, TypeVar
+from sqlite_store import ThreadConnections, connect, data_path
+
+SINGLE_FLIGHT_DB_PATH = os.environ.get("SINGLE_FLIGHT_DB_PATH") or data_path("single_flight.db")
+LEASE_SECONDS = 120  # renewed while the work runs; a crashed holder's lease lapses after this
+POLL_SECONDS = 0.5  # how often a process waiting on another process's lease checks again
+
+T = TypeVar("T")
+
+
+class _Abandoned(Exception):
+    """Set on the shared Future when the leader stopped without a result or an error."""
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent work. Within a process, callers of `do` with the
+    same key wait on the first caller's Future. Across processes, the first caller
+    takes a lease row in SQLite; callers elsewhere poll `lookup` (the persistent store
+    the work writes to, e.g. the document registry or the quiz cache) until the lease
+    holder's result shows up there or the lease is released, then take over if needed.
+    """
+
+    def __init__(self, path: str = SINGLE_FLIGHT_DB_PATH, lease_seconds: float = LEASE_SECONDS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.owner = f"{os.getpid()}:{uuid.uuid4().hex}"
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        self._conns = ThreadConnections(path)
+        self._conn().execute("""
+            CREATE TABLE IF NOT EXISTS leases (
+                key TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires REAL NOT NULL
+            )
+        """)
+
+    def _conn(self) -> sqlite3.Connection:
+        return self._conns.get()
+
+    # ------------------- Leases -------------------
+    def _try_lease(self, key: str) -> bool:
+        now = time.time()
+        cur = self._conn().execute(
+            "INSERT INTO leases (key, owner, expires) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET owner=excluded.owner, expires=excluded.expires "
+            "WHERE leases.expires < ?", (key, self.owner, now + self.lease_seconds, now))
+        return cur.rowcount == 1
+
+    def _renew(self, key: str, done: threading.Event):
+        conn = connect(self.path, autocommit=True)
+        try:
+            while not done.wait(self.lease_seconds / 3):
+                conn.execute("UPDATE leases SET expires=? WHERE key=? AND owner=?",
+                             (time.time() + self.lease_seconds, key, self.owner))
+        finally:
+            conn.close()
+
+    def _release(self, key: str):
+        self._conn().execute("DELETE FROM leases WHERE key=? AND owner=?", (key, self.owner))
+
+    def _run_leased(self, key: str, fn: Callable[[], T], lookup: Optional[Callable[[], Optional[T]]]) -> T:
+        while True:
+            if lookup:
+                found = lookup()
+                if found is not None:
+                    return found
+            if self._try_lease(key):
+                break
+            time.sleep(POLL_SECONDS)  # another process is doing this work
+
+        done = threading.Event()
+        threading.Thread(target=self._renew, args=(key, done), daemon=True).start()
+        try:
+            return fn()
+        finally:
+            done.set()
+            self._release(key)
+
+    # ------------------- Public API -------------------
+    def do(self, key: str, fn: Callable[[], T], lookup: Optional[Callable[[], Optional[T]]] = None) -> T:
+        """
+        Return `fn()`, running it at most once at a time per key across threads and
+        processes. `lookup` returns an already stored result (or None) and is checked
+        before running `fn`, including after waiting for another process.
+        """
+        while True:
+            with self._lock:
+                future = self._inflight.get(key)
+                leader = future is None
+                if leader:
+                    future = self._inflight[key] = Future()
+            if leader:
+                break
+            try:
+                return future.result()
+            except _Abandoned:
+                continue  # the leader was interrupted, not failed: take over
+
+        # The key is released before the Future is resolved, so a waiter that has to
+        # take over never finds the abandoned Future again.
+        try:
+            result = self._run_leased(key, fn, lookup)
+        except Exception as e:
+            # Errors of the work itself are shared with every waiter.
+            self._forget(key)
+            future.set_exception(e)
+            raise
+        except BaseException:
+            # Control flow of the leader's own thread (KeyboardInterrupt, a Streamlit
+            # rerun) is not the waiters' business; one of them runs the work instead.
+            self._forget(key)
+            future.set_exception(_Abandoned(key))
+            raise
+        self._forget(key)
+        future.set_result(result)
+        return result
+
+    def _forget(self, key: str):
+        with self._lock:
+            del self._inflight[key]
+
+
+_single_flight: Optional[SingleFlight] = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight() -> SingleFlight:
+    """Process-wide shared instance."""
+    global _single_flight
+    with _single_flight_lock:
+        if _single_flight is None:
+            _single_flight = SingleFlight()
+        return _single_flight
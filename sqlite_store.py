@@ -0,0 +1,149 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict
+from tracing import incr
+
+# Shared SQLite plumbing: where the app's files live, how connections are opened and
+# configured, and the least-recently-used table both SQLite caches are built on.
+
+DATA_DIR = os.environ.get("QUIZ_DATA_DIR", "data")  # every database, cache and spool directory
+BUSY_TIMEOUT_SECONDS = 30  # how long a statement waits for another writer's lock
+POOL_MAX_IDLE = 8  # idle connections kept open for reuse
+LRU_EVICT_TO = 0.9  # a full cache is cut to this fraction of max_entries, so eviction does not run on every insert
+
+
+# ------------------- Data Directory -------------------
+def data_path(name: str) -> str:
+    """
+    Path of `name` under DATA_DIR. A file or directory left in the working directory
+    by an older version is used where it is instead, so existing data is not orphaned.
+    """
+    path = os.path.join(DATA_DIR, name)
+    if not os.path.exists(path) and os.path.exists(name):
+        return name
+    return path
+
+
+# ------------------- Connections -------------------
+def connect(path: str, autocommit: bool = False) -> sqlite3.Connection:
+    """
+    Open `path` in WAL mode, creating its directory. The connection may be handed to
+    another thread (only one uses it at a time); with `autocommit` every statement
+    commits on its own unless wrapped in an explicit BEGIN.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_SECONDS, check_same_thread=False,
+                           isolation_level=None if autocommit else "")
+    conn.execute("PRAGMA journal_mode=WAL")  # readers no longer block the writer
+    conn.execute("PRAGMA synchronous=NORMAL")  # safe with WAL, far fewer fsyncs
+    conn.execute("PRAGMA cache_size=-8000")  # 8 MB page cache per connection
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA foreign_keys=ON")
+    return conn
+
+
+class ThreadConnections:
+    """One autocommit connection per thread, opened on first use."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def get(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = connect(self.path, autocommit=True)
+        return conn
+
+
+class ConnectionPool:
+    """
+    Reusable connections from `connect`. A connection is only ever used by the thread
+    that borrowed it, so it can be reused across Streamlit's script threads.
+    """
+
+    def __init__(self, path: str, max_idle: int = POOL_MAX_IDLE):
+        self.path = path
+        self.max_idle = max_idle
+        self._idle = queue.LifoQueue()
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = connect(self.path)
+        try:
+            yield conn
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            if self._idle.qsize() < self.max_idle:
+                self._idle.put(conn)
+            else:
+                conn.close()
+
+
+# ------------------- LRU Table -------------------
+class LRUTable:
+    """
+    Base for a SQLite cache whose table has a `last_used` column: counts hits and
+    misses (also as `<metric>_hits`/`<metric>_misses` in tracing) and, past
+    `max_entries` rows, deletes the least recently used. Subclasses set `table` and
+    `metric` and create the table in `_create`; writes go through `_write`.
+    """
+    table = ""
+    metric = ""
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._pool = ConnectionPool(path)
+        self._lock = threading.Lock()  # serializes writers, so _count stays exact
+        with self._pool.connection() as conn:
+            self._create(conn)
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{self.table}_last_used ON {self.table}(last_used)")
+            conn.commit()
+            self._count = conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def _create(self, conn: sqlite3.Connection):
+        raise NotImplementedError
+
+    @contextmanager
+    def _write(self):
+        """A pooled connection held under the writer lock; committed on exit."""
+        with self._lock, self._pool.connection() as conn:
+            yield conn
+            conn.commit()
+
+    def _added(self, conn: sqlite3.Connection, rows: int):
+        """Account for `rows` new rows (negative for deletions), evicting if the table is full."""
+        self._count += rows
+        if self._count > self.max_entries:
+            excess = self._count - int(self.max_entries * LRU_EVICT_TO)
+            cur = conn.execute(f"DELETE FROM {self.table} WHERE rowid IN "
+                               f"(SELECT rowid FROM {self.table} ORDER BY last_used LIMIT ?)", (excess,))
+            self._count -= max(cur.rowcount, 0)
+
+    def _touch(self, conn: sqlite3.Connection, where: str, keys):
+        """Mark the rows matching `where` for each parameter tuple in `keys` as used now."""
+        conn.executemany(f"UPDATE {self.table} SET last_used=? WHERE {where}",
+                         [(time.time(), *key) for key in keys])
+
+    def _record(self, hits: int, misses: int):
+        self.hits += hits
+        self.misses += misses
+        incr(f"{self.metric}_hits", hits)
+        incr(f"{self.metric}_misses", misses)
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "entries": self._count}
@@ -0,0 +1,35 @@
+import numpy as np
+
+from context_builder import coverage_select
+
+
+def _assert_full_selection(picks, k: int, n: int):
+    assert len(picks) == min(k, n)
+    assert len(set(picks)) == len(picks)
+    assert all(0 <= i < n for i in picks)
+
+
+def test_coverage_select_returns_k_picks_from_duplicate_vectors():
+    # 12 chunks but only 3 distinct embeddings: k-means can form at most 3 clusters.
+    distinct = np.eye(3, 8, dtype="float32")
+    vectors = np.repeat(distinct, 4, axis=0)
+
+    picks = coverage_select(vectors, 5)
+
+    _assert_full_selection(picks, 5, len(vectors))
+    # Every distinct embedding is covered before any duplicate is added.
+    assert {tuple(vectors[i]) for i in picks[:3]} == {tuple(row) for row in distinct}
+
+
+def test_coverage_select_returns_k_picks_when_all_vectors_are_identical():
+    vectors = np.ones((10, 4), dtype="float32")
+    _assert_full_selection(coverage_select(vectors, 4), 4, 10)
+
+
+def test_coverage_select_with_zero_vectors():
+    vectors = np.zeros((6, 4), dtype="float32")
+    _assert_full_selection(coverage_select(vectors, 3), 3, 6)
+
+
+def test_coverage_select_with_fewer_vectors_than_k():
+    assert coverage_select(np.eye(3, dtype="float32"), 5) == [0, 1, 2]
@@ -0,0 +1,54 @@
+import json
+
+import pytest
+
+from quiz_generation import JSONMCQStreamParser, parse_mcqs_json
+
+
+def _question(i: int, **overrides) -> dict:
+    question = {
+        "question": f"Question {i}?",
+        "options": {label: f"Option {label}{i}" for label in "ABCD"},
+        "answer": "ABCD"[i % 4],
+    }
+    question.update(overrides)
+    return question
+
+
+def _stream(text: str, piece: int) -> list:
+    parser = JSONMCQStreamParser()
+    parsed = []
+    for i in range(0, len(text), piece):
+        parsed.extend(parser.feed(text[i:i + piece]))
+    return parsed + parser.close()
+
+
+QUESTIONS = [
+    _question(0),
+    _question(1, question='Which set is {a, b} or "c}" \\ neither?'),
+    _question(2, options=["x}", "{y", "z", "w"]),
+    _question(3),
+]
+
+OUTPUTS = {
+    "array": json.dumps(QUESTIONS, indent=2),
+    "prose": "Here are your questions:\n[" + ",\n(continuing)\n".join(map(json.dumps, QUESTIONS)) + "]",
+    "broken object": "[" + json.dumps(QUESTIONS[0]) + ', {"question": }, ' + json.dumps(QUESTIONS[1]) + "]",
+    "wrapper": json.dumps({"questions": QUESTIONS}),
+}
+
+
+@pytest.mark.parametrize("piece", [1, 7, 16, 100000])
+@pytest.mark.parametrize("name", sorted(OUTPUTS))
+def test_stream_parser_matches_whole_output_parser(name, piece):
+    text = OUTPUTS[name]
+    assert _stream(text, piece) == parse_mcqs_json(text)
+
+
+def test_stream_parser_returns_each_question_as_it_closes():
+    text = json.dumps(QUESTIONS)
+    first_end = text.index(json.dumps(QUESTIONS[1])) - 2  # just past the first object's '}'
+    parser = JSONMCQStreamParser()
+
+    assert parser.feed(text[:first_end - 1]) == []
+    assert [q["question"] for q in parser.feed(text[first_end - 1:first_end])] == ["Question 0?"]
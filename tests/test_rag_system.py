@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+from rag_system import RAG
+
+
+def _rows(start: int, count: int, dim: int = 4) -> np.ndarray:
+    return np.arange(start * dim, (start + count) * dim, dtype="float32").reshape(count, dim)
+
+
+def test_first_append_allocates_buffer_with_embedding_dim():
+    rag = RAG(use_embedding_cache=False)
+    rag._append_embeddings(_rows(0, 3))
+
+    assert rag.embeddings.shape == (3, 4)
+    np.testing.assert_array_equal(rag.embeddings, _rows(0, 3))
+
+
+def test_appends_keep_earlier_rows_when_buffer_grows():
+    rag = RAG(use_embedding_cache=False)
+    rag._append_embeddings(_rows(0, 60))
+    capacity = rag._embeddings.shape[0]
+    rag._append_embeddings(_rows(60, capacity))  # forces at least one reallocation
+
+    assert rag._embeddings.shape[0] > capacity
+    np.testing.assert_array_equal(rag.embeddings, _rows(0, 60 + capacity))
+
+
+def test_dimension_change_is_rejected_once_rows_are_stored():
+    rag = RAG(use_embedding_cache=False)
+    rag._append_embeddings(_rows(0, 2))
+    with pytest.raises(ValueError):
+        rag._append_embeddings(np.zeros((1, 8), dtype="float32"))
+
+
+def test_clear_documents_resets_buffer_for_a_new_dimension():
+    rag = RAG(use_embedding_cache=False)
+    rag._append_embeddings(_rows(0, 2))
+    rag.clear_documents()
+    rag._append_embeddings(np.ones((2, 8), dtype="float32"))
+
+    assert rag.embeddings.shape == (2, 8)
+
+
+def test_two_documents_can_be_added_and_retrieved():
+    pytest.importorskip("faiss")
+    from benchmarks.fakes import FakeSentenceTransformer
+
+    rag = RAG(use_embedding_cache=False)
+    rag._model = FakeSentenceTransformer(dim=32)
+    rag.add_document("mitochondria produce energy " * 100)
+    rag.add_document("photosynthesis happens in chloroplasts " * 100)
+
+    assert rag.embeddings.shape[0] == len(rag.documents)
+    assert rag.retrieve("mitochondria produce energy", top_k=2)
+
+
+def _add_vectors(rag: RAG, vectors: np.ndarray):
+    # add_documents without the encoder: the same store-and-index steps on given vectors.
+    rag.documents = list(rag.documents) + [""] * len(vectors)
+    rag._append_embeddings(vectors)
+    if rag._awaiting_training() or rag._needs_retraining():
+        rag._build_index()
+    else:
+        rag._add_to_index(vectors)
+
+
+def test_ivf_waits_for_enough_training_vectors_and_retrains_as_corpus_grows():
+    faiss = pytest.importorskip("faiss")
+    from rag_system import RETRAIN_GROWTH, TRAIN_POINTS_PER_CENTROID
+
+    rng = np.random.default_rng(0)
+    rag = RAG(index_type="ivf_flat", nlist=4, use_embedding_cache=False)
+    threshold = TRAIN_POINTS_PER_CENTROID * 4
+
+    _add_vectors(rag, rng.normal(size=(threshold - 1, 8)).astype("float32"))
+    assert isinstance(rag.index, faiss.IndexFlat)
+
+    _add_vectors(rag, rng.normal(size=(1, 8)).astype("float32"))
+    assert isinstance(rag.index, faiss.IndexIVFFlat)
+    assert rag._trained_size == threshold
+
+    _add_vectors(rag, rng.normal(size=(threshold, 8)).astype("float32"))
+    assert rag._trained_size == threshold  # grown, but not RETRAIN_GROWTH times yet
+
+    _add_vectors(rag, rng.normal(size=((RETRAIN_GROWTH - 2) * threshold, 8)).astype("float32"))
+    assert rag._trained_size == RETRAIN_GROWTH * threshold
+    assert rag.index.ntotal == rag._size
@@ -0,0 +1,198 @@
+import os
+import gzip
+import json
+import zlib
+import hashlib
+import multiprocessing
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, Iterator, List, Optional, Tuple
+from sqlite_store import data_path
+from tracing import incr, span
+
+EXTRACT_WORKERS = int(os.environ.get("EXTRACT_WORKERS", str(os.cpu_count() or 1)))
+PAGES_PER_TASK = 8
+PARALLEL_MIN_PAGES = 24  # below this, starting worker processes costs more than it saves
+EXTRACTION_CACHE_DIR = os.environ.get("EXTRACTION_CACHE_DIR") or data_path(".extraction_cache")
+EXTRACTION_CACHE_MAX_BYTES = int(os.environ.get("EXTRACTION_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# ------------------- PDF Worker Process -------------------
+_worker_reader = None
+
+
+def _init_pdf_worker(file_bytes: bytes):
+    """Parse the PDF once per worker process instead of once per task."""
+    global _worker_reader
+    from PyPDF2 import PdfReader
+
+    _worker_reader = PdfReader(BytesIO(file_bytes))
+
+
+def _extract_pdf_range(page_range: Tuple[int, int]) -> List[str]:
+    start, stop = page_range
+    return [_worker_reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+
+# ------------------- Page Generators -------------------
+def iter_pdf_pages(file_bytes: bytes, workers: int = EXTRACT_WORKERS) -> Iterator[str]:
+    """
+    Yield the text of each PDF page in order. Large PDFs are split into page ranges
+    that are extracted in parallel on a process pool. The pool uses the "spawn" start
+    method: this runs inside the multi-threaded Streamlit server, where forking could
+    copy locks held by other threads into the children and deadlock them.
+    """
+    from PyPDF2 import PdfReader
+
+    reader = PdfReader(BytesIO(file_bytes))
+    num_pages = len(reader.pages)
+
+    if workers <= 1 or num_pages < PARALLEL_MIN_PAGES:
+        for page in reader.pages:
+            yield page.extract_text() or ""
+        return
+
+    ranges = [(start, min(start + PAGES_PER_TASK, num_pages)) for start in range(0, num_pages, PAGES_PER_TASK)]
+    with ProcessPoolExecutor(max_workers=min(workers, len(ranges)), mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_pdf_worker, initargs=(file_bytes,)) as pool:
+        for page_texts in pool.map(_extract_pdf_range, ranges):
+            yield from page_texts
+
+
+def iter_docx_paragraphs(file_bytes: bytes) -> Iterator[str]:
+    """DOCX files have no fixed pages, so paragraphs are the unit that is streamed."""
+    from docx import Document
+
+    doc = Document(BytesIO(file_bytes))
+    for p in doc.paragraphs:
+        yield p.text
+
+
+def iter_pages(file_name: str, file_bytes: bytes, workers: int = EXTRACT_WORKERS) -> Iterator[str]:
+    """Per-page (PDF) or per-paragraph (DOCX) text of an uploaded file, in document order."""
+    name = file_name.lower()
+    if name.endswith(".pdf"):
+        return iter_pdf_pages(file_bytes, workers)
+    if name.endswith(".docx"):
+        return iter_docx_paragraphs(file_bytes)
+    return iter(())
+
+
+def extract_text(file_name: str, file_bytes: bytes) -> str:
+    return "\n".join(iter_pages(file_name, file_bytes))
+
+
+# ------------------- Extraction Cache -------------------
+def hash_stream(fileobj: BinaryIO, chunk_size: int = HASH_CHUNK_SIZE) -> str:
+    """sha256 of a file object, read in chunks; the file is rewound afterwards."""
+    digest = hashlib.sha256()
+    for block in iter(lambda: fileobj.read(chunk_size), b""):
+        digest.update(block)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+class ExtractionCache:
+    """
+    Extracted text on disk, one gzip file per upload hash. The first line holds the
+    character offset at which each page starts, the rest is the text itself.
+    Least recently used files are removed once the directory exceeds `max_bytes`.
+    """
+
+    def __init__(self, directory: str = EXTRACTION_CACHE_DIR, max_bytes: int = EXTRACTION_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, file_hash: str) -> str:
+        return os.path.join(self.directory, f"{file_hash}.txt.gz")
+
+    def _read(self, file_hash: str) -> Optional[Tuple[List[int], str]]:
+        path = self._path(file_hash)
+        try:
+            with gzip.open(path, "rt", encoding="utf-8", newline="") as f:
+                offsets = json.loads(f.readline())
+                text = f.read()
+        except (OSError, ValueError, EOFError, zlib.error):
+            # Missing, truncated or corrupt files (a crash mid-write) are a cache miss.
+            return None
+        os.utime(path)  # mark as recently used
+        return offsets, text
+
+    def get_text(self, file_hash: str) -> Optional[str]:
+        entry = self._read(file_hash)
+        return entry[1] if entry else None
+
+    def get_pages(self, file_hash: str) -> Optional[List[str]]:
+        entry = self._read(file_hash)
+        if not entry:
+            return None
+        offsets, text = entry
+        # Pages were joined with "\n", so each page ends one character before the next starts.
+        ends = [start - 1 for start in offsets[1:]] + [len(text)]
+        return [text[start:end] for start, end in zip(offsets, ends)]
+
+    def put(self, file_hash: str, pages: List[str]) -> str:
+        offsets, position = [], 0
+        for page in pages:
+            offsets.append(position)
+            position += len(page) + 1
+        text = "\n".join(pages)
+
+        path = self._path(file_hash)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8", newline="", compresslevel=6) as f:
+            f.write(json.dumps(offsets))
+            f.write("\n")
+            f.write(text)
+        os.replace(tmp_path, path)
+        self._evict()
+        return text
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".txt.gz"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+_cache: Optional[ExtractionCache] = None
+
+
+def get_extraction_cache() -> ExtractionCache:
+    global _cache
+    if _cache is None:
+        _cache = ExtractionCache()
+    return _cache
+
+
+def extract_text_cached(file_name: str, fileobj: BinaryIO, workers: int = EXTRACT_WORKERS) -> Tuple[str, str]:
+    """
+    Return (file_hash, text) for an uploaded file. Known uploads are served from the
+    extraction cache without reading the whole file into memory or parsing it again.
+    New uploads are extracted completely before returning: the cache stores the whole
+    text, and chunking splits it in one pass.
+    `workers` caps the page-extraction processes (1 when the caller is itself a worker).
+    """
+    with span("extract", file_name=file_name) as attrs:
+        file_hash = hash_stream(fileobj)
+        cache = get_extraction_cache()
+        text = cache.get_text(file_hash)
+        attrs["cache_hit"] = text is not None
+        incr("extraction_cache_hits" if text is not None else "extraction_cache_misses")
+        if text is None:
+            pages = list(iter_pages(file_name, fileobj.read(), workers))
+            fileobj.seek(0)
+            text = cache.put(file_hash, pages)
+            incr("extracted_pages", len(pages))
+    return file_hash, text
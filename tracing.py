@@ -0,0 +1,194 @@
+import os
+import json
+import time
+import uuid
+import bisect
+import random
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+# Timing spans and counters for the quiz pipeline. Spans feed a latency histogram per
+# stage (exported in Prometheus text format) and a sample reservoir per stage used
+# for p50/p90/p99; with QUIZ_TRACE_LOG set, every finished span is also appended to
+# that file as one JSON line carrying its trace and parent ids.
+
+TRACE_LOG_PATH = os.environ.get("QUIZ_TRACE_LOG", "")
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+RESERVOIR_SIZE = 2048  # latency samples kept per stage for quantiles
+
+_current_span = contextvars.ContextVar("quiz_current_span", default=None)
+_lock = threading.Lock()
+_log_lock = threading.Lock()
+
+
+class _Stage:
+    __slots__ = ("buckets", "count", "sum", "errors", "samples")
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.errors = 0
+        self.samples: List[float] = []
+
+    def observe(self, seconds: float, failed: bool):
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.errors += failed
+        # Reservoir sampling keeps a uniform sample of all observations in bounded memory.
+        if len(self.samples) < RESERVOIR_SIZE:
+            self.samples.append(seconds)
+        else:
+            slot = random.randrange(self.count)
+            if slot < RESERVOIR_SIZE:
+                self.samples[slot] = seconds
+
+
+_stages: Dict[str, _Stage] = {}
+_counters: Dict[str, float] = {}
+
+
+# ------------------- Recording -------------------
+def incr(name: str, value: float = 1):
+    """Add to a named counter, e.g. incr("rag_chunks", len(chunks))."""
+    if value:
+        with _lock:
+            _counters[name] = _counters.get(name, 0) + value
+
+
+def observe(stage: str, seconds: float, failed: bool = False):
+    with _lock:
+        _stages.setdefault(stage, _Stage()).observe(seconds, failed)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """
+    Time the enclosed block as stage `name`. The yielded dict can be filled with more
+    attributes (counts, cache hits) that go into the JSON log line.
+    """
+    parent = _current_span.get()
+    record = {"trace_id": parent["trace_id"] if parent else uuid.uuid4().hex[:16],
+              "span_id": uuid.uuid4().hex[:16], "parent_id": parent["span_id"] if parent else None,
+              "name": name, "attrs": attrs}
+    token = _current_span.set(record)
+    start = time.perf_counter()
+    error = None
+    try:
+        yield attrs
+    except BaseException as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        _current_span.reset(token)
+        observe(name, seconds, failed=error is not None)
+        if TRACE_LOG_PATH:
+            record.update(start=time.time() - seconds, duration_ms=round(seconds * 1000, 3), error=error)
+            _write_log(record)
+
+
+def traced(name: str):
+    """Decorator form of `span`; keeps the wrapped signature (LangGraph inspects it for `config`)."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _write_log(record: Dict):
+    line = json.dumps(record, default=str)
+    with _log_lock:
+        with open(TRACE_LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+# ------------------- Export -------------------
+def _quantile(sorted_samples: List[float], q: float) -> Optional[float]:
+    if not sorted_samples:
+        return None
+    return sorted_samples[min(len(sorted_samples) - 1, int(q * len(sorted_samples)))]
+
+
+def snapshot() -> Dict:
+    """Counters plus count / mean / p50 / p90 / p99 latency per stage, as plain JSON data."""
+    with _lock:
+        stages = {}
+        for name, stage in _stages.items():
+            samples = sorted(stage.samples)
+            stages[name] = {
+                "count": stage.count, "errors": stage.errors,
+                "mean_ms": stage.sum / stage.count * 1000 if stage.count else None,
+                **{f"p{int(q * 100)}_ms": (_quantile(samples, q) or 0) * 1000 for q in (0.5, 0.9, 0.99)},
+            }
+        return {"stages": stages, "counters": dict(_counters)}
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def prometheus_text() -> str:
+    """All stages, counters and LLM gateway metrics in the Prometheus text exposition format."""
+    lines = ["# HELP quiz_stage_duration_seconds Time spent per pipeline stage.",
+             "# TYPE quiz_stage_duration_seconds histogram"]
+    with _lock:
+        for name, stage in sorted(_stages.items()):
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + (float("inf"),), stage.buckets):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'quiz_stage_duration_seconds_bucket{{stage="{_label(name)}",le="{le}"}} {cumulative}')
+            lines.append(f'quiz_stage_duration_seconds_sum{{stage="{_label(name)}"}} {stage.sum}')
+            lines.append(f'quiz_stage_duration_seconds_count{{stage="{_label(name)}"}} {stage.count}')
+        lines += ["# HELP quiz_stage_errors_total Stage runs that raised.", "# TYPE quiz_stage_errors_total counter"]
+        lines += [f'quiz_stage_errors_total{{stage="{_label(n)}"}} {s.errors}' for n, s in sorted(_stages.items())]
+        lines += ["# HELP quiz_events_total Pipeline counters (chunks, tokens, cache hits, parse failures).",
+                  "# TYPE quiz_events_total counter"]
+        lines += [f'quiz_events_total{{event="{_label(n)}"}} {v}' for n, v in sorted(_counters.items())]
+
+    from llm_gateway import metrics as gateway_metrics
+
+    gateway = gateway_metrics()
+    if gateway:
+        lines += ["# HELP quiz_llm_gateway LLM gateway counters per endpoint.", "# TYPE quiz_llm_gateway gauge"]
+        for endpoint, values in sorted(gateway.items()):
+            lines += [f'quiz_llm_gateway{{endpoint="{_label(endpoint)}",metric="{key}"}} {value}'
+                      for key, value in sorted(values.items())]
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """GET /metrics (Prometheus text) and GET /metrics.json (snapshot)."""
+
+    def do_GET(self):
+        if self.path.startswith("/metrics.json"):
+            body, content_type = json.dumps(snapshot()).encode("utf-8"), "application/json"
+        elif self.path.startswith("/metrics"):
+            body, content_type = prometheus_text().encode("utf-8"), "text/plain; version=0.0.4"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_metrics(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Serve /metrics from a background thread of this process (e.g. the Streamlit server)."""
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server